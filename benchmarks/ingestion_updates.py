@@ -0,0 +1,197 @@
+"""
+Benchmark de recepción de updates: long polling frente a webhook.
+
+Levanta en local una Bot API falsa (Tornado) y una Application de PTB con un
+único MessageHandler, inyecta updates a un ritmo fijo y mide la latencia
+desde que el update "existe" en Telegram hasta que el handler lo recibe:
+
+- polling: el update se encola en la Bot API falsa y el Updater lo recoge
+  con getUpdates (long polling, igual que run_polling).
+- webhook: la Bot API falsa hace POST al servidor de Updater.start_webhook
+  (el mismo que usa run_webhook) con la cabecera del secret token.
+
+Uso:
+    python -m benchmarks.ingestion_updates [--updates 500] [--ritmo 200]
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+import httpx
+from tornado.web import Application as AppTornado, RequestHandler
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+TOKEN = "123456:benchmark"
+PUERTO_API = 8781
+PUERTO_WEBHOOK = 8782
+RUTA_WEBHOOK = "telegram"
+
+
+'''
+-----------------------------------------------------------------------------------
+Bot API falsa
+-----------------------------------------------------------------------------------
+'''
+
+
+class BotApiFalsa:
+    """getMe, getUpdates (long polling), set/deleteWebhook y sendMessage."""
+
+    def __init__(self):
+        self.pendientes = []
+        self.hay_updates = asyncio.Event()
+        self.webhook = None
+
+    def update(self, update_id):
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+                "text": "ping"
+            }
+        }
+
+    async def get_updates(self, offset, espera):
+        self.pendientes = [u for u in self.pendientes if u["update_id"] >= offset]
+        if not self.pendientes:
+            self.hay_updates.clear()
+            try:
+                await asyncio.wait_for(self.hay_updates.wait(), espera)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # CancelledError: el Updater cerró la conexión al pararse
+                pass
+        return list(self.pendientes)
+
+    def encolar(self, update):
+        self.pendientes.append(update)
+        self.hay_updates.set()
+
+    def servidor(self):
+        api = self
+
+        class _Metodo(RequestHandler):
+            def _parametro(self, nombre, defecto=None):
+                # PTB manda los números y objetos en JSON y los textos tal cual
+                valor = self.get_body_argument(nombre, None)
+                if valor is None:
+                    return defecto
+                try:
+                    return json.loads(valor)
+                except ValueError:
+                    return valor
+
+            async def post(self, token, metodo):
+                if metodo == "getMe":
+                    resultado = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+                elif metodo == "getUpdates":
+                    resultado = await api.get_updates(
+                        self._parametro("offset", 0) or 0, self._parametro("timeout", 0) or 0)
+                elif metodo == "setWebhook":
+                    api.webhook = self._parametro("url")
+                    resultado = True
+                elif metodo == "deleteWebhook":
+                    api.webhook = None
+                    resultado = True
+                else:
+                    resultado = True
+                self.write({"ok": True, "result": resultado})
+
+        return AppTornado([(r"/bot([^/]+)/(\w+)", _Metodo)])
+
+
+'''
+-----------------------------------------------------------------------------------
+Medición
+-----------------------------------------------------------------------------------
+'''
+
+
+async def _medir(modo, total, ritmo):
+    api = BotApiFalsa()
+    servidor = api.servidor().listen(PUERTO_API, address="127.0.0.1")
+
+    inyectado = {}
+    latencias = []
+    terminado = asyncio.Event()
+
+    async def _handler(update, context):
+        latencias.append(time.perf_counter() - inyectado[update.update_id])
+        if len(latencias) == total:
+            terminado.set()
+
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f"http://127.0.0.1:{PUERTO_API}/bot")
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.ALL, _handler))
+
+    secreto = secrets.token_urlsafe(16)
+    await app.initialize()
+    await app.start()
+    if modo == "polling":
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+    else:
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=PUERTO_WEBHOOK, url_path=RUTA_WEBHOOK,
+            webhook_url=f"http://127.0.0.1:{PUERTO_WEBHOOK}/{RUTA_WEBHOOK}",
+            secret_token=secreto)
+
+    async with httpx.AsyncClient() as cliente:
+        if modo == "webhook":
+            # Sin el secret token el servidor rechaza el update
+            rechazo = await cliente.post(api.webhook, json=api.update(0))
+            assert rechazo.status_code == 403, rechazo.status_code
+
+        inicio = time.perf_counter()
+        envios = []
+        for update_id in range(1, total + 1):
+            update = api.update(update_id)
+            inyectado[update_id] = time.perf_counter()
+            if modo == "polling":
+                api.encolar(update)
+            else:
+                # Como Telegram, sin esperar a la respuesta para mandar el siguiente
+                envios.append(asyncio.create_task(cliente.post(
+                    api.webhook, json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": secreto})))
+            await asyncio.sleep(1 / ritmo)
+        await asyncio.gather(*envios)
+        await asyncio.wait_for(terminado.wait(), 30)
+        duracion = time.perf_counter() - inicio
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    servidor.stop()
+
+    latencias.sort()
+    return {
+        "modo": modo,
+        "updates": total,
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1] * 1000,
+        "max_ms": latencias[-1] * 1000,
+        "updates_s": total / duracion
+    }
+
+
+async def _principal(total, ritmo):
+    for modo in ("polling", "webhook"):
+        r = await _medir(modo, total, ritmo)
+        print(f"{r['modo']:8} {r['updates']} updates: p50 {r['p50_ms']:.2f} ms, "
+              f"p95 {r['p95_ms']:.2f} ms, max {r['max_ms']:.2f} ms, {r['updates_s']:.0f} updates/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--ritmo", type=float, default=200, help="updates por segundo inyectados")
+    args = parser.parse_args()
+    asyncio.run(_principal(args.updates, args.ritmo))
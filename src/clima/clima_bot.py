@@ -1,5 +1,4 @@
 from datetime import datetime, time
-from bson import ObjectId
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CommandHandler,
@@ -10,14 +9,18 @@ from telegram.ext import (
     MessageHandler
 )
 
-from src.database.models import (
+from src.database.async_models import (
     get_user,
-    obtener_recordatorios_clima,
+    pagina_recordatorios_clima,
     eliminar_recordatorio_clima,
     actualizar_recordatorio_clima,
-    coleccion_clima
+    obtener_recordatorio_clima
+)
+from src.clima.gestion_clima import (
+    obtener_clima_actual,
+    programar_recordatorio_diario_clima,
+    cancelar_recordatorio_diario_clima
 )
-from src.clima.gestion_clima import obtener_clima_actual, programar_recordatorio_diario_clima
 from src.clima.recordatorio_clima import (
     STATE_DIARIO_PROVINCIA,
     STATE_DIARIO_HORA,
@@ -27,6 +30,7 @@ from src.clima.recordatorio_clima import (
     seleccionar_zona_diario
 )
 from src.utils.logger import setup_logger
+from src.utils.paginacion import codificar_cursor, decodificar_cursor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -88,13 +92,13 @@ async def comando_clima(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Recordatorio diario, Gestionar recordatorios).
     '''
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
     if context.args:
         provincia = " ".join(context.args)
-        texto = obtener_clima_actual(provincia)
+        texto = await obtener_clima_actual(provincia)
         await update.message.reply_text(texto)
         return ConversationHandler.END
     else:
@@ -219,7 +223,7 @@ async def mostrar_clima_actual(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     provincia = query.data[len("provincia_"):]
-    texto = obtener_clima_actual(provincia)
+    texto = await obtener_clima_actual(provincia)
     await query.edit_message_text(texto)
     return ConversationHandler.END
 
@@ -250,25 +254,79 @@ async def submenu_gestionar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
+# callback_data de los botones de página: climapag_<modo>_<sentido>_<cursor>
+# modo: "v" (ver), "e" (eliminar) o "d" (editar); sentido: "s" o "a"
+PREFIJO_PAGINA_CLIMA = "climapag_"
+
+
+def _hora_str(rec):
+    hora_cfg = rec.get("hora_config", {})
+    return f"{hora_cfg.get('hora', '--')}:{hora_cfg.get('minuto', '--')} {hora_cfg.get('zona', '')}"
+
+
+def _botones_navegacion_clima(pagina, modo):
+    fila = []
+    if pagina["anterior"] is not None:
+        fila.append(InlineKeyboardButton(
+            "« Anterior", callback_data=f"{PREFIJO_PAGINA_CLIMA}{modo}_a_{codificar_cursor(pagina['anterior'])}"))
+    if pagina["siguiente"] is not None:
+        fila.append(InlineKeyboardButton(
+            "Siguiente »", callback_data=f"{PREFIJO_PAGINA_CLIMA}{modo}_s_{codificar_cursor(pagina['siguiente'])}"))
+    return [fila] if fila else []
+
+
+def _pagina_ver(pagina):
+    texto = "Tus recordatorios de clima:\n\n"
+    for rec in pagina["documentos"]:
+        texto += f"- {rec.get('provincia', '')} @ {_hora_str(rec)}\n"
+    botones = _botones_navegacion_clima(pagina, "v")
+    if not botones:
+        return texto, None, ConversationHandler.END
+    return texto, InlineKeyboardMarkup(botones), STATE_GESTIONAR_VER
+
+
+def _pagina_con_botones(pagina, modo, prefijo, texto, estado):
+    botones = []
+    for rec in pagina["documentos"]:
+        botones.append([InlineKeyboardButton(
+            f"{rec.get('provincia', '')} @ {_hora_str(rec)}",
+            callback_data=f"{prefijo}{rec['_id']}")])
+    botones += _botones_navegacion_clima(pagina, modo)
+    return texto, InlineKeyboardMarkup(botones), estado
+
+
+def _pagina_eliminar(pagina):
+    return _pagina_con_botones(pagina, "e", "clima_eliminar_",
+                               "Selecciona el recordatorio que deseas eliminar:",
+                               STATE_GESTIONAR_ELIMINAR)
+
+
+def _pagina_editar(pagina):
+    return _pagina_con_botones(pagina, "d", "clima_editar_",
+                               "Selecciona el recordatorio que deseas editar:",
+                               STATE_GESTIONAR_EDITAR)
+
+
+_PAGINA_POR_MODO = {"v": _pagina_ver, "e": _pagina_eliminar, "d": _pagina_editar}
+
+
+async def _mostrar_pagina_clima(query, modo, user_id, cursor=None, hacia_atras=False):
+    pagina = await pagina_recordatorios_clima(user_id, cursor=cursor, hacia_atras=hacia_atras)
+    if not pagina["documentos"]:
+        await query.edit_message_text("No tienes recordatorios de clima.")
+        return ConversationHandler.END
+
+    texto, teclado, estado = _PAGINA_POR_MODO[modo](pagina)
+    await query.edit_message_text(texto, reply_markup=teclado)
+    return estado
+
+
 async def mostrar_recordatorios_clima_list(query, context):
     '''
     Muestra en un mensaje la lista de recordatorios de clima existentes,
-    sin permitir ninguna acción (sólo lectura).
+    sin permitir ninguna acción (sólo lectura), una página cada vez.
     '''
-    chat_id = query.message.chat_id
-    lista = obtener_recordatorios_clima(chat_id)
-    if not lista:
-        await query.edit_message_text("No tienes recordatorios de clima.")
-        return ConversationHandler.END
-
-    texto = "Tus recordatorios de clima:\n\n"
-    for rec in lista:
-        prov = rec.get("provincia", "")
-        hora_cfg = rec.get("hora_config", {})
-        hora_str = f"{hora_cfg.get('hora', '--')}:{hora_cfg.get('minuto', '--')} {hora_cfg.get('zona', '')}"
-        texto += f"- {prov} @ {hora_str}\n"
-    await query.edit_message_text(texto)
-    return ConversationHandler.END
+    return await _mostrar_pagina_clima(query, "v", query.message.chat_id)
 
 
 async def mostrar_recordatorios_clima_eliminar(query, context):
@@ -276,25 +334,7 @@ async def mostrar_recordatorios_clima_eliminar(query, context):
     Muestra un listado de botones con cada recordatorio de clima,
     para que el usuario seleccione cuál desea eliminar.
     '''
-    user_id = query.from_user.id
-    lista = obtener_recordatorios_clima(user_id)
-    if not lista:
-        await query.edit_message_text("No tienes recordatorios de clima.")
-        return ConversationHandler.END
-
-    botones = []
-    for rec in lista:
-        _id = str(rec["_id"])
-        prov = rec.get("provincia", "")
-        hora_cfg = rec.get("hora_config", {})
-        hora_str = f"{hora_cfg.get('hora', '--')}:{hora_cfg.get('minuto', '--')} {hora_cfg.get('zona', '')}"
-        texto = f"{prov} @ {hora_str}"
-        botones.append([InlineKeyboardButton(
-            texto, callback_data=f"clima_eliminar_{_id}")])
-
-    teclado = InlineKeyboardMarkup(botones)
-    await query.edit_message_text("Selecciona el recordatorio que deseas eliminar:", reply_markup=teclado)
-    return STATE_GESTIONAR_ELIMINAR
+    return await _mostrar_pagina_clima(query, "e", query.from_user.id)
 
 
 async def eliminar_recordatorio_clima_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -303,8 +343,9 @@ async def eliminar_recordatorio_clima_callback(update: Update, context: ContextT
     data = query.data
     if data.startswith("clima_eliminar_"):
         rec_id = data[len("clima_eliminar_"):]
-        resultado = eliminar_recordatorio_clima(rec_id)
+        resultado = await eliminar_recordatorio_clima(rec_id)
         if resultado.deleted_count > 0:
+            cancelar_job_clima(context, rec_id)
             await query.edit_message_text("Recordatorio eliminado.")
         else:
             await query.edit_message_text("No se pudo eliminar el recordatorio.")
@@ -318,25 +359,19 @@ async def mostrar_recordatorios_clima_editar(query, context):
     Muestra un listado de recordatorios de clima para que el usuario
     seleccione cuál quiere editar (cambiando hora y zona).
     '''
-    user_id = query.from_user.id
-    lista = obtener_recordatorios_clima(user_id)
-    if not lista:
-        await query.edit_message_text("No tienes recordatorios de clima.")
-        return ConversationHandler.END
+    return await _mostrar_pagina_clima(query, "d", query.from_user.id)
 
-    botones = []
-    for rec in lista:
-        _id = str(rec["_id"])
-        prov = rec.get("provincia", "")
-        hora_cfg = rec.get("hora_config", {})
-        hora_str = f"{hora_cfg.get('hora', '--')}:{hora_cfg.get('minuto', '--')} {hora_cfg.get('zona', '')}"
-        texto = f"{prov} @ {hora_str}"
-        botones.append([InlineKeyboardButton(
-            texto, callback_data=f"clima_editar_{_id}")])
 
-    teclado = InlineKeyboardMarkup(botones)
-    await query.edit_message_text("Selecciona el recordatorio que deseas editar:", reply_markup=teclado)
-    return STATE_GESTIONAR_EDITAR
+async def paginar_recordatorios_clima(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    '''
+    Callback de los botones Anterior / Siguiente de los tres listados.
+    '''
+    query = update.callback_query
+    await query.answer()
+    modo, sentido, cursor = query.data[len(PREFIJO_PAGINA_CLIMA):].split("_", 2)
+    user_id = query.message.chat_id if modo == "v" else query.from_user.id
+    return await _mostrar_pagina_clima(
+        query, modo, user_id, cursor=decodificar_cursor(cursor), hacia_atras=(sentido == "a"))
 
 
 async def editar_recordatorio_clima_seleccionado(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -438,15 +473,15 @@ async def editar_recordatorio_clima_zona(update: Update, context: ContextTypes.D
             "zona": zona
         }
     }
-    actualizar_recordatorio_clima(rec_id, cambios)
+    await actualizar_recordatorio_clima(rec_id, cambios)
 
     # 2) Cancelar el job anterior
     cancelar_job_clima(context, rec_id)
 
     # 3) Leer doc recién editado, reprogramar
-    doc = coleccion_clima.find_one({"_id": ObjectId(rec_id)})
+    doc = await obtener_recordatorio_clima(rec_id)
     if doc:
-        chat_id = doc["chat_id"]
+        chat_id = doc["user_id"]
         provincia = doc["provincia"]
         hora_cfg = doc["hora_config"]
         nombre = doc["nombre_usuario"]
@@ -470,12 +505,11 @@ async def editar_recordatorio_clima_zona(update: Update, context: ContextTypes.D
 
 def cancelar_job_clima(context, record_id):
     """
-    Recorre los jobs en context.job_queue y elimina
-    el que coincida con el record_id en job.data.
+    Saca la suscripción del grupo del DespachadorClima en el que está
+    (O(1), sin recorrer toda la cola). Si el grupo queda vacío se
+    cancela su job.
     """
-    for job in context.job_queue.jobs():
-        if job.data and job.data.get("record_id") == record_id:
-            job.schedule_removal()
+    cancelar_recordatorio_diario_clima(context, record_id)
 
 
 ''' CONVERSATION HANDLER '''
@@ -503,13 +537,21 @@ conv_handler_clima = ConversationHandler(
             CallbackQueryHandler(
                 submenu_gestionar, pattern="^(gestionar_ver|gestionar_eliminar|gestionar_editar)$")
         ],
+        STATE_GESTIONAR_VER: [
+            CallbackQueryHandler(
+                paginar_recordatorios_clima, pattern=f"^{PREFIJO_PAGINA_CLIMA}")
+        ],
         STATE_GESTIONAR_ELIMINAR: [
             CallbackQueryHandler(
-                eliminar_recordatorio_clima_callback, pattern="^clima_eliminar_")
+                eliminar_recordatorio_clima_callback, pattern="^clima_eliminar_"),
+            CallbackQueryHandler(
+                paginar_recordatorios_clima, pattern=f"^{PREFIJO_PAGINA_CLIMA}")
         ],
         STATE_GESTIONAR_EDITAR: [
             CallbackQueryHandler(
-                editar_recordatorio_clima_seleccionado, pattern="^clima_editar_")
+                editar_recordatorio_clima_seleccionado, pattern="^clima_editar_"),
+            CallbackQueryHandler(
+                paginar_recordatorios_clima, pattern=f"^{PREFIJO_PAGINA_CLIMA}")
         ],
         STATE_GESTIONAR_EDITAR_HORA: [
             MessageHandler(filters.TEXT & ~filters.COMMAND,
@@ -524,5 +566,8 @@ conv_handler_clima = ConversationHandler(
                        context: update.message.reply_text("Operación cancelada."))
     ],
     per_user=True,
-    per_chat=True
+    per_chat=True,
+    # Estado guardado en MongoDB (PersistenciaMongo)
+    name="conv_clima",
+    persistent=True
 )
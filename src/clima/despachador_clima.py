@@ -0,0 +1,163 @@
+import logging
+import weakref
+from datetime import datetime, timedelta, timezone
+from src.scheduler.registro_jobs import get_registro_jobs, TIPO_CLIMA
+from src.scheduler.snapshot import snapshot_scheduler
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_DIARIO = 24 * 3600
+
+
+'''
+-----------------------------------------------------------------------------------
+Despachador de recordatorios de clima agrupados por minuto de envío y provincia
+-----------------------------------------------------------------------------------
+'''
+
+
+class DespachadorClima:
+    """
+    Agrupa las suscripciones de clima por minuto de envío en UTC (hora, minuto)
+    y, dentro de cada minuto, por provincia. Se mantiene un único job diario
+    por minuto en lugar de un job por suscripción, y en cada envío se consulta
+    OpenWeather una vez por provincia. El número de jobs crece con las horas de
+    envío distintas y las llamadas a la API con las provincias, no con los
+    suscriptores.
+
+    Cada suscripción es un dict con "user_id", "provincia", "zona" y "nombre";
+    la zona sólo se usa al generar el mensaje de cada usuario.
+
+    Si se indica un 'observador' (ver SnapshotScheduler) se le avisa con
+    clima_agregado(...) y clima_quitado(record_id).
+    """
+
+    def __init__(self, job_queue, callback, observador=None):
+        self._job_queue = job_queue
+        self._callback = callback
+        self._observador = observador
+        # (hora, minuto) -> provincia -> record_id -> suscripción
+        self._grupos = {}
+        # record_id -> ((hora, minuto), provincia)
+        self._clave_por_record = {}
+
+    @staticmethod
+    def nombre_grupo(clave):
+        hora, minuto = clave
+        return f"clima_grupo_{hora:02d}{minuto:02d}"
+
+    def agregar(self, record_id, hora_utc, minuto_utc, suscripcion, crear_job=True):
+        """
+        Añade (o mueve) la suscripción al grupo de su minuto de envío.
+        Si el grupo no tenía job y crear_job es True, se programa.
+        """
+        record_id = str(record_id)
+        clave = (hora_utc, minuto_utc)
+        provincia = suscripcion["provincia"]
+
+        if self._clave_por_record.get(record_id) not in (None, (clave, provincia)):
+            self.quitar(record_id)
+
+        grupo = self._grupos.setdefault(clave, {})
+        grupo.setdefault(provincia, {})[record_id] = suscripcion
+        self._clave_por_record[record_id] = (clave, provincia)
+        if self._observador is not None:
+            self._observador.clima_agregado(record_id, hora_utc, minuto_utc, suscripcion)
+        if crear_job:
+            self._asegurar_job(clave)
+
+    def quitar(self, record_id):
+        """
+        Saca la suscripción de su grupo. Si el grupo se queda vacío,
+        se cancela su job. Devuelve True si la suscripción existía.
+        """
+        ubicacion = self._clave_por_record.pop(str(record_id), None)
+        if ubicacion is None:
+            return False
+        clave, provincia = ubicacion
+        grupo = self._grupos.get(clave, {})
+        suscripciones = grupo.get(provincia, {})
+        suscripciones.pop(str(record_id), None)
+        if not suscripciones:
+            grupo.pop(provincia, None)
+        if not grupo:
+            self._grupos.pop(clave, None)
+            get_registro_jobs(self._job_queue).cancelar(self.nombre_grupo(clave))
+        if self._observador is not None:
+            self._observador.clima_quitado(str(record_id))
+        return True
+
+    def suscriptores_por_provincia(self, clave):
+        """
+        Copia {provincia: [suscripciones]} del grupo (segura ante cambios
+        durante el envío).
+        """
+        return {provincia: list(suscripciones.values())
+                for provincia, suscripciones in self._grupos.get(clave, {}).items()}
+
+    def suscriptores(self, clave):
+        """Copia plana de las suscripciones del grupo."""
+        return [s for lista in self.suscriptores_por_provincia(clave).values() for s in lista]
+
+    def suscripcion(self, record_id):
+        """Suscripción del record_id, o None si no está en el despachador."""
+        ubicacion = self._clave_por_record.get(str(record_id))
+        if ubicacion is None:
+            return None
+        clave, provincia = ubicacion
+        return self._grupos[clave][provincia].get(str(record_id))
+
+    def record_ids(self):
+        """record_id de todas las suscripciones del despachador."""
+        return list(self._clave_por_record)
+
+    def claves(self):
+        """Claves (hora UTC, minuto UTC) de los grupos activos."""
+        return list(self._grupos)
+
+    def programar_grupos(self):
+        """Crea el job de todos los grupos que todavía no lo tienen."""
+        for clave in list(self._grupos):
+            self._asegurar_job(clave)
+
+    def _asegurar_job(self, clave):
+        registro = get_registro_jobs(self._job_queue)
+        nombre = self.nombre_grupo(clave)
+        if registro.contiene(nombre, TIPO_CLIMA):
+            return
+
+        hora, minuto = clave
+        now_utc = datetime.now(timezone.utc)
+        primera = now_utc.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        # Si ya pasó la hora de hoy, lo programamos para mañana
+        if primera <= now_utc:
+            primera += timedelta(days=1)
+
+        job = self._job_queue.run_repeating(
+            self._callback,
+            interval=INTERVALO_DIARIO,
+            first=primera,
+            name=nombre,
+            data={"clave": clave}
+        )
+        registro.registrar(nombre, TIPO_CLIMA, job)
+
+    def __len__(self):
+        return len(self._clave_por_record)
+
+
+# Un despachador por scheduler, igual que el RegistroJobs
+_despachadores = weakref.WeakKeyDictionary()
+
+
+def get_despachador_clima(job_queue, callback):
+    """
+    Devuelve el DespachadorClima asociado al job_queue, creándolo la
+    primera vez con 'callback' como función de envío de cada grupo.
+    """
+    scheduler = job_queue.scheduler
+    despachador = _despachadores.get(scheduler)
+    if despachador is None:
+        despachador = DespachadorClima(job_queue, callback, observador=snapshot_scheduler)
+        _despachadores[scheduler] = despachador
+    return despachador
@@ -1,26 +1,124 @@
 import logging
 from src.utils.logger import setup_logger
 from telegram.ext import ContextTypes
-from datetime import datetime, timedelta, timezone
-import requests
+from datetime import datetime, timedelta, timezone, time
+from time import monotonic
+from src.clima.despachador_clima import get_despachador_clima
+from src.scheduler.particiones import gestor_particiones
+from src.database.async_models import iterar_lotes_clima
+from src.config.settings import SCHEDULER_CONFIG, CLIMA_CONFIG
+from src.utils.cache_ttl import CacheTTL, AUSENTE
+from src.utils.single_flight import SingleFlight
+from src.utils.metricas import OPENWEATHER_LATENCIA, OPENWEATHER_RESPUESTAS
+from src.core.cola_envios import enviar_mensaje
+import asyncio
+import httpx
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+ENDPOINT_WEATHER = "weather"
+ENDPOINT_FORECAST = "forecast"
 
-def obtener_clima_actual(provincia):
+_TTL_POR_ENDPOINT = {
+    ENDPOINT_WEATHER: CLIMA_CONFIG["ttl_weather"],
+    ENDPOINT_FORECAST: CLIMA_CONFIG["ttl_forecast"]
+}
+
+# Caché de respuestas de OpenWeather por (provincia, endpoint)
+cache_openweather = CacheTTL(
+    CLIMA_CONFIG["cache_max_entradas"], CLIMA_CONFIG["ttl_weather"])
+
+# Consultas en curso por (provincia, endpoint), compartidas entre llamadas concurrentes
+vuelos_openweather = SingleFlight()
+
+# Cliente HTTP asíncrono compartido (pool de conexiones keep-alive)
+_cliente_http = None
+
+
+def get_cliente_http():
+    """
+    Devuelve el cliente httpx compartido para OpenWeather, creándolo la
+    primera vez. Reutiliza las conexiones TLS entre consultas y tiene
+    timeouts explícitos de conexión y lectura.
+    """
+    global _cliente_http
+    if _cliente_http is None or _cliente_http.is_closed:
+        _cliente_http = httpx.AsyncClient(
+            base_url="https://api.openweathermap.org/data/2.5/",
+            timeout=httpx.Timeout(
+                CLIMA_CONFIG["timeout_lectura"],
+                connect=CLIMA_CONFIG["timeout_conexion"]
+            ),
+            limits=httpx.Limits(
+                max_connections=CLIMA_CONFIG["max_conexiones"],
+                max_keepalive_connections=CLIMA_CONFIG["max_conexiones_keepalive"]
+            )
+        )
+    return _cliente_http
+
+
+async def cerrar_cliente_http():
+    """Cierra el pool de conexiones (se llama al apagar el bot)."""
+    global _cliente_http
+    if _cliente_http is not None:
+        await _cliente_http.aclose()
+        _cliente_http = None
+
+
+async def consultar_openweather(endpoint, provincia, forzar=False):
+    """
+    Devuelve el JSON del endpoint ('weather' o 'forecast') de OpenWeather
+    para la provincia, o None si la API no responde con 200. Las respuestas
+    correctas se guardan en caché con el TTL de su endpoint, así que las
+    consultas repetidas de una misma provincia no salen a la red. Si ya hay
+    una consulta idéntica en curso, se espera a ella en lugar de repetirla.
+    Con forzar=True se ignora la caché (se usa para refrescarla).
+    """
+    clave = (provincia.strip().lower(), endpoint)
+    if not forzar:
+        datos = cache_openweather.obtener(clave)
+        if datos is not AUSENTE:
+            return datos
+
+    return await vuelos_openweather.ejecutar(
+        clave, lambda: _descargar_openweather(endpoint, provincia, clave))
+
+
+async def _descargar_openweather(endpoint, provincia, clave):
+    params = {
+        "q": f"{provincia},ES",
+        "appid": os.getenv("OPENWEATHER_KEY"),
+        "units": "metric",
+        "lang": "es"
+    }
+    inicio = monotonic()
+    try:
+        resp = await get_cliente_http().get(endpoint, params=params)
+    except httpx.HTTPError as e:
+        OPENWEATHER_LATENCIA.labels(endpoint).observe(monotonic() - inicio)
+        OPENWEATHER_RESPUESTAS.labels(endpoint, type(e).__name__).inc()
+        logger.warning(f"Error al consultar OpenWeather ({endpoint}, {provincia}): {e}")
+        return None
+    OPENWEATHER_LATENCIA.labels(endpoint).observe(monotonic() - inicio)
+    OPENWEATHER_RESPUESTAS.labels(endpoint, str(resp.status_code)).inc()
+    if resp.status_code != 200:
+        return None
+
+    datos = resp.json()
+    cache_openweather.guardar(clave, datos, ttl=_TTL_POR_ENDPOINT[endpoint])
+    return datos
+
+
+async def obtener_clima_actual(provincia):
     """
     Consulta el endpoint 'weather' de OpenWeather para obtener el clima actual.
     Devuelve un texto descriptivo.
     """
-    ciudad = f"{provincia},ES"
-    clave_api = os.getenv("OPENWEATHER_KEY")
-    url_api = f"https://api.openweathermap.org/data/2.5/weather?q={ciudad}&appid={clave_api}&units=metric&lang=es"
-    resp = requests.get(url_api)
-    if resp.status_code == 200:
-        datos = resp.json()
+    datos = await consultar_openweather(ENDPOINT_WEATHER, provincia)
+    if datos:
         temp_float = datos["main"]["temp"]
         temp = int(round(temp_float))
 
@@ -42,27 +140,34 @@ def obtener_clima_actual(provincia):
         return "No se pudo obtener el clima en este momento."
 
 
-def obtener_pronostico_clima(provincia, zona="UTC+0"):
+async def obtener_datos_clima(provincia, forzar=False):
     """
-    Obtiene la temperatura actual, mínima y máxima en las próximas 24 horas,
-    así como la descripción del clima, el viento (convertido a km/h) y el
-    porcentaje de nubes. Las temperaturas y el viento se devuelven sin decimales.
+    Descarga de OpenWeather los datos de clima actual ('weather') y el
+    pronóstico ('forecast') de la provincia. Las dos consultas se lanzan
+    a la vez. No depende de la zona horaria del usuario, así que se puede
+    compartir entre todos los suscriptores de la misma provincia.
 
     Retorna:
-      (temp_actual, temp_min, temp_max, descripcion, viento_kmh, nubes)
-
-    donde cada uno puede ser None si no se pudo obtener.
-    El viento se expresa en km/h (en lugar de m/s).
+      (datos_actual, datos_pronostico), cada uno None si no se pudo obtener.
     """
+    data_c, data_f = await asyncio.gather(
+        consultar_openweather(ENDPOINT_WEATHER, provincia, forzar),
+        consultar_openweather(ENDPOINT_FORECAST, provincia, forzar)
+    )
+    return data_c, data_f
+
 
-    clave_api = os.getenv("OPENWEATHER_KEY")
-    ciudad = f"{provincia},ES"
+def calcular_pronostico(data_c, data_f, zona="UTC+0"):
+    """
+    A partir de los datos devueltos por obtener_datos_clima calcula la
+    temperatura actual, mínima y máxima en las próximas 24 horas (según la
+    zona del usuario), la descripción, el viento en km/h y las nubes.
 
-    # 1. Clima actual (temp_actual, descripción, viento, nubes)
-    url_cur = f"https://api.openweathermap.org/data/2.5/weather?q={ciudad}&appid={clave_api}&units=metric&lang=es"
-    rc = requests.get(url_cur)
-    if rc.status_code == 200:
-        data_c = rc.json()
+    Retorna:
+      (temp_actual, temp_min, temp_max, descripcion, viento_kmh, nubes)
+    """
+    # 1. Clima actual
+    if data_c:
         # Tomamos la temperatura y la descripción
         temp_actual = data_c["main"]["temp"]
         descripcion = data_c["weather"][0]["description"]
@@ -89,11 +194,8 @@ def obtener_pronostico_clima(provincia, zona="UTC+0"):
     now_local = now_utc + timedelta(hours=offset_horas)
     limit_local = now_local + timedelta(hours=24)
 
-    # 3. Llamamos al endpoint de 'forecast' para las próximas horas
-    url_f = f"https://api.openweathermap.org/data/2.5/forecast?q={ciudad}&appid={clave_api}&units=metric&lang=es"
-    rf = requests.get(url_f)
-    if rf.status_code == 200:
-        data_f = rf.json()
+    # 3. Pronóstico de las próximas horas
+    if data_f:
         forecast_list = data_f.get("list", [])
 
         # 4. Filtramos los Timestamps entre now_local y now_local + 24h
@@ -119,20 +221,31 @@ def obtener_pronostico_clima(provincia, zona="UTC+0"):
     return temp_actual, temp_min, temp_max, descripcion, viento_kmh, nubes
 
 
-async def enviar_recordatorio_diario_clima(context: ContextTypes.DEFAULT_TYPE):
+async def obtener_pronostico_clima(provincia, zona="UTC+0"):
     """
-    Callback del job que envía el recordatorio diario del clima.
-    Usa obtener_pronostico_clima para mostrar datos de temperatura min, max, nubes, etc.
-    Y si la hora local es antes de las 12, pone "Buenos días" con el nombre/apodo del usuario.
+    Obtiene la temperatura actual, mínima y máxima en las próximas 24 horas,
+    así como la descripción del clima, el viento (convertido a km/h) y el
+    porcentaje de nubes. Las temperaturas y el viento se devuelven sin decimales.
+
+    Retorna:
+      (temp_actual, temp_min, temp_max, descripcion, viento_kmh, nubes)
+
+    donde cada uno puede ser None si no se pudo obtener.
+    El viento se expresa en km/h (en lugar de m/s).
     """
-    job = context.job
-    chat_id = job.chat_id
-    provincia = job.data["provincia"]
-    zona = job.data.get("zona", "UTC+0")
-    nombre = job.data.get("nombre", "")
+    data_c, data_f = await obtener_datos_clima(provincia)
+    return calcular_pronostico(data_c, data_f, zona)
+
 
+def construir_mensaje_clima(provincia, zona, nombre, pronostico):
+    """
+    Construye el texto del recordatorio diario del clima a partir del
+    'pronostico' calculado por calcular_pronostico (temperatura min, max,
+    nubes, etc.). Si la hora local es antes de las 12, pone "Buenos días"
+    con el nombre/apodo del usuario.
+    """
     (temp_actual, temp_min, temp_max, desc, viento_kmh,
-     nubes) = obtener_pronostico_clima(provincia, zona)
+     nubes) = pronostico
 
     # Calcular la hora local para decidir el saludo.
     try:
@@ -166,8 +279,33 @@ async def enviar_recordatorio_diario_clima(context: ContextTypes.DEFAULT_TYPE):
             "No se pudo obtener todos los datos.\n"
             "Posiblemente no haya pronósticos próximos o la API no devolvió información."
         )
+    return mensaje
+
 
-    await context.bot.send_message(chat_id=chat_id, text=mensaje, parse_mode="HTML")
+async def enviar_recordatorio_diario_clima(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Callback del job de un minuto de envío del DespachadorClima. Las
+    suscripciones se agrupan por provincia: los datos de OpenWeather se
+    descargan una sola vez por provincia y luego se genera un mensaje
+    personalizado (zona horaria y nombre) para cada suscriptor, que se
+    deja en la cola de envíos.
+    """
+    clave = context.job.data["clave"]
+    por_provincia = _despachador(context.job_queue).suscriptores_por_provincia(clave)
+
+    for provincia, suscripciones in por_provincia.items():
+        data_c, data_f = await obtener_datos_clima(provincia)
+
+        for suscripcion in suscripciones:
+            zona = suscripcion.get("zona", "UTC+0")
+            mensaje = construir_mensaje_clima(
+                provincia,
+                zona,
+                suscripcion.get("nombre", ""),
+                calcular_pronostico(data_c, data_f, zona)
+            )
+            await enviar_mensaje(
+                context.bot, suscripcion["user_id"], mensaje, parse_mode="HTML")
 
 
 def convertir_a_utc(fecha_naive, zona_str):
@@ -196,33 +334,165 @@ def convertir_a_utc(fecha_naive, zona_str):
     return fecha_local.astimezone(timezone.utc)
 
 
-def programar_recordatorio_diario_clima(context, user_id, provincia, hora_programada, zona_horaria, nombre, record_id):
+def hora_envio_utc(hora_programada, zona_horaria):
     """
-    Programa un job repetitivo diario que, a la hora local especificada (convertida a UTC),
-    envíe el recordatorio de clima. Se incluye record_id en job.data para poder
-    cancelarlo/reprogramarlo si el usuario lo edita.
+    Devuelve (hora, minuto) en UTC correspondientes a 'hora_programada'
+    (datetime.time local) en la zona indicada.
     """
-    from datetime import datetime, timezone, timedelta
-
     now_utc = datetime.now(timezone.utc)
     fecha_naive = datetime.combine(now_utc.date(), hora_programada)
-    fecha_programada = convertir_a_utc(fecha_naive, zona_horaria)
-
-    # Si ya pasó la hora de hoy, lo programamos para mañana
-    if fecha_programada < now_utc:
-        fecha_programada += timedelta(days=1)
-
-    interval = 24 * 3600  # 24 horas
-    context.job_queue.run_repeating(
-        enviar_recordatorio_diario_clima,
-        interval=interval,
-        first=fecha_programada,
-        chat_id=user_id,  # Usamos user_id como chat_id para mensajes privados
-        name=f"clima_{record_id}",
-        data={
+    fecha_utc = convertir_a_utc(fecha_naive, zona_horaria)
+    return fecha_utc.hour, fecha_utc.minute
+
+
+def _despachador(job_queue):
+    return get_despachador_clima(job_queue, enviar_recordatorio_diario_clima)
+
+
+def programar_recordatorio_diario_clima(context, user_id, provincia, hora_programada, zona_horaria, nombre, record_id, crear_job=True):
+    """
+    Añade la suscripción al grupo del DespachadorClima correspondiente a su
+    hora de envío (convertida a UTC). Si el grupo todavía no existe,
+    se programa su job diario. Se indexa por record_id para poder
+    cancelarlo/reprogramarlo si el usuario lo edita. Si el usuario es de
+    una partición de otro worker, no se programa aquí.
+    """
+    if not gestor_particiones.es_mia(user_id):
+        return
+    hora_utc, minuto_utc = hora_envio_utc(hora_programada, zona_horaria)
+    _despachador(context.job_queue).agregar(
+        record_id,
+        hora_utc,
+        minuto_utc,
+        {
+            "user_id": user_id,  # Usamos user_id como chat_id para mensajes privados
             "provincia": provincia,
             "zona": zona_horaria,
-            "nombre": nombre,
-            "record_id": record_id  # ¡Importante para poder cancelar luego!
-        }
+            "nombre": nombre
+        },
+        crear_job=crear_job
+    )
+
+
+def cancelar_recordatorio_diario_clima(context, record_id):
+    """Saca la suscripción de su grupo (y cancela el job si queda vacío)."""
+    return _despachador(context.job_queue).quitar(record_id)
+
+
+def suscripciones_programadas(context):
+    """record_id de las suscripciones que hay en el despachador."""
+    return _despachador(context.job_queue).record_ids()
+
+
+def cancelar_suscripciones_de_usuarios(context, pertenece):
+    """
+    Saca del despachador las suscripciones cuyo usuario cumple
+    pertenece(user_id). Se usa al ceder particiones a otro worker.
+    """
+    despachador = _despachador(context.job_queue)
+    quitadas = 0
+    for record_id in despachador.record_ids():
+        suscripcion = despachador.suscripcion(record_id)
+        if suscripcion is not None and pertenece(suscripcion["user_id"]):
+            quitadas += despachador.quitar(record_id)
+    return quitadas
+
+
+def programar_suscripcion_clima(context, doc, crear_job=True):
+    """
+    Programa (o mueve de grupo) la suscripción a partir de su documento de
+    la colección clima. Devuelve False si le falta la hora o la provincia.
+    """
+    hora_cfg = doc.get("hora_config") or {}
+    if "hora" not in hora_cfg or not doc.get("provincia"):
+        return False
+    programar_recordatorio_diario_clima(
+        context,
+        doc["user_id"],
+        doc["provincia"],
+        time(hora_cfg["hora"], hora_cfg.get("minuto", 0)),
+        hora_cfg.get("zona", "UTC+0"),
+        doc.get("nombre_usuario", ""),
+        str(doc["_id"]),
+        crear_job=crear_job
+    )
+    return True
+
+
+def restaurar_suscripciones_clima(context, entradas):
+    """
+    Vuelve a meter en el despachador las suscripciones guardadas en el
+    snapshot del planificador (ya con su hora en UTC) y crea un job por
+    minuto, sin consultar la colección clima.
+    """
+    despachador = _despachador(context.job_queue)
+    for entrada in entradas:
+        despachador.agregar(
+            entrada["record_id"], entrada["hora"], entrada["minuto"],
+            entrada["suscripcion"], crear_job=False)
+    despachador.programar_grupos()
+    return len(entradas)
+
+
+async def rehidratar_suscripciones_clima(context, filtro=None):
+    """
+    Se llama al arrancar el bot. Recorre en streaming la colección clima
+    (o sólo las suscripciones que cumplen 'filtro'), agrupa las
+    suscripciones por minuto de envío y provincia, y crea un único job por
+    minuto al final.
+    """
+    inicio = monotonic()
+    total = 0
+    despachador = _despachador(context.job_queue)
+
+    async for lote in iterar_lotes_clima(filtro, tamano_lote=SCHEDULER_CONFIG["tamano_lote"]):
+        for doc in lote:
+            programar_suscripcion_clima(context, doc, crear_job=False)
+        total += len(lote)
+        await asyncio.sleep(0)
+
+    despachador.programar_grupos()
+    logger.info(
+        f"Rehidratación de clima completada: {len(despachador)} suscripciones "
+        f"en {len(despachador.claves())} grupos ({monotonic() - inicio:.2f} s)")
+    return total
+
+
+'''
+-----------------------------------------------------------------------------------
+Precarga de pronósticos antes de los minutos de envío
+-----------------------------------------------------------------------------------
+'''
+
+
+async def precargar_pronosticos(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Job que se ejecuta cada minuto. Mira qué grupos del DespachadorClima se
+    envían dentro de CLIMA_CONFIG["precarga_minutos"] y refresca en la caché
+    los datos de sus provincias, de modo que el envío se genere con datos ya
+    descargados.
+    """
+    objetivo = datetime.now(timezone.utc) + \
+        timedelta(minutes=CLIMA_CONFIG["precarga_minutos"])
+    clave = (objetivo.hour, objetivo.minute)
+    provincias = list(_despachador(context.job_queue).suscriptores_por_provincia(clave))
+    if not provincias:
+        return
+
+    await asyncio.gather(*(obtener_datos_clima(p, forzar=True) for p in provincias))
+    logger.info(
+        f"Precargado el clima de {len(provincias)} provincias para las {clave[0]:02d}:{clave[1]:02d} UTC")
+
+
+def programar_precarga_clima(job_queue):
+    """Programa precargar_pronosticos al inicio de cada minuto (si está activada)."""
+    if CLIMA_CONFIG["precarga_minutos"] <= 0:
+        return None
+    now_utc = datetime.now(timezone.utc)
+    siguiente_minuto = now_utc.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return job_queue.run_repeating(
+        precargar_pronosticos,
+        interval=60,
+        first=siguiente_minuto,
+        name="clima_precarga"
     )
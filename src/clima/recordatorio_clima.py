@@ -2,10 +2,11 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from datetime import datetime
-from src.database.models import (
+from src.database.async_models import (
     crear_suscripcion_clima,
     obtener_recordatorios_clima,
-    eliminar_recordatorio_clima
+    eliminar_recordatorio_clima,
+    confirmar_escrituras
 )
 from src.clima.gestion_clima import programar_recordatorio_diario_clima
 from src.utils.logger import setup_logger
@@ -103,16 +104,19 @@ async def seleccionar_zona_diario(update: Update, context: ContextTypes.DEFAULT_
     provincia = context.user_data.get("provincia_diario")
     hora = context.user_data.get("hora_diario")
 
-    from src.database.models import get_user
-    usuario = get_user(user_id)
+    from src.database.async_models import get_user
+    usuario = await get_user(user_id)
     if usuario and usuario.get("apodo"):
         nombre = usuario["apodo"]
     else:
         nombre = query.from_user.username
 
     hora_obj = {"hora": hora.hour, "minuto": hora.minute, "zona": zona}
-    nuevo_id = crear_suscripcion_clima(
+    nuevo_id = await crear_suscripcion_clima(
         user_id, nombre, provincia, hora_obj)  # <-- devuelve el _id
+    if not nuevo_id or not await confirmar_escrituras():
+        await query.edit_message_text("No se pudo crear el recordatorio de clima.")
+        return ConversationHandler.END
     record_id = str(nuevo_id)
 
     programar_recordatorio_diario_clima(
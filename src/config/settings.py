@@ -12,7 +12,11 @@ DB_CONFIG = {
     "uri": os.getenv("MONGO_URI"),
     "database": "jbot_db",
     "pool_size": 10,
-    "max_pool_size": 50
+    "max_pool_size": 50,
+    # Comprobación de salud en segundo plano y reconexión con backoff
+    "heartbeat_segundos": float(os.getenv("DB_HEARTBEAT_SEGUNDOS", 10)),
+    "backoff_inicial": float(os.getenv("DB_BACKOFF_INICIAL", 0.5)),
+    "backoff_max": float(os.getenv("DB_BACKOFF_MAX", 30))
 }
 
 # Configuración de seguridad
@@ -36,5 +40,132 @@ LOG_CONFIG = {
 # Configuración del bot
 BOT_CONFIG = {
     "token": os.getenv("TELEGRAM_TOKEN"),
-    "admin_ids": [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id]
+    "admin_ids": [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id],
+    # Elementos por página en los listados con botones
+    "tamano_pagina": int(os.getenv("TAMANO_PAGINA", 8)),
+    # Recepción de updates: "polling" (getUpdates) o "webhook"
+    "modo": os.getenv("BOT_MODO", "polling")
+}
+
+# Modo webhook: servidor HTTP local al que Telegram (o un proxy inverso) envía los updates
+WEBHOOK_CONFIG = {
+    # Detrás de un proxy inverso basta con escuchar en local
+    "listen": os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+    "port": int(os.getenv("WEBHOOK_PORT", 8443)),
+    "url_path": os.getenv("WEBHOOK_PATH", "telegram"),
+    # URL pública (la del proxy) sin el path, p. ej. https://bot.ejemplo.com
+    "url": os.getenv("WEBHOOK_URL"),
+    # Telegram la manda en X-Telegram-Bot-Api-Secret-Token. Obligatoria en
+    # modo webhook: tiene que ser la misma en todas las réplicas y sobrevivir
+    # a los reinicios (p. ej. python -c "import secrets; print(secrets.token_urlsafe(32))")
+    "secret_token": os.getenv("WEBHOOK_SECRET")
+}
+
+# Configuración del planificador de recordatorios
+SCHEDULER_CONFIG = {
+    # Sólo se crean jobs para lo que se dispara en las próximas N horas
+    "horizonte_horas": int(os.getenv("SCHEDULER_HORIZONTE_HORAS", 6)),
+    # Cada cuánto se carga la siguiente ventana (debe ser menor que el horizonte)
+    "intervalo_recarga_minutos": int(os.getenv("SCHEDULER_RECARGA_MINUTOS", 30)),
+    # Documentos por lote al recorrer el cursor en la rehidratación
+    "tamano_lote": int(os.getenv("SCHEDULER_TAMANO_LOTE", 500))
+}
+
+# Snapshot del planificador para arrancar en caliente
+SNAPSHOT_CONFIG = {
+    # Cada cuánto se vuelcan a MongoDB los cambios de jobs acumulados
+    "intervalo_segundos": int(os.getenv("SNAPSHOT_INTERVALO_SEGUNDOS", 30)),
+    # Al restaurar se reconcilian los documentos cambiados desde la marca
+    # del snapshot menos este margen (cubre la escritura en curso al volcar)
+    "margen_segundos": int(os.getenv("SNAPSHOT_MARGEN_SEGUNDOS", 60))
+}
+
+# Sincronización del planificador con los cambios hechos desde fuera del bot
+SINCRONIZACION_CONFIG = {
+    # "auto" (change streams si el servidor los admite, si no sondeo),
+    # "cambios" (sólo change streams) o "sondeo"
+    "modo": os.getenv("SINCRONIZACION_MODO", "auto"),
+    # Cada cuánto se buscan documentos con creado_en/actualizado_en nuevos
+    "intervalo_sondeo_segundos": int(os.getenv("SINCRONIZACION_SONDEO_SEGUNDOS", 5)),
+    # En modo sondeo, cada cuánto se comprueba si se borraron documentos programados
+    "intervalo_borrados_segundos": int(os.getenv("SINCRONIZACION_BORRADOS_SEGUNDOS", 60))
+}
+
+# Reparto del planificador entre varios procesos (particiones por user_id)
+PARTICIONES_CONFIG = {
+    # Con 1 (por defecto) un único proceso programa todo, sin leases
+    "numero": int(os.getenv("PARTICIONES_NUMERO", 1)),
+    # Un lease no renovado en este tiempo se considera de un worker caído
+    "duracion_lease_segundos": int(os.getenv("PARTICIONES_LEASE_SEGUNDOS", 30)),
+    # Cada cuánto se renuevan los leases y se reequilibra el reparto
+    "renovacion_segundos": int(os.getenv("PARTICIONES_RENOVACION_SEGUNDOS", 10)),
+    # Identificador del worker (por defecto, host y pid)
+    "worker_id": os.getenv("WORKER_ID")
+}
+
+# Persistencia de conversaciones y user_data en MongoDB
+PERSISTENCIA_CONFIG = {
+    # Cada cuánto se guardan las conversaciones y el user_data que han cambiado
+    "intervalo_segundos": int(os.getenv("PERSISTENCIA_INTERVALO_SEGUNDOS", 5)),
+    # Una conversación abandonada se borra tras estos días sin cambios
+    "retencion_dias": int(os.getenv("PERSISTENCIA_RETENCION_DIAS", 7))
+}
+
+# Métricas en formato Prometheus (GET /metrics)
+METRICAS_CONFIG = {
+    "activo": os.getenv("METRICAS_ACTIVO", "true").lower() == "true",
+    # Sólo en local por defecto; Prometheus suele correr en la misma máquina
+    "listen": os.getenv("METRICAS_LISTEN", "127.0.0.1"),
+    "puerto": int(os.getenv("METRICAS_PUERTO", 9464))
+}
+
+# Archivado de recordatorios terminados
+ARCHIVO_CONFIG = {
+    # Tiempo que un recordatorio terminado sigue en la colección principal
+    # (cubre también la diferencia entre la zona horaria y UTC)
+    "margen_horas": int(os.getenv("ARCHIVO_MARGEN_HORAS", 24)),
+    # Cada cuánto pasa el barrido
+    "intervalo_minutos": int(os.getenv("ARCHIVO_INTERVALO_MINUTOS", 60)),
+    # Días que se conservan en el archivo antes de que los borre el índice TTL
+    "retencion_dias": int(os.getenv("ARCHIVO_RETENCION_DIAS", 90))
+}
+
+# Configuración de las consultas a OpenWeather
+CLIMA_CONFIG = {
+    # Caché de respuestas por (provincia, endpoint)
+    "cache_max_entradas": int(os.getenv("CLIMA_CACHE_MAX_ENTRADAS", 256)),
+    "ttl_weather": int(os.getenv("CLIMA_TTL_WEATHER", 300)),     # segundos
+    "ttl_forecast": int(os.getenv("CLIMA_TTL_FORECAST", 1800)),  # segundos
+    # Cliente HTTP compartido (conexiones keep-alive)
+    "timeout_conexion": float(os.getenv("CLIMA_TIMEOUT_CONEXION", 3)),
+    "timeout_lectura": float(os.getenv("CLIMA_TIMEOUT_LECTURA", 5)),
+    "max_conexiones": int(os.getenv("CLIMA_MAX_CONEXIONES", 20)),
+    "max_conexiones_keepalive": int(os.getenv("CLIMA_MAX_KEEPALIVE", 10)),
+    # Minutos de antelación con los que se precargan los pronósticos antes
+    # de cada minuto de envío (0 desactiva la precarga). Debe ser menor que
+    # los TTL de la caché para que los datos sigan vigentes al enviar.
+    "precarga_minutos": int(os.getenv("CLIMA_PRECARGA_MINUTOS", 2))
+}
+
+# Configuración de la cola de envío de mensajes (límites de Telegram)
+ENVIOS_CONFIG = {
+    "mensajes_por_segundo": float(os.getenv("ENVIOS_MENSAJES_POR_SEGUNDO", 30)),
+    "segundos_por_chat": float(os.getenv("ENVIOS_SEGUNDOS_POR_CHAT", 1)),
+    "trabajadores": int(os.getenv("ENVIOS_TRABAJADORES", 8)),
+    "max_reintentos": int(os.getenv("ENVIOS_MAX_REINTENTOS", 3)),
+    "max_pendientes": int(os.getenv("ENVIOS_MAX_PENDIENTES", 10000))
+}
+
+# Procesado concurrente de updates (en orden dentro de cada usuario y chat)
+UPDATES_CONFIG = {
+    "trabajadores": int(os.getenv("UPDATES_TRABAJADORES", 16)),
+    "max_pendientes": int(os.getenv("UPDATES_MAX_PENDIENTES", 1024))
+}
+
+# Caché en memoria de usuarios registrados (get_user)
+USUARIOS_CACHE_CONFIG = {
+    "max_entradas": int(os.getenv("USUARIOS_CACHE_MAX_ENTRADAS", 10000)),
+    "ttl": float(os.getenv("USUARIOS_CACHE_TTL", 600)),
+    # Los "no registrado" caducan antes para que /register se note enseguida
+    "ttl_negativo": float(os.getenv("USUARIOS_CACHE_TTL_NEGATIVO", 15))
 }
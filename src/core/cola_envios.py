@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from telegram.error import RetryAfter
+from src.config.settings import ENVIOS_CONFIG
+from src.utils.metricas import ENVIO_LATENCIA
+
+logger = logging.getLogger(__name__)
+
+
+'''
+-----------------------------------------------------------------------------------
+Limitador global (token bucket)
+-----------------------------------------------------------------------------------
+'''
+
+
+class LimitadorTokens:
+    """
+    Token bucket: se rellenan 'tasa' tokens por segundo hasta 'capacidad'.
+    Cada envío consume un token; si no quedan, se espera al siguiente.
+    """
+
+    def __init__(self, tasa, capacidad=None):
+        self._tasa = tasa
+        self._capacidad = capacidad or tasa
+        self._tokens = self._capacidad
+        self._ultimo = time.monotonic()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self._capacidad,
+                           self._tokens + (ahora - self._ultimo) * self._tasa)
+        self._ultimo = ahora
+
+    async def adquirir(self):
+        while True:
+            self._rellenar()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._tasa)
+
+
+'''
+-----------------------------------------------------------------------------------
+Cola de envíos de mensajes del bot
+-----------------------------------------------------------------------------------
+'''
+
+
+class ColaEnvios:
+    """
+    Cola de salida para context.bot.send_message pensada para los picos en
+    los que muchos jobs se disparan a la vez (por ejemplo a las 08:00).
+
+    - Un token bucket global limita los mensajes por segundo de todo el bot.
+    - Cada chat tiene su propio ritmo (un mensaje cada 'segundos_por_chat').
+    - Un número fijo de trabajadores envía en paralelo (concurrencia acotada).
+    - Si Telegram responde RetryAfter, se pausan todos los envíos el tiempo
+      indicado y se reintenta el mensaje.
+
+    estadisticas() expone la profundidad de la cola y la latencia de envío.
+    """
+
+    def __init__(self, mensajes_por_segundo, segundos_por_chat, trabajadores,
+                 max_reintentos, max_pendientes):
+        self._mensajes_por_segundo = mensajes_por_segundo
+        self._segundos_por_chat = segundos_por_chat
+        self._num_trabajadores = trabajadores
+        self._max_reintentos = max_reintentos
+        self._max_pendientes = max_pendientes
+
+        self._loop = None
+        self._cola = None
+        self._trabajadores = []
+        self._limitador = None
+        self._proximo_por_chat = {}
+        self._pausa_hasta = 0.0
+
+        self.enviados = 0
+        self.errores = 0
+        self.reintentos = 0
+        self._latencia_total = 0.0
+        self.latencia_max = 0.0
+        self._espera_total = 0.0
+
+    def _asegurar_iniciada(self):
+        """Arranca los trabajadores en el event loop actual (o los recrea si cambió)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._cola = asyncio.Queue(maxsize=self._max_pendientes)
+        self._limitador = LimitadorTokens(self._mensajes_por_segundo)
+        self._proximo_por_chat = {}
+        self._trabajadores = [
+            loop.create_task(self._trabajador(), name=f"envios_{i}")
+            for i in range(self._num_trabajadores)
+        ]
+
+    async def encolar(self, bot, chat_id, text, **kwargs):
+        """
+        Añade un mensaje a la cola y devuelve un Future que se resuelve con el
+        Message enviado (o con la excepción si no se pudo enviar). Sólo espera
+        si la cola está llena.
+        """
+        self._asegurar_iniciada()
+        futuro = self._loop.create_future()
+        await self._cola.put((bot, chat_id, text, kwargs, futuro, time.monotonic()))
+        return futuro
+
+    async def _esperar_turno(self, chat_id):
+        # Pausa global tras un RetryAfter
+        espera = self._pausa_hasta - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+        # Ritmo por chat: se reserva el siguiente hueco libre de ese chat
+        ahora = time.monotonic()
+        turno = max(ahora, self._proximo_por_chat.get(chat_id, 0.0))
+        self._proximo_por_chat[chat_id] = turno + self._segundos_por_chat
+        if turno > ahora:
+            await asyncio.sleep(turno - ahora)
+
+        await self._limitador.adquirir()
+
+    async def _trabajador(self):
+        while True:
+            bot, chat_id, text, kwargs, futuro, encolado = await self._cola.get()
+            try:
+                mensaje = await self._enviar(bot, chat_id, text, kwargs, encolado)
+                if not futuro.done():
+                    futuro.set_result(mensaje)
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"No se pudo enviar el mensaje a {chat_id}: {e}")
+                if not futuro.done():
+                    futuro.set_exception(e)
+                    # Nadie está obligado a esperar el Future: evitamos el aviso
+                    futuro.exception()
+            finally:
+                self._cola.task_done()
+                self._limpiar_chats()
+
+    async def _enviar(self, bot, chat_id, text, kwargs, encolado):
+        for intento in range(self._max_reintentos + 1):
+            await self._esperar_turno(chat_id)
+            inicio = time.monotonic()
+            try:
+                mensaje = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                if intento >= self._max_reintentos:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.reintentos += 1
+                self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + retry_after)
+                logger.warning(f"RetryAfter de Telegram: pausando envíos {retry_after} s")
+                continue
+
+            fin = time.monotonic()
+            ENVIO_LATENCIA.observe(fin - inicio)
+            self.enviados += 1
+            self._latencia_total += fin - inicio
+            self.latencia_max = max(self.latencia_max, fin - inicio)
+            self._espera_total += inicio - encolado
+            return mensaje
+
+    def _limpiar_chats(self):
+        # Los chats cuyo turno ya pasó no necesitan seguir en memoria
+        if len(self._proximo_por_chat) > 10 * self._max_pendientes:
+            ahora = time.monotonic()
+            self._proximo_por_chat = {
+                chat: turno for chat, turno in self._proximo_por_chat.items() if turno > ahora}
+
+    async def esperar_vacia(self):
+        """Espera a que se hayan procesado todos los mensajes encolados."""
+        if self._cola is not None:
+            await self._cola.join()
+
+    async def detener(self, timeout=10):
+        """Intenta vaciar la cola (como mucho 'timeout' segundos) y para los trabajadores."""
+        if self._cola is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Se descartan {self._cola.qsize()} mensajes pendientes al detener la cola")
+        for tarea in self._trabajadores:
+            tarea.cancel()
+        await asyncio.gather(*self._trabajadores, return_exceptions=True)
+        self._trabajadores = []
+        self._cola = None
+        self._loop = None
+
+    def estadisticas(self):
+        return {
+            "pendientes": self._cola.qsize() if self._cola is not None else 0,
+            "enviados": self.enviados,
+            "errores": self.errores,
+            "reintentos": self.reintentos,
+            "latencia_media": self._latencia_total / self.enviados if self.enviados else 0.0,
+            "latencia_max": self.latencia_max,
+            "espera_media": self._espera_total / self.enviados if self.enviados else 0.0
+        }
+
+
+cola_envios = ColaEnvios(
+    ENVIOS_CONFIG["mensajes_por_segundo"],
+    ENVIOS_CONFIG["segundos_por_chat"],
+    ENVIOS_CONFIG["trabajadores"],
+    ENVIOS_CONFIG["max_reintentos"],
+    ENVIOS_CONFIG["max_pendientes"]
+)
+
+
+async def enviar_mensaje(bot, chat_id, text, **kwargs):
+    """
+    Encola un mensaje en la cola de envíos global. Se usa desde los callbacks
+    del JobQueue en lugar de llamar a bot.send_message directamente.
+    """
+    return await cola_envios.encolar(bot, chat_id, text, **kwargs)
@@ -1,6 +1,8 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from src.database.models import register_user, get_user, update_user_nickname
+from src.database.async_models import (
+    register_user, get_user, update_user_nickname, confirmar_escrituras
+)
 from src.core.security import validate_nickname, is_rate_limited, record_attempt
 from src.utils.input_sanitizer import sanitize_text
 from src.utils.validators import validate_chat_id, validate_username, validar_apodo
@@ -53,7 +55,7 @@ async def comando_registro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if user:
         await update.message.reply_text(
@@ -83,7 +85,7 @@ async def comando_registro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_username = update.effective_user.username if update.effective_user else None
 
     # Registrar usuario
-    if register_user(chat_id, user_id, apodo, telegram_username):
+    if await register_user(chat_id, user_id, apodo, telegram_username) and await confirmar_escrituras():
         await update.message.reply_text(
             f"¡Registro exitoso! Tu apodo es: {apodo}\n"
             "Puedes cambiarlo en cualquier momento usando /setnickname <nuevo_apodo>"
@@ -99,7 +101,7 @@ async def comando_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
         user_id = update.effective_user.id
-        user = get_user(user_id)
+        user = await get_user(user_id)
 
         if not user:
             await update.message.reply_text(
@@ -124,7 +126,7 @@ async def comando_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not es_valido:
             await update.message.reply_text(f"Error: {mensaje_error}")
             return
-        if update_user_nickname(user_id, nuevo_apodo):
+        if await update_user_nickname(user_id, nuevo_apodo):
             await update.message.reply_text(f"¡Apodo actualizado! Tu nuevo apodo es: {nuevo_apodo}")
         else:
             await update.message.reply_text("Error al actualizar el apodo. Por favor, intenta de nuevo.")
@@ -1,18 +1,44 @@
+import asyncio
 import logging
 import signal
+from datetime import datetime, timezone
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
 from src.core.commands import (
     comando_start, comando_help, comando_registro, comando_nickname
 )
 from src.reminders.recordatorios import conv_handler_recordatorios
-from src.reminders.mensaje_recordatorios import reprogramar_todos_los_recordatorios
-from src.reminders.gestion_recordatorios import procesar_eliminar_recordatorio
+from src.reminders.mensaje_recordatorios import (
+    reprogramar_todos_los_recordatorios, recargar_ventana_recordatorios,
+    barrer_recordatorios_terminados
+)
+from src.reminders.gestion_recordatorios import (
+    procesar_eliminar_recordatorio, paginar_recordatorios, PREFIJO_PAGINA
+)
 from src.clima.clima_bot import conv_handler_clima
+from src.clima.gestion_clima import (
+    rehidratar_suscripciones_clima, programar_precarga_clima, cerrar_cliente_http
+)
 from src.rpi.rpi_settings import get_system_info
 from src.rpi.rpi_config import get_config_handler
-from src.config.settings import BOT_CONFIG, LOG_CONFIG
+from src.config.settings import (
+    BOT_CONFIG, LOG_CONFIG, SCHEDULER_CONFIG, ARCHIVO_CONFIG, SNAPSHOT_CONFIG,
+    WEBHOOK_CONFIG
+)
 from src.utils.logger import setup_logger
-from src.database.models import ajustar_hora_recordatorios_clima
+from src.utils.metricas import (
+    instrumentar_conversacion, instrumentar_job_queue, registrar_estado,
+    iniciar_servidor_metricas, detener_servidor_metricas
+)
+from src.core.cola_envios import cola_envios
+from src.core.procesador_updates import procesador_updates
+from src.database.connection import get_db, startup, shutdown
+from src.database.migraciones import aplicar_migraciones
+from src.database.persistencia import PersistenciaMongo
+from src.scheduler.restauracion import (
+    restaurar_desde_snapshot, volcar_snapshot, al_ganar_particiones, al_perder_particiones
+)
+from src.scheduler.particiones import gestor_particiones
+from src.scheduler.sincronizacion import sincronizador_planificador
 
 # Configurar logging
 setup_logger()
@@ -28,13 +54,48 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
 
     try:
-        # Ajustar hora de recordatorios existentes
-        ajustar_hora_recordatorios_clima()
-
-        app = ApplicationBuilder().token(BOT_CONFIG["token"]).build()
-
-        # Reprogramar recordatorios existentes al arrancar el bot
+        app = (
+            ApplicationBuilder()
+            .token(BOT_CONFIG["token"])
+            # Usuarios distintos en paralelo, cada usuario en orden
+            .concurrent_updates(procesador_updates)
+            # Conversaciones y user_data en MongoDB; se guardan también al apagar
+            .persistence(PersistenciaMongo())
+            .post_init(al_iniciar)
+            .post_shutdown(al_apagar)
+            .build()
+        )
+
+        # Métricas: retraso y número de jobs, colas de updates y de envíos
+        instrumentar_job_queue(app.job_queue)
+        registrar_estado("updates", procesador_updates.estadisticas)
+        registrar_estado(
+            "updates_profundidad", procesador_updates.profundidades_por_puesto, etiqueta="puesto")
+        registrar_estado("envios", cola_envios.estadisticas)
+
+        # Reprogramar recordatorios y suscripciones de clima al arrancar el bot
         app.job_queue.run_once(iniciar_reprogramado, when=0)
+        # Cargar periódicamente la siguiente ventana de recordatorios
+        intervalo_recarga = SCHEDULER_CONFIG["intervalo_recarga_minutos"] * 60
+        app.job_queue.run_repeating(
+            recargar_ventana_recordatorios,
+            interval=intervalo_recarga,
+            first=intervalo_recarga
+        )
+        # Archivar los recordatorios que ya han terminado
+        app.job_queue.run_repeating(
+            barrer_recordatorios_terminados,
+            interval=ARCHIVO_CONFIG["intervalo_minutos"] * 60,
+            first=60
+        )
+        # Guardar los cambios de jobs en el snapshot del planificador
+        app.job_queue.run_repeating(
+            volcar_snapshot,
+            interval=SNAPSHOT_CONFIG["intervalo_segundos"],
+            first=SNAPSHOT_CONFIG["intervalo_segundos"]
+        )
+        # Precargar el clima antes de cada minuto con envíos programados
+        programar_precarga_clima(app.job_queue)
         app.add_error_handler(error_handler)
 
         # Handlers de comandos básicos
@@ -44,32 +105,98 @@ def main():
         app.add_handler(CommandHandler("setnickname", comando_nickname))
 
         # Handler para recordatorios
+        instrumentar_conversacion(conv_handler_recordatorios)
         app.add_handler(conv_handler_recordatorios)
         app.add_handler(CallbackQueryHandler(
             procesar_eliminar_recordatorio, pattern="^eliminar_"))
+        app.add_handler(CallbackQueryHandler(
+            paginar_recordatorios, pattern=f"^{PREFIJO_PAGINA}"))
 
         # Handler para el comando /clima
+        instrumentar_conversacion(conv_handler_clima)
         app.add_handler(conv_handler_clima)
 
         # Handler para el comando /RSettings
         app.add_handler(get_config_handler())
 
-        logger.info("Bot iniciado correctamente")
-        app.run_polling()
+        logger.info(f"Bot iniciado correctamente (modo {BOT_CONFIG['modo']})")
+        recibir_updates(app)
 
     except Exception as e:
         logger.error(f"Error fatal en el bot: {e}", exc_info=True)
         raise
 
 
+def parametros_webhook():
+    """Argumentos de run_webhook / Updater.start_webhook según WEBHOOK_CONFIG."""
+    if not WEBHOOK_CONFIG["url"]:
+        raise ValueError("BOT_MODO=webhook necesita WEBHOOK_URL")
+    if not WEBHOOK_CONFIG["secret_token"]:
+        raise ValueError("BOT_MODO=webhook necesita WEBHOOK_SECRET")
+    return {
+        "listen": WEBHOOK_CONFIG["listen"],
+        "port": WEBHOOK_CONFIG["port"],
+        "url_path": WEBHOOK_CONFIG["url_path"],
+        "webhook_url": f"{WEBHOOK_CONFIG['url'].rstrip('/')}/{WEBHOOK_CONFIG['url_path']}",
+        # PTB responde 403 a las peticiones sin este token
+        "secret_token": WEBHOOK_CONFIG["secret_token"]
+    }
+
+
+def recibir_updates(app):
+    """
+    Arranca la recepción de updates: long polling (por defecto) o webhook
+    con el servidor HTTP asíncrono de PTB. El TLS lo pone el proxy inverso
+    que reenvía a WEBHOOK_CONFIG["listen"]:["port"].
+    """
+    if BOT_CONFIG["modo"] == "webhook":
+        app.run_webhook(**parametros_webhook())
+    else:
+        app.run_polling()
+
+
 async def error_handler(update, context):
     logger.error(f"Error en el bot: {context.error}", exc_info=True)
     if update:
         logger.error(f"Update que causó el error: {update}")
 
 
+async def al_iniciar(app):
+    # Conectar a MongoDB, crear índices y arrancar el heartbeat
+    await startup()
+    # Aplicar las migraciones de datos pendientes (una sola vez cada una)
+    await asyncio.to_thread(aplicar_migraciones, get_db())
+    # Endpoint /metrics para Prometheus
+    await iniciar_servidor_metricas()
+
+
+async def al_apagar(app):
+    await detener_servidor_metricas()
+    # Dejar de aplicar cambios externos al planificador
+    await sincronizador_planificador.detener()
+    # Liberar las particiones para que otro worker las tome sin esperar
+    await gestor_particiones.detener()
+    # Enviar lo que quede en la cola de mensajes antes de salir
+    await cola_envios.detener()
+    # Cerrar el pool de conexiones HTTP de OpenWeather
+    await cerrar_cliente_http()
+    # Guardar los últimos cambios del planificador para el siguiente arranque
+    await volcar_snapshot()
+    # Parar el heartbeat y cerrar las conexiones a MongoDB
+    await shutdown()
+
+
 async def iniciar_reprogramado(context):
-    await reprogramar_todos_los_recordatorios(context)
+    inicio = datetime.now(timezone.utc)
+    if gestor_particiones.activo:
+        # Cada partición se carga al tomar su lease (ver GestorParticiones)
+        gestor_particiones.iniciar(context, al_ganar_particiones, al_perder_particiones)
+    # En caliente desde el snapshot del planificador si existe; si no, en frío
+    elif not await restaurar_desde_snapshot(context):
+        await reprogramar_todos_los_recordatorios(context)
+        await rehidratar_suscripciones_clima(context)
+    # A partir de aquí los cambios hechos fuera del bot se aplican según llegan
+    sincronizador_planificador.iniciar(context, desde=inicio)
 
 if __name__ == "__main__":
     main()
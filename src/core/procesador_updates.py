@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from telegram.ext import BaseUpdateProcessor
+from src.config.settings import UPDATES_CONFIG
+from src.database.async_models import unidad_de_trabajo
+from src.database.connection import db_disponible
+
+logger = logging.getLogger(__name__)
+
+MENSAJE_SIN_BD = (
+    "El servicio no está disponible en este momento. "
+    "Por favor, intenta de nuevo en unos minutos."
+)
+
+
+def clave_update(update):
+    """
+    Clave con la que se ordenan los updates: el user_id si lo hay y, si no
+    (p. ej. posts de canal), el chat_id. conv_handler_recordatorios guarda
+    su estado sólo por usuario (per_chat=False), así que dos chats del mismo
+    usuario no pueden tratarse a la vez. None si no tiene ninguno.
+    """
+    usuario = getattr(update, "effective_user", None)
+    if usuario is not None:
+        return ("usuario", usuario.id)
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return ("chat", chat.id)
+    return None
+
+
+'''
+-----------------------------------------------------------------------------------
+Procesado concurrente de updates con orden por usuario
+-----------------------------------------------------------------------------------
+'''
+
+
+class ProcesadorPorUsuario(BaseUpdateProcessor):
+    """
+    Procesa updates de usuarios distintos en paralelo y los de un mismo
+    usuario (en cualquier chat) estrictamente en orden, para que los
+    ConversationHandler (recordatorios, clima) vean los pasos de cada
+    conversación uno detrás de otro.
+
+    - Cada clave (ver clave_update) tiene un asyncio.Lock; sus waiters se
+      despiertan en orden de llegada, que es el orden de los updates.
+    - Un semáforo propio limita los updates que se ejecutan a la vez a
+      'trabajadores'. Se toma después del lock del usuario, así que los
+      updates que esperan su turno no ocupan trabajadores.
+    - El semáforo de BaseUpdateProcessor (max_pendientes) acota los updates
+      en curso o en espera y hace de backpressure sobre el Updater.
+    - Cada update se trata dentro de una unidad de trabajo: sus escrituras
+      se mandan juntas, sin transacción, al terminar; antes si se llama a
+      confirmar_escrituras() o a una función de async_models que vaya
+      directamente a MongoDB (así las lecturas ven lo ya escrito).
+    - Si el heartbeat marca MongoDB como caído, el update no se trata: se
+      contesta al momento en lugar de esperar al timeout de cada consulta.
+
+    estadisticas() expone el estado global y profundidades_por_puesto() la
+    profundidad de las colas más largas.
+    """
+
+    def __init__(self, trabajadores, max_pendientes):
+        super().__init__(max_pendientes)
+        self._trabajadores = asyncio.BoundedSemaphore(trabajadores)
+        self._num_trabajadores = trabajadores
+        # clave -> [lock, updates pendientes (en espera + en curso)]
+        self._colas = {}
+
+        self.en_curso = 0
+        self.procesados = 0
+        self.rechazados = 0
+        self.profundidad_max = 0
+        self._espera_total = 0.0
+        self.espera_max = 0.0
+
+    async def do_process_update(self, update, coroutine):
+        clave = clave_update(update)
+        if clave is None:
+            async with self._trabajadores:
+                await self._ejecutar(update, coroutine, time.monotonic())
+            return
+
+        cola = self._colas.get(clave)
+        if cola is None:
+            cola = self._colas[clave] = [asyncio.Lock(), 0]
+        cola[1] += 1
+        self.profundidad_max = max(self.profundidad_max, cola[1])
+        llegada = time.monotonic()
+        try:
+            async with cola[0]:
+                async with self._trabajadores:
+                    await self._ejecutar(update, coroutine, llegada)
+        finally:
+            cola[1] -= 1
+            if cola[1] == 0:
+                del self._colas[clave]
+
+    async def _ejecutar(self, update, coroutine, llegada):
+        espera = time.monotonic() - llegada
+        self._espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        self.en_curso += 1
+        try:
+            if not db_disponible():
+                coroutine.close()
+                self.rechazados += 1
+                await _avisar_sin_bd(update)
+                return
+            async with unidad_de_trabajo():
+                await coroutine
+        except Exception as e:
+            # PTB ya pasa los errores de los handlers a sus error handlers;
+            # aquí llegan sobre todo los de confirmar las escrituras
+            logger.error(f"Error al terminar el update: {e}", exc_info=True)
+        finally:
+            self.en_curso -= 1
+            self.procesados += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def profundidad(self, clave):
+        """Updates pendientes (en espera + en curso) de la clave (ver clave_update)."""
+        cola = self._colas.get(clave)
+        return cola[1] if cola else 0
+
+    def profundidades(self, limite=10):
+        """Las 'limite' claves con más updates pendientes, de mayor a menor."""
+        colas = sorted(self._colas.items(), key=lambda item: item[1][1], reverse=True)
+        return [(clave, cola[1]) for clave, cola in colas[:limite]]
+
+    def profundidades_por_puesto(self, limite=5):
+        """
+        {1: profundidad de la cola más larga, 2: la siguiente...} hasta
+        'limite', con 0 si hay menos colas. Se exporta como gauge con la
+        etiqueta "puesto": el número de series es fijo y no lleva user_id.
+        """
+        profundidades = [profundidad for _, profundidad in self.profundidades(limite)]
+        profundidades += [0] * (limite - len(profundidades))
+        return {puesto: profundidad for puesto, profundidad in enumerate(profundidades, 1)}
+
+    def estadisticas(self):
+        pendientes = sum(cola[1] for cola in self._colas.values())
+        return {
+            "trabajadores": self._num_trabajadores,
+            "en_curso": self.en_curso,
+            # en_curso cuenta también los updates sin usuario ni chat
+            "en_espera": max(0, pendientes - self.en_curso),
+            "usuarios_con_cola": sum(1 for cola in self._colas.values() if cola[1] > 1),
+            "profundidad_max": self.profundidad_max,
+            "procesados": self.procesados,
+            "rechazados_sin_bd": self.rechazados,
+            "espera_media": self._espera_total / self.procesados if self.procesados else 0.0,
+            "espera_max": self.espera_max
+        }
+
+
+async def _avisar_sin_bd(update):
+    """Contesta al usuario que ahora no se puede atender su petición."""
+    try:
+        consulta = getattr(update, "callback_query", None)
+        if consulta is not None:
+            await consulta.answer(MENSAJE_SIN_BD, show_alert=True)
+        elif getattr(update, "effective_message", None) is not None:
+            await update.effective_message.reply_text(MENSAJE_SIN_BD)
+    except Exception as e:
+        logger.warning(f"No se pudo avisar de que MongoDB no está disponible: {e}")
+
+
+procesador_updates = ProcesadorPorUsuario(
+    UPDATES_CONFIG["trabajadores"],
+    UPDATES_CONFIG["max_pendientes"]
+)
@@ -7,8 +7,7 @@ from src.database.models import (
     crear_suscripcion_clima,
     obtener_recordatorios_clima,
     eliminar_recordatorio_clima,
-    actualizar_recordatorio_clima,
-    coleccion_clima
+    actualizar_recordatorio_clima
 )
 
 __all__ = [
@@ -20,6 +19,5 @@ __all__ = [
     'crear_suscripcion_clima',
     'obtener_recordatorios_clima',
     'eliminar_recordatorio_clima',
-    'actualizar_recordatorio_clima',
-    'coleccion_clima'
+    'actualizar_recordatorio_clima'
 ]
@@ -0,0 +1,472 @@
+import functools
+import logging
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from src.database.connection import get_async_db, BaseDatosDiferida
+from src.database.unidad_trabajo import UnidadTrabajo, unidad_actual
+from src.database.models import (
+    PROYECCION_PROGRAMACION,
+    PROYECCION_CLIMA,
+    PROYECCION_LISTADO_RECORDATORIOS,
+    PROYECCION_LISTADO_CLIMA,
+    ORDEN_RECORDATORIOS,
+    ORDEN_CLIMA,
+    consulta_pagina,
+    resultado_pagina,
+    cambios_next_fire_at,
+    filtro_recordatorios_terminados,
+    cache_usuarios,
+    guardar_usuario_en_cache,
+    invalidar_usuario_por_chat_id
+)
+from src.utils.cache_ttl import AUSENTE
+from src.utils.metricas import medir_mongo
+from src.config.settings import BOT_CONFIG
+from src.utils.validators import validate_chat_id
+from src.utils.input_sanitizer import sanitize_text, sanitize_provincia
+
+
+logger = logging.getLogger(__name__)
+db = BaseDatosDiferida(get_async_db)
+
+'''
+-----------------------------------------------------------------------------------
+Versión asíncrona de src.database.models
+
+Mismas funciones y mismos valores de retorno, pero sobre AsyncMongoClient:
+hay que hacer await de cada llamada y ninguna bloquea el event loop de PTB
+mientras espera a MongoDB. Es la que deben usar los handlers y callbacks.
+-----------------------------------------------------------------------------------
+'''
+
+
+def unidad_de_trabajo(transaccion=False):
+    """
+    Abre una UnidadTrabajo sobre la base de datos asíncrona. Las escrituras
+    de este módulo hechas dentro de 'async with unidad_de_trabajo():' se
+    mandan juntas al salir (en una transacción sólo con transaccion=True).
+    """
+    return UnidadTrabajo(db, transaccion)
+
+
+def _con_escrituras_al_dia(funcion):
+    """
+    Decorador para las funciones que van directamente a MongoDB (lecturas y
+    escrituras que no se acumulan): antes se manda lo pendiente en la unidad
+    de trabajo abierta, para que vean lo escrito antes en el mismo update.
+    """
+    @functools.wraps(funcion)
+    async def envoltura(*args, **kwargs):
+        unidad = unidad_actual()
+        if unidad is not None and len(unidad):
+            await unidad.confirmar()
+        return await funcion(*args, **kwargs)
+    return envoltura
+
+
+async def confirmar_escrituras():
+    """
+    Confirma ya lo acumulado en la unidad de trabajo abierta (cada update
+    se trata dentro de una). Los handlers la llaman antes de contestar al
+    usuario que algo se ha guardado.
+
+    Returns:
+        bool: False si la escritura falló
+    """
+    unidad = unidad_actual()
+    if unidad is None:
+        return True
+    try:
+        await unidad.confirmar()
+        return True
+    except Exception as e:
+        logger.error(f"Error al confirmar las escrituras: {e}", exc_info=True)
+        return False
+
+
+def _tras_confirmar(funcion):
+    """Llama a 'funcion' cuando la escritura en curso esté en MongoDB."""
+    unidad = unidad_actual()
+    if unidad is not None:
+        unidad.al_confirmar(funcion)
+    else:
+        funcion()
+
+
+async def _insertar(coleccion, documento):
+    """Inserta (o acumula en la unidad de trabajo abierta) y devuelve el _id."""
+    unidad = unidad_actual()
+    if unidad is not None:
+        return unidad.insertar(coleccion, documento)
+    return (await db[coleccion].insert_one(documento)).inserted_id
+
+
+@medir_mongo
+async def register_user(chat_id, user_id, apodo, username=None):
+    """
+    Registra un nuevo usuario en la base de datos.
+
+    Returns:
+        bool: True si el registro fue exitoso, False en caso contrario
+    """
+    try:
+        if not validate_chat_id(chat_id):
+            logger.warning(f"Chat ID inválido: {chat_id}")
+            return False
+
+        # Verificar si el usuario ya está registrado (por user_id)
+        if await db.usuarios.find_one({"user_id": user_id}):
+            logger.info(f"Usuario ya registrado: {user_id}")
+            return False
+
+        data_usuario = {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "apodo": sanitize_text(apodo),
+            "username": sanitize_text(username) if username else None,
+            "registro": datetime.now(timezone.utc)
+        }
+        await _insertar("usuarios", data_usuario)
+        _tras_confirmar(lambda: cache_usuarios.invalidar(user_id))
+        logger.info(
+            f"Usuario registrado: {user_id} (apodo: {apodo}, username: {username})")
+        return True
+    except Exception as e:
+        logger.error(f"Error al registrar usuario: {e}", exc_info=True)
+        return False
+
+
+@medir_mongo
+async def crear_recordatorio(user_id, titulo, descripcion, fecha_hora_inicio, frecuencia, fecha_hora_fin, zona_horaria, next_fire_at=None, expira_en=None):
+    try:
+        documento = {
+            "user_id": user_id,
+            "titulo": sanitize_text(titulo),
+            "descripcion": sanitize_text(descripcion),
+            "fecha_hora_inicio": fecha_hora_inicio,
+            "frecuencia": frecuencia,
+            "fecha_hora_fin": fecha_hora_fin,
+            "zona_horaria": zona_horaria,
+            "next_fire_at": next_fire_at,
+            "expira_en": expira_en,
+            "creado_en": datetime.now(timezone.utc)
+        }
+        id_insertado = await _insertar("recordatorios", documento)
+        logger.info(f"Recordatorio creado para usuario {user_id}")
+        return id_insertado
+    except Exception as e:
+        logger.error(f"Error al crear recordatorio: {e}", exc_info=True)
+        return None
+
+
+@medir_mongo
+async def crear_suscripcion_clima(user_id, nombre_usuario, provincia, hora_config):
+    try:
+        provincia_sanitizada = sanitize_provincia(provincia)
+        if not provincia_sanitizada:
+            logger.warning(f"Provincia inválida: {provincia}")
+            return None
+
+        documento = {
+            "user_id": user_id,
+            "nombre_usuario": sanitize_text(nombre_usuario),
+            "provincia": provincia_sanitizada,
+            "hora_config": hora_config,
+            "creado_en": datetime.now(timezone.utc)
+        }
+        id_insertado = await _insertar("clima", documento)
+        logger.info(f"Suscripción de clima creada para usuario {user_id}")
+        return id_insertado
+    except Exception as e:
+        logger.error(
+            f"Error al crear suscripción de clima: {e}", exc_info=True)
+        return None
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def get_user(user_id):
+    """Obtiene un usuario por su user_id (pasando por cache_usuarios)"""
+    usuario = cache_usuarios.obtener(user_id)
+    if usuario is AUSENTE:
+        marca = cache_usuarios.marca()
+        usuario = await db.usuarios.find_one({"user_id": user_id})
+        guardar_usuario_en_cache(user_id, usuario, marca)
+    return usuario
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def get_user_by_chat_id(chat_id):
+    """Obtiene un usuario por su chat_id"""
+    return await db.usuarios.find_one({"chat_id": chat_id})
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def update_user(chat_id, data):
+    resultado = await db.usuarios.update_one({"chat_id": chat_id}, {"$set": data})
+    invalidar_usuario_por_chat_id(chat_id)
+    return resultado
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def delete_user(chat_id):
+    resultado = await db.usuarios.delete_one({"chat_id": chat_id})
+    invalidar_usuario_por_chat_id(chat_id)
+    return resultado
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def obtener_recordatorios(user_id=None):
+    query = {"user_id": user_id} if user_id is not None else {}
+    return await db.recordatorios.find(query).to_list(None)
+
+
+async def _pagina(coleccion, user_id, campos, proyeccion, cursor, hacia_atras, tamano):
+    filtro, orden = consulta_pagina(user_id, campos, cursor, hacia_atras)
+    documentos = await coleccion.find(filtro, proyeccion).sort(orden).limit(tamano + 1).to_list(None)
+    return resultado_pagina(documentos, campos, tamano, cursor, hacia_atras)
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def pagina_recordatorios(user_id, cursor=None, hacia_atras=False, tamano=BOT_CONFIG["tamano_pagina"]):
+    """Una página de los recordatorios del usuario ordenados por fecha de inicio."""
+    return await _pagina(db.recordatorios, user_id, ORDEN_RECORDATORIOS,
+                         PROYECCION_LISTADO_RECORDATORIOS, cursor, hacia_atras, tamano)
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def pagina_recordatorios_clima(user_id, cursor=None, hacia_atras=False, tamano=BOT_CONFIG["tamano_pagina"]):
+    """Una página de las suscripciones de clima del usuario (por orden de creación)."""
+    return await _pagina(db.clima, user_id, ORDEN_CLIMA,
+                         PROYECCION_LISTADO_CLIMA, cursor, hacia_atras, tamano)
+
+
+async def _iterar_lotes(coleccion, filtro, tamano_lote, proyeccion):
+    """
+    Igual que models._iterar_lotes pero como generador asíncrono:
+    se usa con 'async for lote in ...'.
+    """
+    cursor = coleccion.find(filtro or {}, proyeccion).batch_size(tamano_lote)
+    lote = []
+    async for documento in cursor:
+        lote.append(documento)
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def iterar_lotes_recordatorios(filtro=None, tamano_lote=500, proyeccion=PROYECCION_PROGRAMACION):
+    """Recorre en lotes los recordatorios que cumplen 'filtro'."""
+    return _iterar_lotes(db.recordatorios, filtro, tamano_lote, proyeccion)
+
+
+@medir_mongo
+async def actualizar_next_fire_at(id_recordatorio, next_fire_at):
+    filtro = {"_id": ObjectId(id_recordatorio)}
+    cambios = cambios_next_fire_at(next_fire_at)
+    unidad = unidad_actual()
+    if unidad is not None:
+        return unidad.actualizar("recordatorios", filtro, cambios)
+    return await db.recordatorios.update_one(filtro, cambios)
+
+
+@medir_mongo
+async def archivar_recordatorios_terminados(limite, tamano_lote=500):
+    """
+    Mueve a recordatorios_archivo los recordatorios con expira_en anterior a
+    'limite', en lotes: insert_many en el archivo y delete_many de los mismos
+    _id en la colección principal. Si un lote se quedó a medias (ya estaba
+    en el archivo), se ignoran los duplicados y se borra igualmente.
+
+    Devuelve el número de recordatorios archivados.
+    """
+    total = 0
+    ahora = datetime.now(timezone.utc)
+    async for lote in _iterar_lotes(db.recordatorios, filtro_recordatorios_terminados(limite), tamano_lote, None):
+        for documento in lote:
+            documento["archivado_en"] = ahora
+        try:
+            await db.recordatorios_archivo.insert_many(lote, ordered=False)
+        except BulkWriteError as e:
+            errores = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errores:
+                raise
+        await db.recordatorios.delete_many({"_id": {"$in": [d["_id"] for d in lote]}})
+        total += len(lote)
+    return total
+
+
+async def _ids_existentes(coleccion, ids):
+    documentos = await coleccion.find(
+        {"_id": {"$in": [ObjectId(i) for i in ids]}}, {"_id": 1}).to_list(None)
+    return {str(d["_id"]) for d in documentos}
+
+
+@medir_mongo
+async def ids_recordatorios_existentes(ids):
+    """Devuelve el subconjunto de 'ids' (como str) que sigue en la colección."""
+    return await _ids_existentes(db.recordatorios, ids)
+
+
+async def abrir_change_stream(coleccion, pipeline, **opciones):
+    """
+    Abre un change stream sobre 'coleccion' con el documento completo en
+    las actualizaciones. Falla si el servidor no es un replica set.
+    """
+    return await db[coleccion].watch(pipeline, full_document="updateLookup", **opciones)
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def eliminar_recordatorio_por_id(id_recordatorio):
+    return await db.recordatorios.delete_one({"_id": ObjectId(id_recordatorio)})
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def obtener_recordatorios_clima(user_id):
+    return await db.clima.find({"user_id": user_id}).to_list(None)
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def obtener_recordatorio_clima(id_recordatorio):
+    return await db.clima.find_one({"_id": ObjectId(id_recordatorio)})
+
+
+def iterar_lotes_clima(filtro=None, tamano_lote=500, proyeccion=PROYECCION_CLIMA):
+    """Recorre en lotes las suscripciones de clima que cumplen 'filtro'."""
+    return _iterar_lotes(db.clima, filtro, tamano_lote, proyeccion)
+
+
+@medir_mongo
+async def ids_clima_existentes(ids):
+    """Devuelve el subconjunto de 'ids' (como str) que sigue en la colección clima."""
+    return await _ids_existentes(db.clima, ids)
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def eliminar_recordatorio_clima(id_recordatorio):
+    return await db.clima.delete_one({"_id": ObjectId(id_recordatorio)})
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def actualizar_recordatorio_clima(id_recordatorio, cambios):
+    """
+    Actualiza un recordatorio de clima existente con los cambios especificados.
+    """
+    try:
+        resultado = await db.clima.update_one(
+            {"_id": ObjectId(id_recordatorio)},
+            {"$set": dict(cambios, actualizado_en=datetime.now(timezone.utc))}
+        )
+        logger.info(f"Recordatorio de clima actualizado: {id_recordatorio}")
+        return resultado.modified_count > 0
+    except Exception as e:
+        logger.error(
+            f"Error al actualizar recordatorio de clima: {e}", exc_info=True)
+        return False
+
+
+@medir_mongo
+@_con_escrituras_al_dia
+async def update_user_nickname(user_id: int, nuevo_apodo: str) -> bool:
+    """
+    Actualiza el apodo de un usuario.
+
+    Returns:
+        bool: True si la actualización fue exitosa, False en caso contrario
+    """
+    try:
+        result = await db.usuarios.update_one(
+            {"user_id": user_id},
+            {"$set": {"apodo": sanitize_text(nuevo_apodo)}}
+        )
+        cache_usuarios.invalidar(user_id)
+        logger.info(f"Apodo actualizado para usuario {user_id}")
+        return result.modified_count > 0
+    except Exception as e:
+        logger.error(f"Error al actualizar apodo: {e}")
+        return False
+
+
+'''
+-----------------------------------------------------------------------------------
+Leases de las particiones del planificador (ver GestorParticiones)
+-----------------------------------------------------------------------------------
+'''
+
+COLECCION_PARTICIONES = "_particiones"
+COLECCION_WORKERS = "_workers"
+
+
+@medir_mongo
+async def latir_worker(worker_id, ahora):
+    """Marca el worker como vivo."""
+    await db[COLECCION_WORKERS].update_one(
+        {"_id": worker_id}, {"$set": {"visto_en": ahora}}, upsert=True)
+
+
+@medir_mongo
+async def contar_workers_vivos(desde):
+    """Workers que han latido después de 'desde'."""
+    return await db[COLECCION_WORKERS].count_documents({"visto_en": {"$gte": desde}})
+
+
+@medir_mongo
+async def olvidar_worker(worker_id):
+    await db[COLECCION_WORKERS].delete_one({"_id": worker_id})
+
+
+@medir_mongo
+async def estado_particiones():
+    """Documentos {_id: particion, dueno, expira_en} de las particiones con lease."""
+    return await db[COLECCION_PARTICIONES].find({}).to_list(None)
+
+
+@medir_mongo
+async def reclamar_particion(particion, worker_id, ahora, expira_en):
+    """
+    Se queda con el lease de la partición si está libre, caducado o ya era
+    suyo. Devuelve False si otro worker lo tiene vigente.
+    """
+    try:
+        await db[COLECCION_PARTICIONES].update_one(
+            {"_id": particion, "$or": [{"expira_en": {"$lt": ahora}}, {"dueno": worker_id}]},
+            {"$set": {"dueno": worker_id, "expira_en": expira_en}},
+            upsert=True)
+    except DuplicateKeyError:
+        # El documento existe y el filtro no casa: el lease es de otro
+        return False
+    return True
+
+
+@medir_mongo
+async def renovar_particiones(worker_id, particiones, expira_en):
+    """Renueva los leases del worker y devuelve las particiones que conserva."""
+    await db[COLECCION_PARTICIONES].update_many(
+        {"_id": {"$in": list(particiones)}, "dueno": worker_id},
+        {"$set": {"expira_en": expira_en}})
+    # Si otro worker lo tomó al caducar, el dueño ya no es este
+    documentos = await db[COLECCION_PARTICIONES].find(
+        {"_id": {"$in": list(particiones)}, "dueno": worker_id}, {"_id": 1}).to_list(None)
+    return {d["_id"] for d in documentos}
+
+
+@medir_mongo
+async def liberar_particiones(worker_id, particiones):
+    """Deja caducados los leases indicados para que otro worker los tome ya."""
+    await db[COLECCION_PARTICIONES].update_many(
+        {"_id": {"$in": list(particiones)}, "dueno": worker_id},
+        {"$set": {"expira_en": datetime(1970, 1, 1, tzinfo=timezone.utc)}})
@@ -1,7 +1,9 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure, ServerSelectionTimeoutError
-from src.config.settings import DB_CONFIG
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure
+from src.config.settings import DB_CONFIG, ARCHIVO_CONFIG, PERSISTENCIA_CONFIG
+import asyncio
 import logging
+import random
 import time
 import atexit
 
@@ -10,95 +12,257 @@ logger = logging.getLogger(__name__)
 # Variables globales
 _client = None
 _db = None
+_async_client = None
 _max_retries = 3
-_retry_delay = 5  # segundos
 
 
-def _connect_with_retry():
-    global _client, _db
-    for attempt in range(_max_retries):
-        try:
-            if _client:
-                _client.close()
-
-            _client = MongoClient(
-                DB_CONFIG["uri"],
-                maxPoolSize=DB_CONFIG["max_pool_size"],
-                serverSelectionTimeoutMS=5000,
-                connectTimeoutMS=5000,
-                socketTimeoutMS=5000,
-                retryWrites=True,
-                w='majority'
-            )
-            # Verificar conexión
-            _client.server_info()
-            _db = _client[DB_CONFIG["database"]]
-            _setup_indexes()
-            logger.info("Conexión a MongoDB establecida correctamente")
-            return
-        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            logger.error(f"Intento {attempt + 1} fallido: {e}")
-            if attempt < _max_retries - 1:
-                time.sleep(_retry_delay)
-            else:
-                raise
-
-
-def _setup_indexes():
-    try:
-        # Crear índices necesarios
-        _db.usuarios.create_index("user_id", unique=True)
-        _db.recordatorios.create_index(
-            [("user_id", 1), ("fecha_hora_inicio", 1)])
-        _db.clima.create_index([("user_id", 1), ("provincia", 1)])
-        logger.info("Índices creados correctamente")
-    except OperationFailure as e:
-        logger.error(f"Error al crear índices: {e}")
-        raise
+'''
+-----------------------------------------------------------------------------------
+Clientes (se crean en el primer uso, sin conectar al importar)
+-----------------------------------------------------------------------------------
+'''
+
+
+def _opciones_cliente():
+    return dict(
+        maxPoolSize=DB_CONFIG["max_pool_size"],
+        serverSelectionTimeoutMS=5000,
+        connectTimeoutMS=5000,
+        socketTimeoutMS=5000,
+        retryWrites=True,
+        w='majority'
+    )
 
 
 def get_db():
+    """
+    Devuelve la base de datos sin hacer ninguna consulta al servidor. El
+    cliente se crea la primera vez (PyMongo conecta en la primera
+    operación) y el estado de la conexión lo vigila MonitorConexion.
+    """
     global _client, _db
-    try:
-        # Verificar conexión antes de devolver
-        _client.server_info()
-        return _db
-    except (ConnectionFailure, ServerSelectionTimeoutError, AttributeError):
-        logger.warning(
-            "Conexión perdida o no inicializada, intentando reconectar...")
-        _connect_with_retry()
-        return _db
+    if _db is None:
+        _client = MongoClient(DB_CONFIG["uri"], **_opciones_cliente())
+        _db = _client[DB_CONFIG["database"]]
+    return _db
+
+
+class BaseDatosDiferida:
+    """
+    Se comporta como la base de datos que devuelve 'obtener' pero no la pide
+    hasta el primer acceso. Permite tener un 'db' a nivel de módulo (como en
+    models.py) sin crear el cliente al importar.
+    """
+
+    def __init__(self, obtener):
+        self._obtener = obtener
+
+    def __getattr__(self, nombre):
+        return getattr(self._obtener(), nombre)
+
+    def __getitem__(self, nombre):
+        return self._obtener()[nombre]
 
 
 def close_connection():
-    global _client
+    global _client, _db
     if _client:
         try:
             _client.close()
             logger.info("Conexión a MongoDB cerrada")
         except Exception as e:
             logger.error(f"Error al cerrar conexión: {e}")
+        _client = None
+        _db = None
 
 
 # Registrar función de cierre
 atexit.register(close_connection)
 
-# Inicializar conexión al importar el módulo
-_connect_with_retry()
 
+def get_async_client():
+    """
+    Cliente asíncrono de PyMongo (AsyncMongoClient) para usar desde los
+    handlers sin bloquear el event loop. Se crea la primera vez que se pide;
+    la conexión real se abre en la primera operación.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(DB_CONFIG["uri"], **_opciones_cliente())
+    return _async_client
+
+
+def get_async_db():
+    return get_async_client()[DB_CONFIG["database"]]
 
-def execute_transaction(func):
-    """Decorador para ejecutar operaciones en transacciones"""
-    def wrapper(*args, **kwargs):
-        session = _client.start_session()
+
+async def close_async_connection():
+    global _async_client
+    if _async_client:
         try:
-            with session.start_transaction():
-                result = func(*args, **kwargs)
-                session.commit_transaction()
-                return result
+            await _async_client.close()
+            logger.info("Conexión asíncrona a MongoDB cerrada")
         except Exception as e:
-            session.abort_transaction()
-            raise
-        finally:
-            session.end_session()
-    return wrapper
+            logger.error(f"Error al cerrar conexión asíncrona: {e}")
+        _async_client = None
+
+
+'''
+-----------------------------------------------------------------------------------
+Monitor de la conexión (heartbeat en segundo plano)
+-----------------------------------------------------------------------------------
+'''
+
+
+async def _ping():
+    await get_async_client().admin.command("ping")
+
+
+class MonitorConexion:
+    """
+    Comprueba la salud de MongoDB en una tarea asyncio en segundo plano y
+    guarda el resultado, de modo que nadie tenga que hacer un ping antes de
+    cada consulta.
+
+    - Mientras la conexión está sana hace un ping cada 'intervalo' segundos.
+    - Si un ping falla, marca la conexión como caída y reintenta con backoff
+      exponencial con jitter (asyncio.sleep, nunca bloquea el event loop)
+      hasta que el servidor vuelve a responder. Los pools de PyMongo
+      restablecen las conexiones solos en cuanto el servidor está disponible.
+    """
+
+    def __init__(self, ping=_ping, intervalo=None, backoff_inicial=None, backoff_max=None):
+        self._ping = ping
+        self._intervalo = intervalo or DB_CONFIG["heartbeat_segundos"]
+        self._backoff_inicial = backoff_inicial or DB_CONFIG["backoff_inicial"]
+        self._backoff_max = backoff_max or DB_CONFIG["backoff_max"]
+        self._tarea = None
+
+        self.sano = True
+        self.fallos_consecutivos = 0
+        self.ultimo_error = None
+        self.ultimo_ok = None
+
+    def _espera(self):
+        if self.fallos_consecutivos == 0:
+            return self._intervalo
+        base = min(self._backoff_max,
+                   self._backoff_inicial * 2 ** (self.fallos_consecutivos - 1))
+        # Jitter completo para que varios procesos no reintenten a la vez
+        return random.uniform(base / 2, base)
+
+    async def comprobar(self):
+        """Hace un ping y actualiza el estado. Devuelve True si respondió."""
+        try:
+            await self._ping()
+        except Exception as e:
+            self.fallos_consecutivos += 1
+            self.ultimo_error = str(e)
+            if self.sano:
+                logger.warning(f"MongoDB no responde: {e}")
+            self.sano = False
+            return False
+
+        if not self.sano:
+            logger.info(
+                f"Conexión a MongoDB recuperada tras {self.fallos_consecutivos} intentos")
+        self.sano = True
+        self.fallos_consecutivos = 0
+        self.ultimo_ok = time.monotonic()
+        return True
+
+    async def _bucle(self):
+        while True:
+            await self.comprobar()
+            await asyncio.sleep(self._espera())
+
+    def iniciar(self):
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(
+                self._bucle(), name="heartbeat_mongodb")
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def estado(self):
+        return {
+            "sano": self.sano,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "ultimo_error": self.ultimo_error,
+            "segundos_desde_ultimo_ok": (
+                time.monotonic() - self.ultimo_ok if self.ultimo_ok is not None else None)
+        }
+
+
+monitor_conexion = MonitorConexion()
+
+
+def db_disponible():
+    """Estado de salud cacheado por el heartbeat (no consulta al servidor)."""
+    return monitor_conexion.sano
+
+
+'''
+-----------------------------------------------------------------------------------
+Ciclo de vida: startup() / shutdown() (post_init y post_shutdown de PTB)
+-----------------------------------------------------------------------------------
+'''
+
+
+async def _setup_indexes():
+    db = get_async_db()
+    try:
+        # Crear índices necesarios
+        await db.usuarios.create_index("user_id", unique=True)
+        await db.recordatorios.create_index(
+            [("user_id", 1), ("fecha_hora_inicio", 1), ("_id", 1)])
+        # El índice parcial de next_fire_at lo crea la migración 3
+        await db.recordatorios.create_index(
+            "expira_en", name="expira_en_terminados",
+            partialFilterExpression={"expira_en": {"$type": "date"}})
+        await db.recordatorios_archivo.create_index(
+            "archivado_en", expireAfterSeconds=ARCHIVO_CONFIG["retencion_dias"] * 86400)
+        await db.clima.create_index([("user_id", 1), ("provincia", 1)])
+        await db.clima.create_index([("user_id", 1), ("_id", 1)])
+        # Reconciliación del snapshot del planificador (filtro_cambiados_desde)
+        await db.recordatorios.create_index("creado_en")
+        await db.recordatorios.create_index("actualizado_en", sparse=True)
+        await db.clima.create_index("creado_en")
+        await db.clima.create_index("actualizado_en", sparse=True)
+        # Conversaciones abandonadas (ver PersistenciaMongo)
+        await db._conversaciones.create_index(
+            "actualizado_en",
+            expireAfterSeconds=PERSISTENCIA_CONFIG["retencion_dias"] * 86400)
+        logger.info("Índices creados correctamente")
+    except OperationFailure as e:
+        logger.error(f"Error al crear índices: {e}")
+        raise
+
+
+async def startup():
+    """
+    Comprueba que MongoDB responde (hasta _max_retries intentos con backoff
+    exponencial y asyncio.sleep), crea los índices y arranca el heartbeat.
+    """
+    for intento in range(1, _max_retries + 1):
+        if await monitor_conexion.comprobar():
+            break
+        logger.error(f"Intento {intento} fallido: {monitor_conexion.ultimo_error}")
+        if intento == _max_retries:
+            raise ConnectionFailure(
+                f"No se pudo conectar a MongoDB: {monitor_conexion.ultimo_error}")
+        await asyncio.sleep(monitor_conexion._espera())
+
+    await _setup_indexes()
+    monitor_conexion.iniciar()
+    logger.info("Conexión a MongoDB establecida correctamente")
+
+
+async def shutdown():
+    """Para el heartbeat y cierra los clientes asíncrono y síncrono."""
+    await monitor_conexion.detener()
+    await close_async_connection()
+    close_connection()
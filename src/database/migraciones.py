@@ -0,0 +1,144 @@
+import logging
+import time
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Colección donde se apunta qué migraciones se han aplicado ya
+COLECCION_MIGRACIONES = "_migrations"
+
+# version -> (descripcion, funcion(db))
+_migraciones = {}
+
+
+def migracion(version, descripcion):
+    """
+    Registra una migración de datos. 'version' es un entero único y las
+    migraciones se aplican en orden creciente, una sola vez cada una.
+    La función recibe la base de datos y debería resolver el cambio con una
+    única operación en el servidor (update con pipeline o bulk_write).
+    """
+    def decorador(funcion):
+        if version in _migraciones:
+            raise ValueError(f"Versión de migración duplicada: {version}")
+        _migraciones[version] = (descripcion, funcion)
+        return funcion
+    return decorador
+
+
+'''
+-----------------------------------------------------------------------------------
+Migraciones
+-----------------------------------------------------------------------------------
+'''
+
+
+@migracion(1, "Restar 1 hora a hora_config.hora de las suscripciones de clima")
+def _ajustar_hora_recordatorios_clima(db):
+    # (hora - 1) % 24 sin valores negativos: (hora + 23) % 24
+    resultado = db.clima.update_many(
+        {"hora_config.hora": {"$exists": True}},
+        [{"$set": {"hora_config.hora": {"$mod": [{"$add": ["$hora_config.hora", 23]}, 24]}}}]
+    )
+    return resultado.modified_count
+
+
+@migracion(2, "Quitar el índice (user_id, fecha_hora_inicio), sustituido por el de la paginación")
+def _quitar_indice_recordatorios_sin_id(db):
+    # (user_id, fecha_hora_inicio, _id) lo cubre como prefijo
+    nombre = "user_id_1_fecha_hora_inicio_1"
+    if nombre not in db.recordatorios.index_information():
+        return 0
+    db.recordatorios.drop_index(nombre)
+    return 1
+
+
+# Frecuencias que se repiten (ver intervalo_repeticion)
+_FRECUENCIAS_REPETIDAS = ["diaria", "semanal", "cada_x_dias", "cada_x_horas"]
+
+# expira_en (ver calcular_expira_en): la fecha de fin si se repite (None si
+# se repite sin fin) y, si no, la última entre inicio y fin ($max ignora null)
+_EXPIRA_EN = {"$cond": [
+    {"$in": ["$frecuencia.tipo", _FRECUENCIAS_REPETIDAS]},
+    {"$ifNull": ["$fecha_hora_fin", None]},
+    {"$max": ["$fecha_hora_inicio", "$fecha_hora_fin"]}
+]}
+
+
+@migracion(3, "Índice parcial de next_fire_at y expira_en en los recordatorios existentes")
+def _indice_parcial_y_expira_en(db):
+    # Sólo los recordatorios activos (next_fire_at con fecha) entran en el índice
+    if "next_fire_at_1" in db.recordatorios.index_information():
+        db.recordatorios.drop_index("next_fire_at_1")
+    db.recordatorios.create_index(
+        "next_fire_at", name="next_fire_at_activos",
+        partialFilterExpression={"next_fire_at": {"$type": "date"}})
+
+    # expira_en como calcular_expira_en. Las fechas se toman tal cual, sin
+    # aplicar la zona horaria; ARCHIVO_CONFIG["margen_horas"] cubre la diferencia.
+    resultado = db.recordatorios.update_many(
+        {"expira_en": {"$exists": False}},
+        [{"$set": {"expira_en": _EXPIRA_EN}}]
+    )
+    return resultado.modified_count
+
+
+'''
+-----------------------------------------------------------------------------------
+Aplicar las migraciones pendientes
+-----------------------------------------------------------------------------------
+'''
+
+
+def aplicar_migraciones(db):
+    """
+    Aplica, en orden, las migraciones que no están en _migrations.
+    Si no hay ninguna pendiente cuesta una sola consulta.
+
+    Antes de ejecutar una migración se inserta su documento con estado
+    "aplicando" (el _id es la versión), de modo que si dos instancias
+    arrancan a la vez sólo una la ejecuta. Si la migración falla se borra
+    la marca para que se reintente en el siguiente arranque.
+
+    Devuelve la lista de versiones aplicadas.
+    """
+    coleccion = db[COLECCION_MIGRACIONES]
+    registradas = {doc["_id"] for doc in coleccion.find({}, {"_id": 1})}
+    pendientes = sorted(v for v in _migraciones if v not in registradas)
+    if not pendientes:
+        logger.info("Migraciones al día")
+        return []
+
+    aplicadas = []
+    for version in pendientes:
+        descripcion, funcion = _migraciones[version]
+        try:
+            coleccion.insert_one({
+                "_id": version,
+                "descripcion": descripcion,
+                "estado": "aplicando",
+                "iniciada_en": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            logger.info(f"La migración {version} la está aplicando otra instancia")
+            continue
+
+        inicio = time.monotonic()
+        try:
+            resultado = funcion(db)
+        except Exception:
+            coleccion.delete_one({"_id": version})
+            logger.error(f"Error en la migración {version}: {descripcion}", exc_info=True)
+            raise
+
+        coleccion.update_one(
+            {"_id": version},
+            {"$set": {"estado": "aplicada", "aplicada_en": datetime.now(timezone.utc),
+                      "resultado": resultado}}
+        )
+        aplicadas.append(version)
+        logger.info(
+            f"Migración {version} aplicada ({descripcion}): {resultado} "
+            f"en {time.monotonic() - inicio:.2f} s")
+    return aplicadas
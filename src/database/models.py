@@ -1,18 +1,42 @@
 import logging
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
-from src.database.connection import get_db, execute_transaction
+from src.database.connection import get_db, BaseDatosDiferida
 from src.utils.validators import validate_nickname, validate_username, validate_chat_id
 from src.utils.input_sanitizer import sanitize_text, sanitize_provincia
 from src.utils.logger import setup_logger
-from src.config.settings import BOT_CONFIG, SECURITY_CONFIG
+from src.config.settings import BOT_CONFIG, SECURITY_CONFIG, USUARIOS_CACHE_CONFIG
+from src.utils.cache_ttl import CacheTTL, AUSENTE
+from src.utils.paginacion import filtro_keyset
+from src.utils.metricas import medir_mongo
 
 
 logger = logging.getLogger(__name__)
-db = get_db()
+db = BaseDatosDiferida(get_db)
 
+# Caché de get_user compartida con async_models. Guarda también los
+# usuarios no registrados (None) con un TTL más corto. Cualquier escritura
+# en usuarios tiene que invalidar la entrada correspondiente.
+cache_usuarios = CacheTTL(
+    USUARIOS_CACHE_CONFIG["max_entradas"], USUARIOS_CACHE_CONFIG["ttl"],
+    indice=lambda usuario: usuario.get("chat_id") if usuario else None)
 
-@execute_transaction
+
+def guardar_usuario_en_cache(user_id, usuario, marca=None):
+    """
+    'marca' es cache_usuarios.marca() tomada antes de la consulta: si una
+    escritura invalidó la caché mientras tanto, lo leído no se guarda.
+    """
+    ttl = None if usuario else USUARIOS_CACHE_CONFIG["ttl_negativo"]
+    cache_usuarios.guardar(user_id, usuario, ttl=ttl, marca=marca)
+
+
+def invalidar_usuario_por_chat_id(chat_id):
+    """Quita de la caché los usuarios de ese chat (update_user y delete_user van por chat_id)."""
+    cache_usuarios.invalidar_por(chat_id)
+
+
+@medir_mongo
 def register_user(chat_id, user_id, apodo, username=None):
     """
     Registra un nuevo usuario en la base de datos.
@@ -44,6 +68,7 @@ def register_user(chat_id, user_id, apodo, username=None):
             "registro": datetime.now(timezone.utc)
         }
         db.usuarios.insert_one(data_usuario)
+        cache_usuarios.invalidar(user_id)
         logger.info(
             f"Usuario registrado: {user_id} (apodo: {apodo}, username: {username})")
         return True
@@ -52,8 +77,8 @@ def register_user(chat_id, user_id, apodo, username=None):
         return False
 
 
-@execute_transaction
-def crear_recordatorio(user_id, titulo, descripcion, fecha_hora_inicio, frecuencia, fecha_hora_fin, zona_horaria):
+@medir_mongo
+def crear_recordatorio(user_id, titulo, descripcion, fecha_hora_inicio, frecuencia, fecha_hora_fin, zona_horaria, next_fire_at=None, expira_en=None):
     try:
         documento = {
             "user_id": user_id,
@@ -63,6 +88,8 @@ def crear_recordatorio(user_id, titulo, descripcion, fecha_hora_inicio, frecuenc
             "frecuencia": frecuencia,
             "fecha_hora_fin": fecha_hora_fin,
             "zona_horaria": zona_horaria,
+            "next_fire_at": next_fire_at,
+            "expira_en": expira_en,
             "creado_en": datetime.now(timezone.utc)
         }
         resultado = db.recordatorios.insert_one(documento)
@@ -73,13 +100,13 @@ def crear_recordatorio(user_id, titulo, descripcion, fecha_hora_inicio, frecuenc
         return None
 
 
-@execute_transaction
+@medir_mongo
 def crear_suscripcion_clima(user_id, nombre_usuario, provincia, hora_config):
     try:
         provincia_sanitizada = sanitize_provincia(provincia)
         if not provincia_sanitizada:
             logger.warning(f"Provincia inválida: {provincia}")
-            return False
+            return None
 
         documento = {
             "user_id": user_id,
@@ -88,52 +115,243 @@ def crear_suscripcion_clima(user_id, nombre_usuario, provincia, hora_config):
             "hora_config": hora_config,
             "creado_en": datetime.now(timezone.utc)
         }
-        db.clima.insert_one(documento)
+        resultado = db.clima.insert_one(documento)
         logger.info(f"Suscripción de clima creada para usuario {user_id}")
-        return True
+        return resultado.inserted_id
     except Exception as e:
         logger.error(
             f"Error al crear suscripción de clima: {e}", exc_info=True)
-        return False
+        return None
 
 
+@medir_mongo
 def get_user(user_id):
-    """Obtiene un usuario por su user_id"""
-    return db.usuarios.find_one({"user_id": user_id})
+    """Obtiene un usuario por su user_id (pasando por cache_usuarios)"""
+    usuario = cache_usuarios.obtener(user_id)
+    if usuario is AUSENTE:
+        marca = cache_usuarios.marca()
+        usuario = db.usuarios.find_one({"user_id": user_id})
+        guardar_usuario_en_cache(user_id, usuario, marca)
+    return usuario
 
 
+@medir_mongo
 def get_user_by_chat_id(chat_id):
     """Obtiene un usuario por su chat_id"""
     return db.usuarios.find_one({"chat_id": chat_id})
 
 
+@medir_mongo
 def update_user(chat_id, data):
-    return db.usuarios.update_one({"chat_id": chat_id}, {"$set": data})
+    resultado = db.usuarios.update_one({"chat_id": chat_id}, {"$set": data})
+    invalidar_usuario_por_chat_id(chat_id)
+    return resultado
 
 
+@medir_mongo
 def delete_user(chat_id):
-    return db.usuarios.delete_one({"chat_id": chat_id})
+    resultado = db.usuarios.delete_one({"chat_id": chat_id})
+    invalidar_usuario_por_chat_id(chat_id)
+    return resultado
 
 
+@medir_mongo
 def obtener_recordatorios(user_id=None):
     query = {"user_id": user_id} if user_id is not None else {}
     return list(db.recordatorios.find(query))
 
 
+'''
+-----------------------------------------------------------------------------------
+Listados paginados (keyset)
+-----------------------------------------------------------------------------------
+'''
+
+# Orden de los listados; coincide con los índices de _setup_indexes
+ORDEN_RECORDATORIOS = ("fecha_hora_inicio", "_id")
+ORDEN_CLIMA = ("_id",)
+
+# Campos que se muestran en los listados
+PROYECCION_LISTADO_RECORDATORIOS = {"titulo": 1, "descripcion": 1, "fecha_hora_inicio": 1}
+PROYECCION_LISTADO_CLIMA = {"provincia": 1, "hora_config": 1}
+
+
+def consulta_pagina(user_id, campos, cursor=None, hacia_atras=False):
+    """
+    Filtro y orden de una página de un listado por usuario. Sin cursor es
+    la primera página; con cursor, la siguiente (o la anterior si
+    hacia_atras) a partir de ese punto. Hacia atrás se ordena al revés y
+    resultado_pagina() le da la vuelta.
+    """
+    filtro = {"user_id": user_id}
+    if cursor is not None:
+        filtro.update(filtro_keyset(campos, cursor, hacia_atras))
+    sentido = -1 if hacia_atras else 1
+    return filtro, [(campo, sentido) for campo in campos]
+
+
+def resultado_pagina(documentos, campos, tamano, cursor=None, hacia_atras=False):
+    """
+    Recibe hasta tamano + 1 documentos (el extra sólo indica que hay más) y
+    devuelve {"documentos", "anterior", "siguiente"}, donde anterior y
+    siguiente son los cursores para moverse o None si no hay más páginas.
+    """
+    hay_mas = len(documentos) > tamano
+    documentos = documentos[:tamano]
+    if hacia_atras:
+        documentos.reverse()
+    if not documentos:
+        return {"documentos": [], "anterior": None, "siguiente": None}
+
+    primero = tuple(documentos[0].get(campo) for campo in campos)
+    ultimo = tuple(documentos[-1].get(campo) for campo in campos)
+    if hacia_atras:
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        hay_anterior, hay_siguiente = cursor is not None, hay_mas
+    return {
+        "documentos": documentos,
+        "anterior": primero if hay_anterior else None,
+        "siguiente": ultimo if hay_siguiente else None
+    }
+
+
+def _pagina(coleccion, user_id, campos, proyeccion, cursor, hacia_atras, tamano):
+    filtro, orden = consulta_pagina(user_id, campos, cursor, hacia_atras)
+    documentos = list(coleccion.find(filtro, proyeccion).sort(orden).limit(tamano + 1))
+    return resultado_pagina(documentos, campos, tamano, cursor, hacia_atras)
+
+
+@medir_mongo
+def pagina_recordatorios(user_id, cursor=None, hacia_atras=False, tamano=BOT_CONFIG["tamano_pagina"]):
+    """Una página de los recordatorios del usuario ordenados por fecha de inicio."""
+    return _pagina(db.recordatorios, user_id, ORDEN_RECORDATORIOS,
+                   PROYECCION_LISTADO_RECORDATORIOS, cursor, hacia_atras, tamano)
+
+
+@medir_mongo
+def pagina_recordatorios_clima(user_id, cursor=None, hacia_atras=False, tamano=BOT_CONFIG["tamano_pagina"]):
+    """Una página de las suscripciones de clima del usuario (por orden de creación)."""
+    return _pagina(db.clima, user_id, ORDEN_CLIMA,
+                   PROYECCION_LISTADO_CLIMA, cursor, hacia_atras, tamano)
+
+
+# Campos que necesita programar_recordatorio (el resto no se descarga)
+PROYECCION_PROGRAMACION = {
+    "user_id": 1,
+    "titulo": 1,
+    "descripcion": 1,
+    "fecha_hora_inicio": 1,
+    "frecuencia": 1,
+    "fecha_hora_fin": 1,
+    "zona_horaria": 1,
+    "next_fire_at": 1
+}
+
+
+def filtro_recordatorios_proximos(hasta):
+    """
+    Filtro de los recordatorios cuyo next_fire_at es anterior o igual a
+    'hasta' (usa el índice de next_fire_at). Los terminados tienen
+    next_fire_at a None y no aparecen.
+    """
+    # $type hace que la consulta pueda usar el índice parcial de activos
+    return {"next_fire_at": {"$lte": hasta, "$type": "date"}}
+
+
+def filtro_recordatorios_terminados(limite):
+    """Recordatorios que dejaron de dispararse antes de 'limite' (usa el índice de expira_en)."""
+    return {"expira_en": {"$lte": limite, "$type": "date"}}
+
+
+def filtro_recordatorios_sin_next_fire_at():
+    """Recordatorios creados antes de existir el campo next_fire_at."""
+    return {"next_fire_at": {"$exists": False}}
+
+
+def filtro_cambiados_desde(desde):
+    """
+    Documentos creados o editados después de 'desde' (usa los índices de
+    creado_en y actualizado_en). Es lo único que hay que reconciliar al
+    restaurar el planificador desde el snapshot.
+    """
+    return {"$or": [{"creado_en": {"$gt": desde}}, {"actualizado_en": {"$gt": desde}}]}
+
+
+def _iterar_lotes(coleccion, filtro, tamano_lote, proyeccion):
+    """
+    Recorre los documentos de 'coleccion' que cumplen 'filtro' con un cursor
+    del servidor y los devuelve en listas de como mucho 'tamano_lote'
+    documentos, sin cargar la colección entera en memoria.
+    """
+    cursor = coleccion.find(filtro or {}, proyeccion).batch_size(tamano_lote)
+    lote = []
+    for documento in cursor:
+        lote.append(documento)
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def iterar_lotes_recordatorios(filtro=None, tamano_lote=500, proyeccion=PROYECCION_PROGRAMACION):
+    """Recorre en lotes los recordatorios que cumplen 'filtro'."""
+    return _iterar_lotes(db.recordatorios, filtro, tamano_lote, proyeccion)
+
+
+def cambios_next_fire_at(next_fire_at):
+    """
+    Update de next_fire_at. Si el recordatorio ha terminado (None) se
+    adelanta expira_en a ahora para que el barrido lo archive.
+    """
+    cambios = {"$set": {"next_fire_at": next_fire_at}}
+    if next_fire_at is None:
+        cambios["$min"] = {"expira_en": datetime.now(timezone.utc)}
+    return cambios
+
+
+@medir_mongo
+def actualizar_next_fire_at(id_recordatorio, next_fire_at):
+    from bson.objectid import ObjectId
+    return db.recordatorios.update_one(
+        {"_id": ObjectId(id_recordatorio)},
+        cambios_next_fire_at(next_fire_at)
+    )
+
+
+@medir_mongo
 def eliminar_recordatorio_por_id(id_recordatorio):
     from bson.objectid import ObjectId
     return db.recordatorios.delete_one({"_id": ObjectId(id_recordatorio)})
 
 
+@medir_mongo
 def obtener_recordatorios_clima(user_id):
     return list(db.clima.find({"user_id": user_id}))
 
 
+# Campos que necesita programar_recordatorio_diario_clima
+PROYECCION_CLIMA = {
+    "user_id": 1,
+    "nombre_usuario": 1,
+    "provincia": 1,
+    "hora_config": 1
+}
+
+
+def iterar_lotes_clima(filtro=None, tamano_lote=500, proyeccion=PROYECCION_CLIMA):
+    """Recorre en lotes las suscripciones de clima que cumplen 'filtro'."""
+    return _iterar_lotes(db.clima, filtro, tamano_lote, proyeccion)
+
+
+@medir_mongo
 def eliminar_recordatorio_clima(id_recordatorio):
     from bson.objectid import ObjectId
     return db.clima.delete_one({"_id": ObjectId(id_recordatorio)})
 
 
+@medir_mongo
 def actualizar_recordatorio_clima(id_recordatorio, cambios):
     """
     Actualiza un recordatorio de clima existente con los cambios especificados.
@@ -142,7 +360,7 @@ def actualizar_recordatorio_clima(id_recordatorio, cambios):
     try:
         resultado = db.clima.update_one(
             {"_id": ObjectId(id_recordatorio)},
-            {"$set": cambios}
+            {"$set": dict(cambios, actualizado_en=datetime.now(timezone.utc))}
         )
         logger.info(f"Recordatorio de clima actualizado: {id_recordatorio}")
         return resultado.modified_count > 0
@@ -152,42 +370,7 @@ def actualizar_recordatorio_clima(id_recordatorio, cambios):
         return False
 
 
-# Colección de clima para acceso directo
-coleccion_clima = db.clima
-
-
-def ajustar_hora_recordatorios_clima():
-    """
-    Ajusta la hora de todos los recordatorios de clima existentes
-    para compensar el cambio horario.
-    """
-    try:
-        # Obtener todos los recordatorios
-        recordatorios = list(db.clima.find({}))
-
-        for recordatorio in recordatorios:
-            hora_config = recordatorio.get("hora_config", {})
-            if not hora_config:
-                continue
-
-            # Ajustar la hora (restar 1 hora)
-            hora_actual = hora_config.get("hora", 0)
-            nueva_hora = (hora_actual - 1) % 24
-
-            # Actualizar el recordatorio
-            db.clima.update_one(
-                {"_id": recordatorio["_id"]},
-                {"$set": {"hora_config.hora": nueva_hora}}
-            )
-
-        logger.info("Hora de recordatorios de clima ajustada correctamente")
-        return True
-    except Exception as e:
-        logger.error(
-            f"Error al ajustar hora de recordatorios: {e}", exc_info=True)
-        return False
-
-
+@medir_mongo
 def update_user_nickname(user_id: int, nuevo_apodo: str) -> bool:
     """
     Actualiza el apodo de un usuario.
@@ -204,6 +387,7 @@ def update_user_nickname(user_id: int, nuevo_apodo: str) -> bool:
             {"user_id": user_id},
             {"$set": {"apodo": sanitize_text(nuevo_apodo)}}
         )
+        cache_usuarios.invalidar(user_id)
         logger.info(f"Apodo actualizado para usuario {user_id}")
         return result.modified_count > 0
     except Exception as e:
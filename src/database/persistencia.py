@@ -0,0 +1,260 @@
+import asyncio
+import copy
+import logging
+import time
+from datetime import datetime, timezone, time as hora_del_dia
+import bson
+from bson.errors import InvalidDocument
+from pymongo.operations import ReplaceOne, DeleteOne
+from telegram.ext import BasePersistence, PersistenceInput
+from src.config.settings import PERSISTENCIA_CONFIG
+from src.database.connection import get_async_db, BaseDatosDiferida
+
+logger = logging.getLogger(__name__)
+
+# Colección con el estado de las conversaciones y el user_data
+COLECCION_PERSISTENCIA = "_conversaciones"
+
+CLASE_USUARIO = "usuario"
+CLASE_CONVERSACION = "conversacion"
+
+
+def _id_usuario(user_id):
+    return f"usuario:{user_id}"
+
+
+def _id_conversacion(nombre, clave):
+    return f"conversacion:{nombre}:{':'.join(str(parte) for parte in clave)}"
+
+
+# BSON no tiene un tipo para datetime.time (hora_diario, nueva_hora_clima)
+_CLAVE_HORA = "__hora__"
+
+
+def _a_bson(valor):
+    """Copia de 'valor' con cada datetime.time como {"__hora__": "HH:MM:SS"}."""
+    if isinstance(valor, hora_del_dia):
+        return {_CLAVE_HORA: valor.isoformat()}
+    if isinstance(valor, dict):
+        return {clave: _a_bson(v) for clave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_a_bson(v) for v in valor]
+    return valor
+
+
+def _desde_bson(valor):
+    """Inversa de _a_bson."""
+    if isinstance(valor, dict):
+        if len(valor) == 1 and _CLAVE_HORA in valor:
+            return hora_del_dia.fromisoformat(valor[_CLAVE_HORA])
+        return {clave: _desde_bson(v) for clave, v in valor.items()}
+    if isinstance(valor, list):
+        return [_desde_bson(v) for v in valor]
+    return valor
+
+
+'''
+-----------------------------------------------------------------------------------
+Persistencia de conversaciones y user_data en MongoDB (write-behind)
+-----------------------------------------------------------------------------------
+'''
+
+
+class PersistenciaMongo(BasePersistence):
+    """
+    Guarda en MongoDB el estado de los ConversationHandler persistentes
+    (recordatorios, clima) y el user_data de cada usuario (nuevo_recordatorio,
+    provincia_diario, hora_diario, id_recordatorio_clima...), de modo que un
+    reinicio no corta las conversaciones a medias.
+
+    PTB ya sólo entrega lo que ha cambiado, cada update_interval segundos.
+    Aquí update_user_data / update_conversation no hacen I/O: marcan la
+    entrada como sucia y programan un único volcado, que escribe todas las
+    entradas de esa pasada en un bulk_write. Tratar un update no añade
+    ninguna ida y vuelta a MongoDB.
+
+    - Una entrada igual a la última escrita no se vuelve a escribir (PTB
+      marca el user_data de todo usuario que manda un update).
+    - El user_data vacío y las conversaciones terminadas se borran.
+    - flush() (lo llama Application.shutdown) escribe lo pendiente.
+    - Si un volcado falla, sus entradas vuelven a quedar pendientes. Una
+      entrada que no se puede codificar en BSON se descarta (con error en
+      el log) en lugar de bloquear a las demás.
+    - Las horas (datetime.time) se guardan como texto y se recuperan como
+      datetime.time.
+
+    chat_data, bot_data y callback_data no se usan y no se guardan.
+    """
+
+    def __init__(self, db=None, update_interval=None):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or PERSISTENCIA_CONFIG["intervalo_segundos"]
+        )
+        self._db = db if db is not None else BaseDatosDiferida(get_async_db)
+        # _id -> documento a guardar, o None si hay que borrarlo
+        self._pendientes = {}
+        # _id -> último contenido escrito (para no repetir escrituras)
+        self._escritos = {}
+        self._lock = asyncio.Lock()
+        self._tarea = None
+        self.volcados = 0
+
+    # --- Carga al arrancar (Application.initialize) ----------------------
+
+    async def get_user_data(self):
+        user_data = {}
+        async for documento in self._db[COLECCION_PERSISTENCIA].find({"clase": CLASE_USUARIO}):
+            datos = _desde_bson(documento["datos"])
+            user_data[documento["user_id"]] = datos
+            # PTB usa este dict como context.user_data: hay que compararlo
+            # con una copia o sus cambios no se verían nunca como nuevos
+            self._escritos[documento["_id"]] = copy.deepcopy(datos)
+        return user_data
+
+    async def get_conversations(self, name):
+        conversaciones = {}
+        filtro = {"clase": CLASE_CONVERSACION, "nombre": name}
+        async for documento in self._db[COLECCION_PERSISTENCIA].find(filtro):
+            conversaciones[tuple(documento["clave"])] = documento["estado"]
+            self._escritos[documento["_id"]] = documento["estado"]
+        return conversaciones
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Cambios (Application.update_persistence) ------------------------
+
+    async def update_user_data(self, user_id, data):
+        self._marcar(_id_usuario(user_id), data or None, {
+            "clase": CLASE_USUARIO,
+            "user_id": user_id,
+            "datos": data
+        })
+
+    async def drop_user_data(self, user_id):
+        self._marcar(_id_usuario(user_id), None, None)
+
+    async def update_conversation(self, name, key, new_state):
+        # new_state None: la conversación ha terminado
+        self._marcar(_id_conversacion(name, key), new_state, {
+            "clase": CLASE_CONVERSACION,
+            "nombre": name,
+            "clave": list(key),
+            "estado": new_state
+        })
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Recargar aquí costaría una consulta por update
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ---------------------------------------------------------------------
+
+    def _marcar(self, _id, contenido, documento):
+        """
+        contenido es lo que se compara con la última escritura; None borra
+        la entrada.
+        """
+        if self._escritos.get(_id) == contenido:
+            self._pendientes.pop(_id, None)
+            return
+        # PTB pasa el context.user_data vivo: se guarda una copia para que lo
+        # que cambie un handler durante el volcado no cuente como escrito
+        self._pendientes[_id] = copy.deepcopy(
+            (contenido, documento if contenido is not None else None))
+        if self._tarea is None or self._tarea.done():
+            # update_persistence lanza todos los update_* con gather: la
+            # tarea empieza cuando ya han marcado todos, un volcado por pasada
+            self._tarea = asyncio.get_running_loop().create_task(self._volcar_en_segundo_plano())
+
+    async def _volcar_en_segundo_plano(self):
+        try:
+            await self.volcar()
+        except Exception as e:
+            # Se reintenta en la siguiente pasada con los mismos cambios
+            logger.warning(f"No se pudo guardar el estado de las conversaciones: {e}")
+
+    def pendientes(self):
+        return len(self._pendientes)
+
+    async def volcar(self):
+        """
+        Escribe las entradas sucias en un único bulk_write. Devuelve cuántas
+        se han escrito.
+        """
+        async with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            if not pendientes:
+                return 0
+
+            actualizado_en = datetime.now(timezone.utc)
+            operaciones = []
+            for _id, (contenido, documento) in list(pendientes.items()):
+                if documento is None:
+                    operaciones.append(DeleteOne({"_id": _id}))
+                    continue
+                documento = dict(_a_bson(documento), _id=_id, actualizado_en=actualizado_en)
+                try:
+                    bson.encode(documento)
+                except InvalidDocument as e:
+                    # Reintentarla haría fallar todos los volcados siguientes
+                    logger.error(f"Estado de conversación {_id} no guardable, se descarta: {e}")
+                    del pendientes[_id]
+                    continue
+                operaciones.append(ReplaceOne({"_id": _id}, documento, upsert=True))
+            if not operaciones:
+                return 0
+
+            inicio = time.monotonic()
+            try:
+                await self._db[COLECCION_PERSISTENCIA].bulk_write(operaciones, ordered=False)
+            except Exception:
+                # Lo que haya cambiado mientras tanto es más reciente
+                for _id, entrada in pendientes.items():
+                    self._pendientes.setdefault(_id, entrada)
+                raise
+
+            for _id, (contenido, _) in pendientes.items():
+                if contenido is None:
+                    self._escritos.pop(_id, None)
+                else:
+                    self._escritos[_id] = contenido
+            self.volcados += 1
+            logger.debug(
+                f"Conversaciones: {len(pendientes)} cambios guardados en "
+                f"{time.monotonic() - inicio:.3f} s")
+            return len(pendientes)
+
+    async def flush(self):
+        """Último volcado al apagar (Application.shutdown)."""
+        if self._tarea is not None:
+            await asyncio.gather(self._tarea, return_exceptions=True)
+        try:
+            await self.volcar()
+        except Exception as e:
+            logger.error(f"No se pudo guardar el estado de las conversaciones al apagar: {e}")
@@ -0,0 +1,157 @@
+import contextvars
+import logging
+from bson.objectid import ObjectId
+from pymongo.operations import InsertOne, UpdateOne, DeleteOne
+
+logger = logging.getLogger(__name__)
+
+# Unidad de trabajo abierta en la tarea actual (cada update de PTB y cada
+# job se ejecutan en su propia tarea, así que no se mezclan entre sí)
+_unidad_actual = contextvars.ContextVar("unidad_trabajo", default=None)
+
+
+def unidad_actual():
+    """Devuelve la UnidadTrabajo abierta en la tarea actual, o None."""
+    unidad = _unidad_actual.get()
+    # Las tareas lanzadas desde un update (block=False) heredan una copia del
+    # contexto y pueden seguir escribiendo cuando la unidad ya se cerró
+    return unidad if unidad is not None and unidad.abierta else None
+
+
+'''
+-----------------------------------------------------------------------------------
+Unidad de trabajo: agrupar escrituras en un único bulk_write
+-----------------------------------------------------------------------------------
+'''
+
+
+class UnidadTrabajo:
+    """
+    Acumula las escrituras (inserciones, actualizaciones y borrados) que se
+    hacen mientras está abierta y las manda juntas al confirmar:
+
+    - Una sola operación: se ejecuta tal cual (insert_one, update_one...),
+      sin sesión ni transacción: un único round trip.
+    - Varias operaciones: un bulk_write por colección, sin transacción (no
+      hace falta un replica set). Con transaccion=True se mandan en una
+      transacción multi-documento para que se apliquen todas o ninguna;
+      sólo deben pedirla quienes necesiten esa atomicidad.
+
+    Se usa como context manager asíncrono; al salir sin excepción se
+    confirma y, si hubo excepción, se descartan las escrituras:
+
+        async with UnidadTrabajo(db) as unidad:
+            unidad.insertar("recordatorios", documento)
+
+    Los ObjectId de las inserciones se generan en el cliente, así que
+    insertar() devuelve el _id antes de confirmar. Lo que dependa de que la
+    escritura ya esté hecha (invalidar la caché...) se registra con
+    al_confirmar().
+    """
+
+    def __init__(self, db, transaccion=False):
+        self._db = db
+        self._transaccion = transaccion
+        # [(coleccion, ("insertar", documento) | ("actualizar", filtro, cambios, upsert) | ("eliminar", filtro))]
+        self._operaciones = []
+        self._al_confirmar = []
+        self._token = None
+        self.abierta = False
+
+    def insertar(self, coleccion, documento):
+        documento.setdefault("_id", ObjectId())
+        self._operaciones.append((coleccion, ("insertar", documento)))
+        return documento["_id"]
+
+    def actualizar(self, coleccion, filtro, cambios, upsert=False):
+        self._operaciones.append((coleccion, ("actualizar", filtro, cambios, upsert)))
+
+    def eliminar(self, coleccion, filtro):
+        self._operaciones.append((coleccion, ("eliminar", filtro)))
+
+    def al_confirmar(self, funcion):
+        """Llama a 'funcion' cuando las escrituras se hayan confirmado."""
+        self._al_confirmar.append(funcion)
+
+    def __len__(self):
+        return len(self._operaciones)
+
+    def _usar_transaccion(self, operaciones):
+        return self._transaccion and len(operaciones) > 1
+
+    async def confirmar(self):
+        """
+        Envía las escrituras acumuladas a MongoDB (cliente asíncrono). Se
+        puede llamar antes de cerrar la unidad; lo que se escriba después se
+        manda al salir.
+        """
+        operaciones, self._operaciones = self._operaciones, []
+        funciones, self._al_confirmar = self._al_confirmar, []
+        resultado = await self._enviar(operaciones)
+        for funcion in funciones:
+            funcion()
+        return resultado
+
+    async def _enviar(self, operaciones):
+        if not operaciones:
+            return
+        if len(operaciones) == 1:
+            coleccion, operacion = operaciones[0]
+            return await ejecutar_operacion(self._db[coleccion], operacion)
+
+        grupos = _por_coleccion(operaciones)
+        if not self._usar_transaccion(operaciones):
+            for coleccion, bulk in grupos.items():
+                await self._db[coleccion].bulk_write(bulk, ordered=False)
+            return
+
+        async with self._db.client.start_session() as sesion:
+            async with await sesion.start_transaction():
+                for coleccion, bulk in grupos.items():
+                    await self._db[coleccion].bulk_write(bulk, session=sesion)
+
+    async def __aenter__(self):
+        self._token = _unidad_actual.set(self)
+        self.abierta = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _unidad_actual.reset(self._token)
+        self.abierta = False
+        if exc_type is None:
+            await self.confirmar()
+        else:
+            logger.warning(
+                f"Se descartan {len(self._operaciones)} escrituras por un error: {exc}")
+            self._operaciones = []
+            self._al_confirmar = []
+        return False
+
+
+def _por_coleccion(operaciones):
+    """Agrupa las operaciones por colección, en el orden en que se hicieron."""
+    grupos = {}
+    for coleccion, operacion in operaciones:
+        grupos.setdefault(coleccion, []).append(_a_operacion_bulk(operacion))
+    return grupos
+
+
+def _a_operacion_bulk(operacion):
+    tipo = operacion[0]
+    if tipo == "insertar":
+        return InsertOne(operacion[1])
+    if tipo == "actualizar":
+        _, filtro, cambios, upsert = operacion
+        return UpdateOne(filtro, cambios, upsert=upsert)
+    return DeleteOne(operacion[1])
+
+
+async def ejecutar_operacion(coleccion, operacion):
+    """Ejecuta una única operación sin bulk_write ni transacción."""
+    tipo = operacion[0]
+    if tipo == "insertar":
+        return await coleccion.insert_one(operacion[1])
+    if tipo == "actualizar":
+        _, filtro, cambios, upsert = operacion
+        return await coleccion.update_one(filtro, cambios, upsert=upsert)
+    return await coleccion.delete_one(operacion[1])
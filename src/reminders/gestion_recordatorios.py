@@ -1,28 +1,34 @@
 from datetime import datetime
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from src.database import get_user, obtener_recordatorios, eliminar_recordatorio_por_id
+from src.database.async_models import get_user, pagina_recordatorios, eliminar_recordatorio_por_id
+from src.utils.paginacion import codificar_cursor, decodificar_cursor
 from src.reminders.mensaje_recordatorios import cancelar_job_por_record_id
 
 '''
 ---------------------------------------------------------------------------
-Muestra todos los recordatorios del usuario con el chat_id que corresponde
+Listados paginados de recordatorios (ver y eliminar)
 ---------------------------------------------------------------------------
 '''
-async def mostrar_recordatorios(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    mensaje = update.message if update.message else update.callback_query.message
-    if not get_user(user_id):
-        await mensaje.reply_text("Primero debes registrarte con /register.")
-        return
+# callback_data de los botones de página: recpag_<modo>_<sentido>_<cursor>
+# modo: "v" (ver) o "e" (eliminar); sentido: "s" (siguiente) o "a" (anterior)
+PREFIJO_PAGINA = "recpag_"
+
+
+def _botones_navegacion(pagina, modo):
+    fila = []
+    if pagina["anterior"] is not None:
+        fila.append(InlineKeyboardButton(
+            "« Anterior", callback_data=f"{PREFIJO_PAGINA}{modo}_a_{codificar_cursor(pagina['anterior'])}"))
+    if pagina["siguiente"] is not None:
+        fila.append(InlineKeyboardButton(
+            "Siguiente »", callback_data=f"{PREFIJO_PAGINA}{modo}_s_{codificar_cursor(pagina['siguiente'])}"))
+    return [fila] if fila else []
 
-    lista = obtener_recordatorios(user_id)
-    if not lista:
-        await mensaje.reply_text("No tienes recordatorios.")
-        return
 
+def _contenido_ver(pagina):
     texto = "Tus recordatorios:\n\n"
-    for indice, recordatorio in enumerate(lista, start=1):
+    for recordatorio in pagina["documentos"]:
         titulo = recordatorio.get("titulo", "Sin título")
         descripcion = recordatorio.get("descripcion", "Sin descripción")
         fecha_inicio = recordatorio.get("fecha_hora_inicio")
@@ -30,9 +36,45 @@ async def mostrar_recordatorios(update: Update, context: ContextTypes.DEFAULT_TY
             fecha_str = fecha_inicio.strftime("%Y-%m-%d %H:%M")
         else:
             fecha_str = "Sin fecha"
-        texto += f"{indice}) {titulo} - {descripcion} (Inicio: {fecha_str})\n"
+        texto += f"- {titulo} - {descripcion} (Inicio: {fecha_str})\n"
+    botones = _botones_navegacion(pagina, "v")
+    return texto, InlineKeyboardMarkup(botones) if botones else None
+
+
+def _contenido_eliminar(pagina):
+    teclado = []
+    for recordatorio in pagina["documentos"]:
+        titulo = recordatorio.get("titulo", "Sin título")
+        # Aquí formamos el callback_data para identificar
+        # cuál recordatorio se elimina
+        callback_data = f"eliminar_{str(recordatorio['_id'])}"
+        teclado.append([InlineKeyboardButton(titulo, callback_data=callback_data)])
+    teclado += _botones_navegacion(pagina, "e")
+    return "Selecciona el recordatorio que deseas eliminar:", InlineKeyboardMarkup(teclado)
+
+
+_CONTENIDO_POR_MODO = {"v": _contenido_ver, "e": _contenido_eliminar}
+
+
+'''
+---------------------------------------------------------------------------
+Muestra los recordatorios del usuario, una página cada vez
+---------------------------------------------------------------------------
+'''
+async def mostrar_recordatorios(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    mensaje = update.message if update.message else update.callback_query.message
+    if not await get_user(user_id):
+        await mensaje.reply_text("Primero debes registrarte con /register.")
+        return
 
-    await mensaje.reply_text(texto)
+    pagina = await pagina_recordatorios(user_id)
+    if not pagina["documentos"]:
+        await mensaje.reply_text("No tienes recordatorios.")
+        return
+
+    texto, teclado = _contenido_ver(pagina)
+    await mensaje.reply_text(texto, reply_markup=teclado)
 
 '''
 ---------------------------------------------------------------------------
@@ -42,25 +84,36 @@ Función para iniciar la eliminación de recordatorios
 async def eliminar_recordatorios(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     mensaje = update.message if update.message else update.callback_query.message
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await mensaje.reply_text("Primero debes registrarte con /register.")
         return
 
-    lista = obtener_recordatorios(user_id)
-    if not lista:
+    pagina = await pagina_recordatorios(user_id)
+    if not pagina["documentos"]:
         await mensaje.reply_text("No tienes recordatorios para eliminar.")
         return
 
-    teclado = []
-    for indice, recordatorio in enumerate(lista, start=1):
-        titulo = recordatorio.get("titulo", "Sin título")
-        # Aquí formamos el callback_data para identificar
-        # cuál recordatorio se elimina
-        callback_data = f"eliminar_{str(recordatorio['_id'])}"
-        teclado.append([InlineKeyboardButton(f"{indice}) {titulo}", callback_data=callback_data)])
+    texto, teclado = _contenido_eliminar(pagina)
+    await mensaje.reply_text(texto, reply_markup=teclado)
+
+'''
+---------------------------------------------------------------------------
+Callback de los botones Anterior / Siguiente
+---------------------------------------------------------------------------
+'''
+async def paginar_recordatorios(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    modo, sentido, cursor = query.data[len(PREFIJO_PAGINA):].split("_", 2)
+
+    pagina = await pagina_recordatorios(
+        query.from_user.id, cursor=decodificar_cursor(cursor), hacia_atras=(sentido == "a"))
+    if not pagina["documentos"]:
+        await query.edit_message_text("No hay más recordatorios.")
+        return
 
-    reply_markup = InlineKeyboardMarkup(teclado)
-    await mensaje.reply_text("Selecciona el recordatorio que deseas eliminar:", reply_markup=reply_markup)
+    texto, teclado = _CONTENIDO_POR_MODO[modo](pagina)
+    await query.edit_message_text(texto, reply_markup=teclado)
 
 '''
 ---------------------------------------------------------------------------
@@ -72,12 +125,12 @@ async def procesar_eliminar_recordatorio(update: Update, context: ContextTypes.D
     await query.answer()
     data = query.data
     user_id = query.from_user.id
-    usuario = get_user(user_id)
+    usuario = await get_user(user_id)
 
     if data.startswith("eliminar_"):
         recordatorio_id = data[len("eliminar_"):]
         # 1) Eliminar en la BD
-        resultado = eliminar_recordatorio_por_id(recordatorio_id)
+        resultado = await eliminar_recordatorio_por_id(recordatorio_id)
         if resultado.deleted_count > 0:
             # 2) Cancelar job en job_queue
             cancelar_job_por_record_id(context, recordatorio_id)
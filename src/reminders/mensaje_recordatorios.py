@@ -1,6 +1,24 @@
 from datetime import datetime, timezone, timedelta
+import asyncio
+import time
 from telegram.ext import ContextTypes
-from src.database.models import obtener_recordatorios
+from src.database.models import (
+    filtro_recordatorios_proximos,
+    filtro_recordatorios_sin_next_fire_at,
+    filtro_cambiados_desde
+)
+from src.database.async_models import (
+    iterar_lotes_recordatorios, actualizar_next_fire_at, unidad_de_trabajo,
+    archivar_recordatorios_terminados
+)
+from src.config.settings import SCHEDULER_CONFIG, ARCHIVO_CONFIG
+from src.database.connection import db_disponible
+from src.core.cola_envios import enviar_mensaje
+from src.scheduler.registro_jobs import (
+    get_registro_jobs, TIPO_INICIO, TIPO_REPETICION, TIPO_FIN
+)
+from src.scheduler.snapshot import snapshot_scheduler, siguiente_ejecucion
+from src.scheduler.particiones import gestor_particiones
 from src.utils.logger import setup_logger
 import logging
 
@@ -30,7 +48,9 @@ async def enviar_recordatorio_inicio(context: ContextTypes.DEFAULT_TYPE):
     titulo = datos.get("titulo", "")
     descripcion = datos.get("descripcion", "")
     mensaje = f"¡Empieza tu recordatorio!\n\nTítulo: {titulo}\n{descripcion}"
-    await context.bot.send_message(chat_id=chat_id, text=mensaje)
+    await enviar_mensaje(context.bot, chat_id, mensaje)
+
+    await _avanzar_next_fire_at(datos)
 
 
 async def enviar_recordatorio_repeticion(context: ContextTypes.DEFAULT_TYPE):
@@ -44,7 +64,14 @@ async def enviar_recordatorio_repeticion(context: ContextTypes.DEFAULT_TYPE):
     titulo = datos.get("titulo", "")
     descripcion = datos.get("descripcion", "")
     mensaje = f"¡Recuerda cumplir con tu recordatorio!\n\nTítulo: {titulo}\n{descripcion}"
-    await context.bot.send_message(chat_id=chat_id, text=mensaje)
+    await enviar_mensaje(context.bot, chat_id, mensaje)
+
+    await _avanzar_next_fire_at(datos)
+
+    # Si la siguiente repetición queda fuera de la ventana, liberamos el job;
+    # la recarga periódica lo volverá a crear cuando toque.
+    if job.next_t and job.next_t > fin_de_ventana():
+        job.schedule_removal()
 
 
 async def enviar_recordatorio_fin(context: ContextTypes.DEFAULT_TYPE):
@@ -60,10 +87,36 @@ async def enviar_recordatorio_fin(context: ContextTypes.DEFAULT_TYPE):
     record_id = datos.get("record_id")
 
     mensaje = f"¡Finaliza el recordatorio!\nTítulo: {titulo}"
-    await context.bot.send_message(chat_id=chat_id, text=mensaje)
+    await enviar_mensaje(context.bot, chat_id, mensaje)
 
     # Cancelamos todos los jobs asociados a este recordatorio
     cancelar_job_por_record_id(context, record_id)
+    if record_id and db_disponible():
+        await actualizar_next_fire_at(record_id, None)
+
+
+# Callback de cada tipo de job (para recrearlos desde el snapshot)
+_CALLBACKS_POR_TIPO = {
+    TIPO_INICIO: enviar_recordatorio_inicio,
+    TIPO_REPETICION: enviar_recordatorio_repeticion,
+    TIPO_FIN: enviar_recordatorio_fin
+}
+
+
+async def _avanzar_next_fire_at(datos):
+    """
+    Tras disparar un job, guarda en la BD la siguiente fecha en la que el
+    recordatorio tiene que volver a ejecutarse.
+    """
+    record_id = datos.get("record_id")
+    programacion = datos.get("programacion")
+    if not record_id or not programacion:
+        return
+    if not db_disponible():
+        # El mensaje ya se envió; la ventana siguiente recalcula la fecha
+        logger.warning(f"MongoDB no disponible: no se guarda next_fire_at de {record_id}")
+        return
+    await actualizar_next_fire_at(record_id, calcular_next_fire_at(programacion))
 
 
 def timezone_from_string(zona_str: str):
@@ -111,6 +164,105 @@ def si_naive_pasar_utc(fecha, zona_str):
     return fecha_local.astimezone(timezone.utc)
 
 
+'''
+-----------------------------------------------------------------------------------
+Cálculo de las próximas ejecuciones de un recordatorio
+-----------------------------------------------------------------------------------
+'''
+
+
+def intervalo_repeticion(freq):
+    """
+    Devuelve el intervalo de repetición (timedelta) según la frecuencia,
+    o None si el recordatorio no se repite.
+    """
+    if not freq:
+        return None
+    tipo_frec = freq.get("tipo")
+    valor_frec = freq.get("valor")
+
+    if tipo_frec == "diaria":
+        return timedelta(days=1)
+    elif tipo_frec == "semanal":
+        return timedelta(days=7)
+    elif tipo_frec == "cada_x_dias" and valor_frec:
+        return timedelta(days=valor_frec)
+    elif tipo_frec == "cada_x_horas" and valor_frec:
+        return timedelta(hours=valor_frec)
+    return None
+
+
+def calcular_proximas_ejecuciones(recordatorio, desde=None):
+    """
+    Devuelve un dict {TIPO_INICIO, TIPO_REPETICION, TIPO_FIN} con la próxima
+    fecha (UTC) posterior a 'desde' en la que se dispara cada tipo de job,
+    o None si ese tipo ya no tiene que ejecutarse.
+
+    La repetición se alinea con la fecha de inicio: si el bot ha estado
+    parado, se salta a la siguiente ocurrencia en lugar de perderla.
+    """
+    desde = desde or ahora_utc()
+    zona_str = recordatorio.get("zona_horaria", "UTC+0")
+    fecha_inicio_utc = si_naive_pasar_utc(
+        recordatorio.get("fecha_hora_inicio"), zona_str)
+    fecha_fin_utc = si_naive_pasar_utc(
+        recordatorio.get("fecha_hora_fin"), zona_str)
+    intervalo = intervalo_repeticion(recordatorio.get("frecuencia"))
+
+    proximas = {TIPO_INICIO: None, TIPO_REPETICION: None, TIPO_FIN: None}
+
+    if fecha_inicio_utc and fecha_inicio_utc > desde:
+        proximas[TIPO_INICIO] = fecha_inicio_utc
+
+    if intervalo and fecha_inicio_utc:
+        primera_rep = fecha_inicio_utc + intervalo
+        if primera_rep > desde:
+            siguiente = primera_rep
+        else:
+            saltos = (desde - primera_rep) // intervalo + 1
+            siguiente = primera_rep + saltos * intervalo
+        if not fecha_fin_utc or siguiente < fecha_fin_utc:
+            proximas[TIPO_REPETICION] = siguiente
+
+    if fecha_fin_utc and fecha_fin_utc > desde:
+        proximas[TIPO_FIN] = fecha_fin_utc
+
+    return proximas
+
+
+def calcular_next_fire_at(recordatorio, desde=None):
+    """
+    Devuelve la próxima fecha (UTC) en la que el recordatorio dispara algún
+    job, o None si ya ha terminado. Es el valor que se guarda en el campo
+    indexado next_fire_at.
+    """
+    fechas = [f for f in calcular_proximas_ejecuciones(
+        recordatorio, desde).values() if f]
+    return min(fechas) if fechas else None
+
+
+def calcular_expira_en(recordatorio):
+    """
+    Fecha (UTC) a partir de la cual el recordatorio ya no se dispara: la de
+    fin si se repite (None si se repite indefinidamente) y, si no, la última
+    entre la de inicio y la de fin (un recordatorio sin frecuencia también
+    puede tener job de fin). Se guarda en expira_en para archivarlo después.
+    """
+    zona_str = recordatorio.get("zona_horaria", "UTC+0")
+    fecha_fin = recordatorio.get("fecha_hora_fin")
+    if intervalo_repeticion(recordatorio.get("frecuencia")):
+        fecha = fecha_fin
+    else:
+        fechas = [f for f in (recordatorio.get("fecha_hora_inicio"), fecha_fin) if f]
+        fecha = max(fechas) if fechas else None
+    return si_naive_pasar_utc(fecha, zona_str)
+
+
+def fin_de_ventana():
+    """Límite superior de la ventana de planificación actual."""
+    return ahora_utc() + timedelta(hours=SCHEDULER_CONFIG["horizonte_horas"])
+
+
 '''
 -----------------------------------------------------------------------------------
 Programar un recordatorio concreto en el JobQueue
@@ -118,7 +270,7 @@ Programar un recordatorio concreto en el JobQueue
 '''
 
 
-def programar_recordatorio(context, recordatorio, record_id=None):
+def programar_recordatorio(context, recordatorio, record_id=None, hasta=None):
     """
     Programa en el JobQueue el inicio, la repetición y el fin del recordatorio,
     usando los datos del dict 'recordatorio'.
@@ -126,106 +278,135 @@ def programar_recordatorio(context, recordatorio, record_id=None):
     - recordatorio: dict con claves como "user_id", "titulo", "descripcion",
       "fecha_hora_inicio", "frecuencia", "fecha_hora_fin", "zona_horaria".
     - record_id: id del recordatorio en la base de datos (string u ObjectId),
-      para poder cancelarlo luego buscando job.data["record_id"] == record_id.
+      con el que se indexan los jobs en el RegistroJobs para cancelarlos luego.
+    - hasta: si se indica, sólo se crean los jobs cuya próxima ejecución cae
+      antes de esa fecha (ventana de planificación). El resto los creará la
+      recarga periódica cuando entren en la ventana.
+
+    Los tipos de job que ya estén en el registro no se duplican, así que se
+    puede llamar varias veces para el mismo recordatorio. Si el usuario es
+    de una partición de otro worker, no se programa nada aquí.
     """
     user_id = recordatorio["user_id"]
+    if not gestor_particiones.es_mia(user_id):
+        return
     titulo = recordatorio.get("titulo", "")
     descripcion = recordatorio.get("descripcion", "")
-    fecha_inicio = recordatorio.get("fecha_hora_inicio")
     freq = recordatorio.get("frecuencia", {"tipo": "ninguna", "valor": None})
-    fecha_fin = recordatorio.get("fecha_hora_fin")
     zona_str = recordatorio.get("zona_horaria", "UTC+0")
 
-    # Convertir a UTC si es naive
-    fecha_inicio_utc = si_naive_pasar_utc(fecha_inicio, zona_str)
-    fecha_fin_utc = si_naive_pasar_utc(fecha_fin, zona_str)
-    now_utc = ahora_utc()
+    registro = get_registro_jobs(context.job_queue)
+    proximas = calcular_proximas_ejecuciones(recordatorio)
+
+    def _pendiente(tipo):
+        fecha = proximas[tipo]
+        if fecha is None or (hasta is not None and fecha > hasta):
+            return False
+        return not (record_id and registro.contiene(record_id, tipo))
+
+    # Datos necesarios para recalcular next_fire_at cuando se dispare un job
+    programacion = {
+        "fecha_hora_inicio": si_naive_pasar_utc(
+            recordatorio.get("fecha_hora_inicio"), zona_str),
+        "frecuencia": freq,
+        "fecha_hora_fin": si_naive_pasar_utc(
+            recordatorio.get("fecha_hora_fin"), zona_str)
+    }
 
     # 1) INICIO: run_once
-    if fecha_inicio_utc and fecha_inicio_utc > now_utc:
-        context.job_queue.run_once(
+    if _pendiente(TIPO_INICIO):
+        job = context.job_queue.run_once(
             enviar_recordatorio_inicio,
-            when=fecha_inicio_utc,
+            when=proximas[TIPO_INICIO],
             chat_id=user_id,  # Usamos user_id como chat_id para mensajes privados
             name=f"record_inicio_{record_id}",
             data={
                 "record_id": record_id,
                 "titulo": titulo,
                 "descripcion": descripcion,
-                "freq": freq
+                "freq": freq,
+                "programacion": programacion
             }
         )
+        registro.registrar(record_id, TIPO_INICIO, job)
 
     # 2) REPETICIÓN: dependiendo de freq
-    tipo_frec = freq["tipo"]
-    valor_frec = freq["valor"]
-
-    def _repetir(interval, first_moment):
-        context.job_queue.run_repeating(
+    if _pendiente(TIPO_REPETICION):
+        job = context.job_queue.run_repeating(
             enviar_recordatorio_repeticion,
-            interval=interval,
-            first=first_moment,
+            interval=intervalo_repeticion(freq),
+            first=proximas[TIPO_REPETICION],
             chat_id=user_id,  # Usamos user_id como chat_id para mensajes privados
             name=f"record_rep_{record_id}",
             data={
                 "record_id": record_id,
                 "titulo": titulo,
-                "descripcion": descripcion
+                "descripcion": descripcion,
+                "programacion": programacion
             }
         )
-
-    if tipo_frec == "diaria" and fecha_inicio_utc:
-        primera_rep = fecha_inicio_utc + timedelta(days=1)
-        if primera_rep > now_utc:
-            _repetir(24 * 3600, primera_rep)
-
-    elif tipo_frec == "semanal" and fecha_inicio_utc:
-        primera_rep = fecha_inicio_utc + timedelta(days=7)
-        if primera_rep > now_utc:
-            _repetir(7 * 24 * 3600, primera_rep)
-
-    elif tipo_frec == "cada_x_dias" and valor_frec and fecha_inicio_utc:
-        primera_rep = fecha_inicio_utc + timedelta(days=valor_frec)
-        if primera_rep > now_utc:
-            _repetir(valor_frec * 24 * 3600, primera_rep)
-
-    elif tipo_frec == "cada_x_horas" and valor_frec and fecha_inicio_utc:
-        primera_rep = fecha_inicio_utc + timedelta(hours=valor_frec)
-        if primera_rep > now_utc:
-            _repetir(valor_frec * 3600, primera_rep)
+        registro.registrar(record_id, TIPO_REPETICION, job)
 
     # 3) FIN: run_once
-    if fecha_fin_utc and fecha_fin_utc > now_utc:
-        context.job_queue.run_once(
+    if _pendiente(TIPO_FIN):
+        job = context.job_queue.run_once(
             enviar_recordatorio_fin,
-            when=fecha_fin_utc,
+            when=proximas[TIPO_FIN],
             chat_id=user_id,  # Usamos user_id como chat_id para mensajes privados
             name=f"record_fin_{record_id}",
             data={
                 "record_id": record_id,
-                "titulo": titulo
+                "titulo": titulo,
+                "programacion": programacion
             }
         )
+        registro.registrar(record_id, TIPO_FIN, job)
 
 
 '''
 -----------------------------------------------------------------------------------
-Cancelar un recordatorio del job_queue buscando su record_id
+Cancelar un recordatorio del job_queue por su record_id
 -----------------------------------------------------------------------------------
 '''
 
 
 def cancelar_job_por_record_id(context, record_id):
     """
-    Busca todos los jobs en job_queue y elimina aquel que
-    tenga job.data["record_id"] == record_id.
+    Elimina todos los jobs (inicio, repetición y fin) asociados al
+    record_id. Se consulta el RegistroJobs, así que el coste no depende
+    del número total de jobs en la cola.
     """
     if not record_id:
         return
 
-    for job in context.job_queue.jobs():
-        if job.data and job.data.get("record_id") == record_id:
-            job.schedule_removal()
+    get_registro_jobs(context.job_queue).cancelar(record_id)
+
+
+def cancelar_jobs_de_usuarios(context, pertenece):
+    """
+    Cancela los jobs de los recordatorios cuyo usuario (chat_id del job)
+    cumple pertenece(user_id). Se usa al ceder particiones a otro worker.
+    """
+    registro = get_registro_jobs(context.job_queue)
+    cancelados = 0
+    for record_id in registro.record_ids((TIPO_INICIO, TIPO_REPETICION, TIPO_FIN)):
+        jobs = registro.obtener(record_id)
+        if any(pertenece(job.chat_id) for job in jobs.values()):
+            cancelados += registro.cancelar(record_id)
+    return cancelados
+
+
+def sincronizar_recordatorio(context, recordatorio, editado=False):
+    """
+    Aplica al planificador un recordatorio creado o editado fuera del
+    handler que suele programarlo (otro proceso, un script, una migración).
+    Si se editó, se cancelan antes sus jobs para crearlos con los datos
+    nuevos; si es nuevo, programar_recordatorio no duplica los que ya haya.
+    """
+    record_id = str(recordatorio["_id"])
+    if editado:
+        cancelar_job_por_record_id(context, record_id)
+    programar_recordatorio(context, recordatorio, record_id=record_id, hasta=fin_de_ventana())
 
 
 '''
@@ -237,26 +418,163 @@ Reprogramar todos los recordatorios al iniciar el bot
 
 async def reprogramar_todos_los_recordatorios(context):
     """
-    Se llama al arrancar el bot para reprogramar cada recordatorio
-    existente en la BD. Esto es útil por si el bot se reinicia y
-    queremos restaurar los jobs.
+    Se llama al arrancar el bot para restaurar los jobs de los recordatorios
+    existentes en la BD. Sólo se cargan los que se disparan dentro de la
+    ventana de planificación (SCHEDULER_CONFIG["horizonte_horas"]); el resto
+    los irá cargando recargar_ventana_recordatorios.
+    """
+    # Recordatorios antiguos que todavía no tienen next_fire_at
+    async def _rellenar_next_fire_at(r):
+        await actualizar_next_fire_at(r["_id"], calcular_next_fire_at(r))
+
+    await rehidratar_recordatorios(
+        filtro_recordatorios_sin_next_fire_at(), _rellenar_next_fire_at,
+        descripcion="next_fire_at pendientes")
+
+    await recargar_ventana_recordatorios(context)
+
+
+async def recargar_ventana_recordatorios(context):
+    """
+    Job periódico que programa los recordatorios cuyo next_fire_at cae
+    dentro de la siguiente ventana. Los que ya tienen sus jobs en el
+    RegistroJobs no se duplican.
     """
-    lista = obtener_recordatorios(
-        None)  # None para obtener todos los recordatorios
+    if not db_disponible():
+        # Sin esperar al timeout de MongoDB; la siguiente pasada la cubre
+        logger.warning("MongoDB no disponible: se omite la recarga de la ventana")
+        return
+    hasta = fin_de_ventana()
+    # Con particiones, sólo las de este worker
+    filtro = gestor_particiones.filtrar(filtro_recordatorios_proximos(hasta))
+    if filtro is not None:
+        await programar_ventana(context, filtro, hasta, descripcion="ventana de recordatorios")
+    # Queda apuntado en el snapshot para saber hasta dónde llegan sus jobs
+    snapshot_scheduler.ventana_hasta = hasta
+
+
+async def reconciliar_recordatorios(context, desde, hasta):
+    """
+    Programa los recordatorios de la ventana que se crearon o editaron
+    después de 'desde' (los que pueden faltar en el snapshot).
+    """
+    filtro = {"$and": [filtro_cambiados_desde(desde), filtro_recordatorios_proximos(hasta)]}
+    return await programar_ventana(
+        context, filtro, hasta, descripcion="cambios desde el snapshot")
+
+
+async def programar_ventana(context, filtro, hasta, descripcion):
+    """Programa hasta 'hasta' los recordatorios que cumplen 'filtro'."""
     now_utc = ahora_utc()
 
-    for r in lista:
+    async def _programar(r):
         # Uso str para convertir ObjectId a string y almacenarlo
         record_id = str(r["_id"])
+        programar_recordatorio(context, r, record_id=record_id, hasta=hasta)
+
+        # Si el bot estuvo parado, next_fire_at puede haberse quedado atrás
+        guardado = r.get("next_fire_at")
+        if guardado and guardado.replace(tzinfo=timezone.utc) <= now_utc:
+            await actualizar_next_fire_at(r["_id"], calcular_next_fire_at(r, now_utc))
+
+    return await rehidratar_recordatorios(filtro, _programar, descripcion=descripcion)
+
+
+def restaurar_jobs_recordatorios(context, entradas, existentes, ahora=None):
+    """
+    Vuelve a crear los jobs guardados en el snapshot del planificador (ver
+    SnapshotScheduler.cargar) con el mismo nombre, data y callback, sin
+    consultar los recordatorios. 'existentes' es el conjunto de record_id
+    que siguen en la BD.
+
+    Las repeticiones perdidas mientras el bot estaba parado se saltan; los
+    jobs de un solo disparo que ya pasaron, los que caen después del fin
+    del recordatorio y los de recordatorios borrados se descartan.
+    Devuelve (jobs creados, lista de (record_id, tipo) descartados).
+    """
+    ahora = ahora or ahora_utc()
+    registro = get_registro_jobs(context.job_queue)
+    creados = 0
+    descartados = []
+
+    for entrada in entradas:
+        record_id, tipo = entrada["record_id"], entrada["tipo"]
+        intervalo = entrada.get("intervalo")
+        datos = entrada.get("datos") or {}
+        proxima = siguiente_ejecucion(entrada.get("proxima"), intervalo, ahora)
+        fin = (datos.get("programacion") or {}).get("fecha_hora_fin")
+        if (record_id not in existentes or proxima is None
+                or (tipo == TIPO_REPETICION and fin and proxima >= fin)):
+            descartados.append((record_id, tipo))
+            continue
+
+        callback = _CALLBACKS_POR_TIPO[tipo]
+        if intervalo:
+            job = context.job_queue.run_repeating(
+                callback, interval=intervalo, first=proxima,
+                chat_id=entrada["chat_id"], name=entrada["nombre"], data=datos)
+        else:
+            job = context.job_queue.run_once(
+                callback, when=proxima,
+                chat_id=entrada["chat_id"], name=entrada["nombre"], data=datos)
+        registro.registrar(record_id, tipo, job)
+        creados += 1
+
+    return creados, descartados
+
+
+async def rehidratar_recordatorios(filtro, procesar, descripcion="recordatorios"):
+    """
+    Recorre en streaming los recordatorios que cumplen 'filtro' (cursor con
+    proyección y lotes de SCHEDULER_CONFIG["tamano_lote"]) y espera a la
+    corrutina procesar(documento) para cada uno. Entre lote y lote cede el control al
+    event loop para que el bot siga atendiendo updates mientras tanto.
 
-        # Ajustamos fecha_inicio y fecha_fin a UTC si están naive
-        fecha_inicio = r.get("fecha_hora_inicio")
-        fecha_fin = r.get("fecha_hora_fin")
-        zona_str = r.get("zona_horaria", "UTC+0")
+    Devuelve un dict con el total de documentos y el tiempo empleado.
+    """
+    inicio = time.monotonic()
+    total = 0
+
+    async for lote in iterar_lotes_recordatorios(filtro, SCHEDULER_CONFIG["tamano_lote"]):
+        # Las escrituras del lote (next_fire_at) se mandan en un único bulk_write
+        async with unidad_de_trabajo():
+            for r in lote:
+                await procesar(r)
+        total += len(lote)
+
+        transcurrido = time.monotonic() - inicio
+        logger.info(
+            f"Rehidratación ({descripcion}): {total} documentos, "
+            f"{total / transcurrido if transcurrido else 0:.0f} docs/s")
+        await asyncio.sleep(0)
+
+    transcurrido = time.monotonic() - inicio
+    logger.info(
+        f"Rehidratación ({descripcion}) completada: {total} documentos en {transcurrido:.2f} s")
+    return {"documentos": total, "segundos": transcurrido}
+
+
+'''
+-----------------------------------------------------------------------------------
+Archivar los recordatorios terminados
+-----------------------------------------------------------------------------------
+'''
 
-        if fecha_inicio:
-            r["fecha_hora_inicio"] = si_naive_pasar_utc(fecha_inicio, zona_str)
-        if fecha_fin:
-            r["fecha_hora_fin"] = si_naive_pasar_utc(fecha_fin, zona_str)
 
-        programar_recordatorio(context, r, record_id=record_id)
+async def barrer_recordatorios_terminados(context):
+    """
+    Job periódico que saca de la colección principal los recordatorios que
+    terminaron hace más de ARCHIVO_CONFIG["margen_horas"] y los pasa a
+    recordatorios_archivo. Así la colección, el arranque y los listados
+    sólo trabajan con recordatorios vivos.
+    """
+    if not db_disponible():
+        logger.warning("MongoDB no disponible: se omite el archivado")
+        return 0
+    limite = ahora_utc() - timedelta(hours=ARCHIVO_CONFIG["margen_horas"])
+    inicio = time.monotonic()
+    total = await archivar_recordatorios_terminados(limite, SCHEDULER_CONFIG["tamano_lote"])
+    if total:
+        logger.info(
+            f"Archivados {total} recordatorios terminados en {time.monotonic() - inicio:.2f} s")
+    return total
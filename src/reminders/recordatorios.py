@@ -8,8 +8,10 @@ from telegram.ext import (
     ConversationHandler
 )
 from datetime import datetime
-from src.database.models import get_user, crear_recordatorio
-from src.reminders.mensaje_recordatorios import programar_recordatorio
+from src.database.async_models import get_user, crear_recordatorio, confirmar_escrituras
+from src.reminders.mensaje_recordatorios import (
+    programar_recordatorio, calcular_next_fire_at, calcular_expira_en, fin_de_ventana
+)
 from src.utils.logger import setup_logger
 import logging
 
@@ -39,7 +41,7 @@ async def menu_recordatorios(update: Update, context: ContextTypes.DEFAULT_TYPE)
     Verificamos el registro.
     """
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -89,7 +91,7 @@ async def recordatorios_menu_callback(update: Update, context: ContextTypes.DEFA
 
     # Verificar registro de nuevo aquí por seguridad
     user_id = query.from_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await query.edit_message_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -121,7 +123,7 @@ async def recordatorios_menu_callback(update: Update, context: ContextTypes.DEFA
 
 async def pedir_titulo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -149,7 +151,7 @@ async def confirmar_descripcion(update, context):
     await query.answer()
 
     user_id = query.from_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await query.edit_message_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -174,7 +176,7 @@ async def confirmar_descripcion(update, context):
 
 async def pedir_descripcion(update, context):
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -192,7 +194,7 @@ async def pedir_descripcion(update, context):
 
 async def pedir_fecha_inicio(update, context):
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -235,7 +237,7 @@ async def seleccionar_frecuencia(update, context):
     await query.answer()
 
     user_id = query.from_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await query.edit_message_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -277,7 +279,7 @@ async def seleccionar_frecuencia(update, context):
 
 async def pedir_valor_cada_x(update, context):
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -307,7 +309,7 @@ async def pedir_valor_cada_x(update, context):
 
 async def pedir_fecha_fin(update, context):
     user_id = update.effective_user.id
-    if not get_user(user_id):
+    if not await get_user(user_id):
         await update.message.reply_text("Primero debes registrarte con /register.")
         return ConversationHandler.END
 
@@ -393,17 +395,6 @@ async def seleccionar_zona_horaria(update: Update, context: ContextTypes.DEFAULT
     datos = context.user_data["nuevo_recordatorio"]
     datos["zona_horaria"] = zona
 
-    # Creamos el recordatorio en la BD
-    id_insertado = crear_recordatorio(
-        user_id=user_id,
-        titulo=datos["titulo"],
-        descripcion=datos["descripcion"],
-        fecha_hora_inicio=datos["fecha_inicio"],
-        frecuencia=datos["frecuencia"],
-        fecha_hora_fin=datos["fecha_fin"],
-        zona_horaria=datos["zona_horaria"]
-    )
-
     # Preparamos el diccionario para programar_recordatorio
     r = {
         "user_id": user_id,
@@ -415,8 +406,25 @@ async def seleccionar_zona_horaria(update: Update, context: ContextTypes.DEFAULT
         "zona_horaria": datos["zona_horaria"]
     }
 
-    # Programamos los jobs
-    programar_recordatorio(context, r, record_id=str(id_insertado))
+    # Creamos el recordatorio en la BD
+    id_insertado = await crear_recordatorio(
+        user_id=user_id,
+        titulo=datos["titulo"],
+        descripcion=datos["descripcion"],
+        fecha_hora_inicio=datos["fecha_inicio"],
+        frecuencia=datos["frecuencia"],
+        fecha_hora_fin=datos["fecha_fin"],
+        zona_horaria=datos["zona_horaria"],
+        next_fire_at=calcular_next_fire_at(r),
+        expira_en=calcular_expira_en(r)
+    )
+    if not await confirmar_escrituras():
+        await query.edit_message_text("No se pudo crear el recordatorio. Por favor, intenta de nuevo.")
+        return ConversationHandler.END
+
+    # Programamos sólo los jobs que caen dentro de la ventana actual
+    programar_recordatorio(context, r, record_id=str(id_insertado),
+                           hasta=fin_de_ventana())
 
     await query.edit_message_text(
         f"¡Recordatorio creado!\n\n"
@@ -462,5 +470,8 @@ conv_handler_recordatorios = ConversationHandler(
     },
     fallbacks=[CommandHandler("cancel", cancelar_recordatorio)],
     per_user=True,
-    per_chat=False
+    per_chat=False,
+    # Estado guardado en MongoDB (PersistenciaMongo)
+    name="conv_recordatorios",
+    persistent=True
 )
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from src.config.settings import PARTICIONES_CONFIG
+from src.database.async_models import (
+    latir_worker, contar_workers_vivos, olvidar_worker, estado_particiones,
+    reclamar_particion, renovar_particiones, liberar_particiones
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _como_utc(fecha):
+    # MongoDB devuelve las fechas naive (en UTC)
+    if fecha is not None and fecha.tzinfo is None:
+        return fecha.replace(tzinfo=timezone.utc)
+    return fecha
+
+
+'''
+-----------------------------------------------------------------------------------
+Reparto del planificador en particiones por user_id con leases en MongoDB
+-----------------------------------------------------------------------------------
+'''
+
+
+class GestorParticiones:
+    """
+    Reparte los recordatorios y las suscripciones de clima entre varios
+    procesos. Cada usuario pertenece a la partición user_id % numero (los
+    user_id de Telegram son enteros repartidos de forma uniforme, y así la
+    partición se puede filtrar en el servidor con $mod sin guardar ningún
+    campo nuevo).
+
+    Cada worker late en _workers y, cada renovacion_segundos:
+    - renueva los leases de sus particiones en _particiones;
+    - si tiene más de ceil(numero / workers vivos), libera las que sobran
+      para que las tome un worker nuevo;
+    - reclama particiones libres o con el lease caducado (de un worker
+      caído) hasta llegar a su parte.
+
+    Al ganar una partición se llama a al_ganar(context, particiones) para
+    cargar sus jobs y al perderla a al_perder(context, particiones) para
+    cancelarlos. Si no puede renovar y su lease caduca, suelta todo antes
+    de que otro worker lo reclame, para no enviar dos veces.
+
+    Con numero == 1 está desactivado: todo es de este proceso.
+    """
+
+    def __init__(self, numero=None, duracion=None, renovacion=None, worker_id=None):
+        self.numero = numero or PARTICIONES_CONFIG["numero"]
+        self._duracion = timedelta(seconds=duracion or PARTICIONES_CONFIG["duracion_lease_segundos"])
+        self._renovacion = renovacion or PARTICIONES_CONFIG["renovacion_segundos"]
+        self.worker_id = (worker_id or PARTICIONES_CONFIG["worker_id"]
+                          or f"{socket.gethostname()}-{os.getpid()}")
+        self._propias = set()
+        self._expira_en = None
+        self._al_ganar = None
+        self._al_perder = None
+        self._tarea = None
+
+    @property
+    def activo(self):
+        return self.numero > 1
+
+    def particion_de(self, user_id):
+        return int(user_id) % self.numero
+
+    def es_mia(self, user_id):
+        """True si este proceso tiene que programar los jobs del usuario."""
+        return not self.activo or self.particion_de(user_id) in self._propias
+
+    def propias(self):
+        return sorted(self._propias)
+
+    def filtro_de(self, particiones):
+        """Filtro de MongoDB de los documentos de las particiones indicadas."""
+        condiciones = [{"user_id": {"$mod": [self.numero, p]}} for p in sorted(particiones)]
+        return condiciones[0] if len(condiciones) == 1 else {"$or": condiciones}
+
+    def filtrar(self, filtro):
+        """
+        Restringe 'filtro' a las particiones de este proceso. Devuelve None
+        si no tiene ninguna (no hay nada que consultar).
+        """
+        if not self.activo:
+            return filtro
+        if not self._propias:
+            return None
+        return {"$and": [filtro, self.filtro_de(self._propias)]}
+
+    # ---------------------------------------------------------------------
+
+    async def equilibrar(self, context, ahora=None):
+        """
+        Un ciclo de renovación y reparto. Devuelve (ganadas, perdidas).
+        """
+        ahora = ahora or datetime.now(timezone.utc)
+        expira_en = ahora + self._duracion
+        await latir_worker(self.worker_id, ahora)
+        vivos = max(1, await contar_workers_vivos(ahora - self._duracion))
+        objetivo = math.ceil(self.numero / vivos)
+
+        perdidas = set()
+        if self._propias:
+            conservadas = await renovar_particiones(self.worker_id, self._propias, expira_en)
+            perdidas = self._propias - conservadas
+            self._propias -= perdidas
+        self._expira_en = expira_en
+
+        sobrantes = sorted(self._propias)[objetivo:]
+        self._propias -= set(sobrantes)
+        perdidas |= set(sobrantes)
+        if perdidas:
+            # Primero se cancelan los jobs aquí y después se suelta el lease:
+            # si no, otro worker podría programar los mismos recordatorios
+            # mientras estos jobs siguen vivos y se enviarían dos veces
+            logger.info(f"Worker {self.worker_id}: suelta las particiones {sorted(perdidas)}")
+            await self._avisar(self._al_perder, context, perdidas)
+        if sobrantes:
+            await liberar_particiones(self.worker_id, sobrantes)
+
+        ganadas = set()
+        if len(self._propias) < objetivo:
+            ocupadas = {d["_id"] for d in await estado_particiones()
+                        if d.get("dueno") != self.worker_id and _como_utc(d["expira_en"]) >= ahora}
+            for particion in range(self.numero):
+                if len(self._propias) + len(ganadas) >= objetivo:
+                    break
+                if particion in self._propias or particion in ocupadas:
+                    continue
+                if await reclamar_particion(particion, self.worker_id, ahora, expira_en):
+                    ganadas.add(particion)
+
+        if ganadas:
+            self._propias |= ganadas
+            logger.info(f"Worker {self.worker_id}: toma las particiones {sorted(ganadas)}")
+            await self._avisar(self._al_ganar, context, ganadas)
+        return ganadas, perdidas
+
+    async def _avisar(self, callback, context, particiones):
+        if callback is not None:
+            await callback(context, particiones)
+
+    async def soltar_todo(self, context):
+        """Deja de programar todas las particiones (lease caducado o apagado)."""
+        if not self._propias:
+            return
+        perdidas, self._propias = set(self._propias), set()
+        await self._avisar(self._al_perder, context, perdidas)
+
+    async def _bucle(self, context):
+        while True:
+            try:
+                await self.equilibrar(context)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"No se pudieron renovar los leases de particiones: {e}")
+                # Sin renovar, otro worker las reclamará al caducar
+                limite = datetime.now(timezone.utc) + timedelta(seconds=self._renovacion)
+                if self._expira_en is not None and self._expira_en <= limite:
+                    await self.soltar_todo(context)
+            await asyncio.sleep(self._renovacion)
+
+    def iniciar(self, context, al_ganar, al_perder):
+        self._al_ganar = al_ganar
+        self._al_perder = al_perder
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(
+                self._bucle(context), name="particiones_planificador")
+
+    async def detener(self):
+        """Para la renovación y libera los leases para que el resto los tome ya."""
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+        try:
+            if self._propias:
+                await liberar_particiones(self.worker_id, self._propias)
+            await olvidar_worker(self.worker_id)
+        except Exception as e:
+            logger.warning(f"No se pudieron liberar las particiones: {e}")
+        self._propias = set()
+
+    def estado(self):
+        return {
+            "worker_id": self.worker_id,
+            "numero": self.numero,
+            "propias": self.propias(),
+            "expira_en": self._expira_en
+        }
+
+
+gestor_particiones = GestorParticiones()
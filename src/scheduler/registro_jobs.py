@@ -0,0 +1,135 @@
+import logging
+import threading
+import weakref
+from apscheduler.events import EVENT_JOB_REMOVED
+from src.scheduler.snapshot import snapshot_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Tipos de job que puede tener asociado un record_id
+TIPO_INICIO = "inicio"
+TIPO_REPETICION = "rep"
+TIPO_FIN = "fin"
+TIPO_CLIMA = "clima"
+
+
+'''
+-----------------------------------------------------------------------------------
+Registro de jobs indexado por record_id
+-----------------------------------------------------------------------------------
+'''
+
+
+class RegistroJobs:
+    """
+    Índice en memoria record_id -> {tipo: job} para los jobs del JobQueue.
+
+    Permite cancelar o consultar los jobs de un recordatorio en O(1) sin
+    recorrer context.job_queue.jobs(). Se mantiene sincronizado escuchando
+    EVENT_JOB_REMOVED del scheduler, que se emite tanto al llamar a
+    schedule_removal() como cuando un job termina por sí solo (run_once ya
+    ejecutado o repetición que llega a su fin).
+
+    Si se indica un 'observador' (ver SnapshotScheduler) se le avisa con
+    job_registrado(record_id, tipo, job) y job_eliminado(record_id, tipo).
+    """
+
+    def __init__(self, observador=None):
+        self._por_record = {}
+        self._por_job_id = {}
+        self._lock = threading.Lock()
+        self._observador = observador
+
+    def registrar(self, record_id, tipo, job):
+        """
+        Asocia 'job' al record_id con el tipo indicado. Si ya había un job
+        de ese mismo tipo, se cancela para no dejarlo huérfano.
+        """
+        if not record_id or job is None:
+            return
+        record_id = str(record_id)
+        with self._lock:
+            anterior = self._por_record.setdefault(record_id, {}).get(tipo)
+            self._por_record[record_id][tipo] = job
+            self._por_job_id[job.job.id] = (record_id, tipo)
+        if anterior is not None and anterior is not job:
+            anterior.schedule_removal()
+        if self._observador is not None:
+            self._observador.job_registrado(record_id, tipo, job)
+
+    def obtener(self, record_id, tipo=None):
+        """
+        Devuelve el job del tipo indicado o, si tipo es None, un dict
+        {tipo: job} con todos los jobs del record_id.
+        """
+        with self._lock:
+            jobs = self._por_record.get(str(record_id), {})
+            if tipo is not None:
+                return jobs.get(tipo)
+            return dict(jobs)
+
+    def record_ids(self, tipos=None):
+        """record_id con algún job (de los 'tipos' indicados, si se pasan)."""
+        with self._lock:
+            return [record_id for record_id, jobs in self._por_record.items()
+                    if tipos is None or any(tipo in jobs for tipo in tipos)]
+
+    def contiene(self, record_id, tipo=None):
+        return bool(self.obtener(record_id, tipo))
+
+    def cancelar(self, record_id, tipos=None):
+        """
+        Cancela los jobs del record_id (todos o sólo los 'tipos' indicados).
+        Devuelve el número de jobs cancelados.
+        """
+        if not record_id:
+            return 0
+        with self._lock:
+            jobs = self._por_record.get(str(record_id), {})
+            seleccion = [job for tipo, job in jobs.items()
+                         if tipos is None or tipo in tipos]
+        for job in seleccion:
+            # schedule_removal dispara EVENT_JOB_REMOVED -> _olvidar
+            job.schedule_removal()
+        return len(seleccion)
+
+    def _olvidar(self, job_id):
+        with self._lock:
+            clave = self._por_job_id.pop(job_id, None)
+            if clave is None:
+                return
+            record_id, tipo = clave
+            jobs = self._por_record.get(record_id)
+            if not (jobs and tipo in jobs and jobs[tipo].job.id == job_id):
+                # Ya lo sustituyó otro job del mismo tipo
+                return
+            del jobs[tipo]
+            if not jobs:
+                del self._por_record[record_id]
+        if self._observador is not None:
+            self._observador.job_eliminado(record_id, tipo)
+
+    def _on_job_removed(self, event):
+        self._olvidar(event.job_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._por_record)
+
+
+# Un registro por scheduler (normalmente sólo hay una Application por proceso)
+_registros = weakref.WeakKeyDictionary()
+
+
+def get_registro_jobs(job_queue):
+    """
+    Devuelve el RegistroJobs asociado al job_queue, creándolo y
+    enganchándolo a los eventos del scheduler y al snapshot la primera vez.
+    """
+    scheduler = job_queue.scheduler
+    registro = _registros.get(scheduler)
+    if registro is None:
+        registro = RegistroJobs(observador=snapshot_scheduler)
+        scheduler.add_listener(registro._on_job_removed, EVENT_JOB_REMOVED)
+        _registros[scheduler] = registro
+    return registro
@@ -0,0 +1,148 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from src.config.settings import SCHEDULER_CONFIG, SNAPSHOT_CONFIG
+from src.database.connection import get_async_db, db_disponible
+from src.database.models import filtro_cambiados_desde, filtro_recordatorios_proximos
+from src.database.async_models import ids_recordatorios_existentes, ids_clima_existentes
+from src.reminders.mensaje_recordatorios import (
+    restaurar_jobs_recordatorios, recargar_ventana_recordatorios, reconciliar_recordatorios,
+    programar_ventana, cancelar_jobs_de_usuarios, fin_de_ventana
+)
+from src.clima.gestion_clima import (
+    restaurar_suscripciones_clima, rehidratar_suscripciones_clima,
+    cancelar_suscripciones_de_usuarios
+)
+from src.scheduler.snapshot import snapshot_scheduler
+from src.scheduler.particiones import gestor_particiones
+
+logger = logging.getLogger(__name__)
+
+
+'''
+-----------------------------------------------------------------------------------
+Volcado periódico del snapshot del planificador
+-----------------------------------------------------------------------------------
+'''
+
+
+async def volcar_snapshot(context=None):
+    """Job periódico (y último paso al apagar) que guarda los cambios de jobs."""
+    if gestor_particiones.activo:
+        # Con particiones cada worker carga las suyas al tomarlas
+        return
+    if not db_disponible():
+        # Los cambios siguen pendientes para el siguiente volcado
+        logger.warning("MongoDB no disponible: se omite el volcado del snapshot")
+        return
+    try:
+        await snapshot_scheduler.volcar(get_async_db())
+    except Exception as e:
+        # Se reintenta en el siguiente volcado con los mismos cambios
+        logger.warning(f"No se pudo guardar el snapshot del planificador: {e}")
+
+
+'''
+-----------------------------------------------------------------------------------
+Arranque en caliente desde el snapshot
+-----------------------------------------------------------------------------------
+'''
+
+
+async def _filtrar_existentes(record_ids, consulta=ids_recordatorios_existentes):
+    existentes = set()
+    ids = sorted(record_ids)
+    tamano = SCHEDULER_CONFIG["tamano_lote"]
+    for i in range(0, len(ids), tamano):
+        existentes |= await consulta(ids[i:i + tamano])
+    return existentes
+
+
+async def restaurar_desde_snapshot(context):
+    """
+    Restaura los jobs de recordatorios y los grupos de clima desde el
+    snapshot y sólo reconcilia contra 'recordatorios' y 'clima' los
+    documentos creados o editados desde la marca del último volcado, de
+    modo que el arranque cuesta en función de los cambios y no del tamaño
+    de las colecciones.
+
+    Devuelve False si no hay snapshot (o no se puede leer); entonces hay que
+    hacer el arranque en frío (reprogramar_todos_los_recordatorios y
+    rehidratar_suscripciones_clima).
+    """
+    inicio = time.monotonic()
+    try:
+        cargado = await snapshot_scheduler.cargar(get_async_db())
+    except Exception as e:
+        logger.warning(f"No se pudo leer el snapshot del planificador: {e}")
+        return False
+    if cargado is None:
+        logger.info("No hay snapshot del planificador: arranque en frío")
+        return False
+
+    meta, jobs, clima = cargado
+    ahora = datetime.now(timezone.utc)
+    desde = meta["marca"] - timedelta(seconds=SNAPSHOT_CONFIG["margen_segundos"])
+
+    # Un borrado posterior al último volcado no está en el snapshot (y los
+    # change streams sólo ven los cambios desde este arranque)
+    existentes = await _filtrar_existentes({j["record_id"] for j in jobs})
+    clima_existente = await _filtrar_existentes(
+        {c["record_id"] for c in clima}, ids_clima_existentes)
+    clima_borrado = [c["record_id"] for c in clima if c["record_id"] not in clima_existente]
+    clima = [c for c in clima if c["record_id"] in clima_existente]
+
+    # Sin awaits dentro: ningún handler registra jobs mientras está en pausa
+    with snapshot_scheduler.pausado():
+        creados, descartados = restaurar_jobs_recordatorios(context, jobs, existentes, ahora)
+        restaurar_suscripciones_clima(context, clima)
+    for record_id, tipo in descartados:
+        snapshot_scheduler.job_eliminado(record_id, tipo)
+    for record_id in clima_borrado:
+        snapshot_scheduler.clima_quitado(record_id)
+
+    ventana_hasta = meta.get("ventana_hasta")
+    recarga = timedelta(minutes=SCHEDULER_CONFIG["intervalo_recarga_minutos"])
+    if ventana_hasta is None or ventana_hasta < ahora + recarga:
+        # La ventana guardada no llega a la próxima recarga: se carga ya
+        # (la consulta de la ventana incluye los recordatorios nuevos)
+        await recargar_ventana_recordatorios(context)
+    else:
+        await reconciliar_recordatorios(context, desde, ventana_hasta)
+    await rehidratar_suscripciones_clima(context, filtro_cambiados_desde(desde))
+
+    logger.info(
+        f"Planificador restaurado desde el snapshot: {creados} jobs de recordatorios "
+        f"({len(descartados)} descartados) y {len(clima)} suscripciones de clima "
+        f"({len(clima_borrado)} descartadas) "
+        f"en {time.monotonic() - inicio:.2f} s")
+    return True
+
+
+'''
+-----------------------------------------------------------------------------------
+Particiones: cargar las que se toman y cancelar las que se ceden
+-----------------------------------------------------------------------------------
+'''
+
+
+async def al_ganar_particiones(context, particiones):
+    """Programa la ventana de recordatorios y el clima de las particiones nuevas."""
+    filtro = gestor_particiones.filtro_de(particiones)
+    hasta = fin_de_ventana()
+    await programar_ventana(
+        context, {"$and": [filtro_recordatorios_proximos(hasta), filtro]}, hasta,
+        descripcion=f"particiones {sorted(particiones)}")
+    await rehidratar_suscripciones_clima(context, filtro)
+
+
+async def al_perder_particiones(context, particiones):
+    """Cancela los jobs de los usuarios de las particiones cedidas."""
+    def pertenece(user_id):
+        return gestor_particiones.particion_de(user_id) in particiones
+
+    recordatorios = cancelar_jobs_de_usuarios(context, pertenece)
+    clima = cancelar_suscripciones_de_usuarios(context, pertenece)
+    logger.info(
+        f"Particiones {sorted(particiones)} cedidas: {recordatorios} jobs de "
+        f"recordatorios y {clima} suscripciones de clima cancelados")
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from bson.timestamp import Timestamp
+from src.config.settings import SCHEDULER_CONFIG, SNAPSHOT_CONFIG, SINCRONIZACION_CONFIG
+from src.database.models import PROYECCION_PROGRAMACION, PROYECCION_CLIMA, filtro_cambiados_desde
+from src.database.async_models import (
+    iterar_lotes_recordatorios, iterar_lotes_clima, abrir_change_stream,
+    ids_recordatorios_existentes, ids_clima_existentes
+)
+from src.reminders.mensaje_recordatorios import sincronizar_recordatorio, cancelar_job_por_record_id
+from src.clima.gestion_clima import (
+    programar_suscripcion_clima, cancelar_recordatorio_diario_clima, suscripciones_programadas
+)
+from src.scheduler.registro_jobs import (
+    get_registro_jobs, TIPO_INICIO, TIPO_REPETICION, TIPO_FIN
+)
+
+logger = logging.getLogger(__name__)
+
+MODO_CAMBIOS = "cambios"
+MODO_SONDEO = "sondeo"
+
+# Sólo interesan las altas, los borrados y las ediciones (que ponen
+# actualizado_en); los cambios de next_fire_at al disparar un job no
+_PIPELINE_CAMBIOS = [{"$match": {"$or": [
+    {"operationType": {"$in": ["insert", "replace", "delete"]}},
+    {"updateDescription.updatedFields.actualizado_en": {"$exists": True}}
+]}}]
+
+_PROYECCION_SONDEO_RECORDATORIOS = dict(PROYECCION_PROGRAMACION, creado_en=1, actualizado_en=1)
+_PROYECCION_SONDEO_CLIMA = dict(PROYECCION_CLIMA, creado_en=1, actualizado_en=1)
+
+
+def _version(documento):
+    # Fecha de la última edición (o de la creación) en UTC aware
+    fecha = documento.get("actualizado_en") or documento.get("creado_en")
+    if fecha is not None and fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha
+
+
+'''
+-----------------------------------------------------------------------------------
+Sincronizador del planificador (change streams con sondeo de respaldo)
+-----------------------------------------------------------------------------------
+'''
+
+
+class SincronizadorPlanificador:
+    """
+    Mantiene los jobs al día con los cambios que se hacen en 'recordatorios'
+    y 'clima' desde fuera de los handlers (otra réplica, un script de
+    administración, una migración), sin rehidratar las colecciones.
+
+    - Con change streams (replica set) se aplica cada alta, edición o borrado
+      en cuanto llega. Si el stream se corta se reanuda con su resume token.
+    - Si el servidor no los admite (o con modo "sondeo"), cada
+      intervalo_sondeo_segundos se buscan los documentos con creado_en o
+      actualizado_en posteriores al sondeo anterior (índices de
+      filtro_cambiados_desde) y, cada intervalo_borrados_segundos, se
+      comprueba que los documentos programados siguen existiendo.
+
+    Las ediciones tienen que poner actualizado_en (como hace
+    actualizar_recordatorio_clima); los cambios de next_fire_at se ignoran.
+    Aplicar un cambio dos veces no duplica jobs.
+    """
+
+    def __init__(self, modo=None, intervalo_sondeo=None, intervalo_borrados=None):
+        self._modo_configurado = modo or SINCRONIZACION_CONFIG["modo"]
+        self._intervalo_sondeo = intervalo_sondeo or SINCRONIZACION_CONFIG["intervalo_sondeo_segundos"]
+        self._intervalo_borrados = intervalo_borrados or SINCRONIZACION_CONFIG["intervalo_borrados_segundos"]
+        self._margen = timedelta(seconds=SNAPSHOT_CONFIG["margen_segundos"])
+        self._tarea = None
+
+        self.modo = None
+        self._desde = None
+        self._ultimo_borrado = None
+        # (coleccion, _id) -> versión ya aplicada en el sondeo
+        self._aplicados = {}
+        self.cambios_aplicados = 0
+
+    # --- Aplicar un cambio -----------------------------------------------
+
+    def aplicar_recordatorio(self, context, documento, editado):
+        sincronizar_recordatorio(context, documento, editado=editado)
+        self.cambios_aplicados += 1
+
+    def eliminar_recordatorio(self, context, record_id):
+        cancelar_job_por_record_id(context, str(record_id))
+        self.cambios_aplicados += 1
+
+    def aplicar_clima(self, context, documento):
+        # agregar() mueve la suscripción si cambió de hora o provincia
+        programar_suscripcion_clima(context, documento)
+        self.cambios_aplicados += 1
+
+    def eliminar_clima(self, context, record_id):
+        cancelar_recordatorio_diario_clima(context, str(record_id))
+        self.cambios_aplicados += 1
+
+    # --- Change streams --------------------------------------------------
+
+    def _opciones_stream(self, token):
+        if token is not None:
+            return {"resume_after": token}
+        return {"start_at_operation_time": Timestamp(int(self._desde.timestamp()), 0)}
+
+    async def _escuchar(self, context, coleccion, stream):
+        """Aplica los cambios de 'stream' y lo reanuda si se corta."""
+        token = stream.resume_token
+        while True:
+            try:
+                async with stream:
+                    async for cambio in stream:
+                        self._aplicar_cambio(context, coleccion, cambio)
+                        token = stream.resume_token
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Change stream de {coleccion} interrumpido: {e}")
+
+            while True:
+                await asyncio.sleep(self._intervalo_sondeo)
+                try:
+                    stream = await abrir_change_stream(
+                        coleccion, _PIPELINE_CAMBIOS, **self._opciones_stream(token))
+                    break
+                except Exception as e:
+                    logger.warning(f"No se pudo reanudar el change stream de {coleccion}: {e}")
+
+    def _aplicar_cambio(self, context, coleccion, cambio):
+        record_id = cambio["documentKey"]["_id"]
+        documento = cambio.get("fullDocument")
+        # En un update, fullDocument es None si el documento ya se borró
+        borrado = cambio["operationType"] == "delete" or documento is None
+        if coleccion == "recordatorios":
+            if borrado:
+                self.eliminar_recordatorio(context, record_id)
+            else:
+                self.aplicar_recordatorio(
+                    context, documento, editado=cambio["operationType"] != "insert")
+        elif borrado:
+            self.eliminar_clima(context, record_id)
+        else:
+            self.aplicar_clima(context, documento)
+
+    # --- Sondeo ----------------------------------------------------------
+
+    async def sondear(self, context):
+        """
+        Aplica los documentos creados o editados desde el sondeo anterior.
+        Devuelve el número de cambios aplicados.
+        """
+        inicio = datetime.now(timezone.utc)
+        # El margen cubre escrituras con la fecha ya puesta pero aún no
+        # confirmadas; _aplicados evita volver a aplicarlas
+        desde = self._desde - self._margen
+        filtro = filtro_cambiados_desde(desde)
+        tamano = SCHEDULER_CONFIG["tamano_lote"]
+        aplicados = 0
+
+        async for lote in iterar_lotes_recordatorios(filtro, tamano, _PROYECCION_SONDEO_RECORDATORIOS):
+            for documento in lote:
+                if self._es_nuevo("recordatorios", documento):
+                    self.aplicar_recordatorio(
+                        context, documento, editado=documento.get("actualizado_en") is not None)
+                    aplicados += 1
+            await asyncio.sleep(0)
+
+        async for lote in iterar_lotes_clima(filtro, tamano, _PROYECCION_SONDEO_CLIMA):
+            for documento in lote:
+                if self._es_nuevo("clima", documento):
+                    self.aplicar_clima(context, documento)
+                    aplicados += 1
+            await asyncio.sleep(0)
+
+        self._desde = inicio
+        self._aplicados = {clave: version for clave, version in self._aplicados.items()
+                           if version >= desde}
+        return aplicados
+
+    def _es_nuevo(self, coleccion, documento):
+        clave = (coleccion, documento["_id"])
+        version = _version(documento)
+        if version is None or self._aplicados.get(clave) == version:
+            return False
+        self._aplicados[clave] = version
+        return True
+
+    async def comprobar_borrados(self, context):
+        """
+        Cancela los jobs de los recordatorios y suscripciones programados que
+        ya no existen en la BD. Devuelve el número de documentos borrados.
+        """
+        tamano = SCHEDULER_CONFIG["tamano_lote"]
+        borrados = 0
+
+        programados = get_registro_jobs(context.job_queue).record_ids(
+            (TIPO_INICIO, TIPO_REPETICION, TIPO_FIN))
+        for i in range(0, len(programados), tamano):
+            lote = programados[i:i + tamano]
+            existentes = await ids_recordatorios_existentes(lote)
+            for record_id in set(lote) - existentes:
+                self.eliminar_recordatorio(context, record_id)
+                borrados += 1
+
+        suscritos = suscripciones_programadas(context)
+        for i in range(0, len(suscritos), tamano):
+            lote = suscritos[i:i + tamano]
+            existentes = await ids_clima_existentes(lote)
+            for record_id in set(lote) - existentes:
+                self.eliminar_clima(context, record_id)
+                borrados += 1
+
+        self._ultimo_borrado = time.monotonic()
+        return borrados
+
+    async def _sondear_siempre(self, context):
+        while True:
+            try:
+                await self.sondear(context)
+                if time.monotonic() - self._ultimo_borrado >= self._intervalo_borrados:
+                    await self.comprobar_borrados(context)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error al sondear cambios del planificador: {e}")
+            await asyncio.sleep(self._intervalo_sondeo)
+
+    # --- Ciclo de vida ---------------------------------------------------
+
+    async def _abrir_streams(self):
+        streams = {}
+        try:
+            for coleccion in ("recordatorios", "clima"):
+                streams[coleccion] = await abrir_change_stream(
+                    coleccion, _PIPELINE_CAMBIOS, **self._opciones_stream(None))
+        except Exception:
+            for stream in streams.values():
+                await stream.close()
+            raise
+        return streams
+
+    async def _bucle(self, context):
+        if self._modo_configurado != MODO_SONDEO:
+            try:
+                streams = await self._abrir_streams()
+            except Exception as e:
+                if self._modo_configurado == MODO_CAMBIOS:
+                    raise
+                logger.info(f"Change streams no disponibles ({e}); se sondean los cambios")
+            else:
+                self.modo = MODO_CAMBIOS
+                logger.info("Sincronización del planificador con change streams")
+                await asyncio.gather(*(self._escuchar(context, coleccion, stream)
+                                       for coleccion, stream in streams.items()))
+                return
+
+        self.modo = MODO_SONDEO
+        self._ultimo_borrado = time.monotonic()
+        await self._sondear_siempre(context)
+
+    def iniciar(self, context, desde):
+        """
+        Empieza a aplicar los cambios posteriores a 'desde' (el momento en
+        que empezó la rehidratación o la restauración del snapshot).
+        """
+        self._desde = desde
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(
+                self._bucle(context), name="sincronizacion_planificador")
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def estado(self):
+        return {
+            "modo": self.modo,
+            "cambios_aplicados": self.cambios_aplicados,
+            "desde": self._desde
+        }
+
+
+sincronizador_planificador = SincronizadorPlanificador()
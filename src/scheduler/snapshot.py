@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pymongo.operations import ReplaceOne, DeleteOne
+from src.config.settings import PARTICIONES_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Colección donde se guarda el estado del planificador
+COLECCION_SNAPSHOT = "_scheduler_snapshot"
+ID_META = "_meta"
+
+CLASE_JOB = "job"
+CLASE_CLIMA = "clima"
+
+# Mismos valores que TIPO_INICIO, TIPO_REPETICION y TIPO_FIN de registro_jobs
+TIPOS_RECORDATORIO = ("inicio", "rep", "fin")
+
+
+def _id_job(record_id, tipo):
+    return f"job:{record_id}:{tipo}"
+
+
+def _id_clima(record_id):
+    return f"clima:{record_id}"
+
+
+def _como_utc(valor):
+    """
+    MongoDB devuelve las fechas naive (en UTC). Las pasa a UTC aware,
+    también dentro de dicts y listas (la data de los jobs).
+    """
+    if isinstance(valor, datetime):
+        return valor.replace(tzinfo=timezone.utc) if valor.tzinfo is None else valor
+    if isinstance(valor, dict):
+        return {clave: _como_utc(v) for clave, v in valor.items()}
+    if isinstance(valor, list):
+        return [_como_utc(v) for v in valor]
+    return valor
+
+
+'''
+-----------------------------------------------------------------------------------
+Snapshot incremental del planificador
+-----------------------------------------------------------------------------------
+'''
+
+
+class SnapshotScheduler:
+    """
+    Copia persistente del estado del planificador para arrancar en caliente.
+
+    Hace de observador del RegistroJobs (jobs de recordatorios: tipo,
+    record_id, próxima ejecución, intervalo y data) y del DespachadorClima
+    (qué suscripción va en qué minuto). Los cambios se acumulan en memoria y
+    volcar() los escribe en un único bulk_write, así que registrar un job
+    nunca espera a MongoDB.
+
+    El documento _meta guarda:
+    - marca: momento en que empezó el último volcado correcto. Todo cambio
+      anterior está en el snapshot; al arrancar sólo hay que reconciliar los
+      documentos creados o editados después.
+    - ventana_hasta: hasta dónde llegaba la ventana de recordatorios cargada.
+
+    Con activo=False (planificador repartido en particiones, que no usa el
+    snapshot) no acumula cambios.
+    """
+
+    def __init__(self, activo=True):
+        self.activo = activo
+        # _id -> documento a guardar, o None si hay que borrarlo
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._pausado = False
+        self.ventana_hasta = None
+        self.volcados = 0
+
+    # --- Observador del RegistroJobs -------------------------------------
+
+    def job_registrado(self, record_id, tipo, job):
+        # Los jobs de los grupos de clima se reconstruyen desde las entradas de clima
+        if self._pausado or tipo not in TIPOS_RECORDATORIO:
+            return
+        trigger = job.job.trigger
+        # next_run_time no existe hasta que arranca el scheduler
+        proxima = (getattr(job.job, "next_run_time", None)
+                   or getattr(trigger, "run_date", None)
+                   or getattr(trigger, "start_date", None))
+        intervalo = getattr(trigger, "interval", None)
+        self._marcar(_id_job(record_id, tipo), {
+            "clase": CLASE_JOB,
+            "record_id": record_id,
+            "tipo": tipo,
+            "chat_id": job.chat_id,
+            "nombre": job.name,
+            "proxima": proxima,
+            "intervalo": intervalo.total_seconds() if intervalo else None,
+            "datos": job.data
+        })
+
+    def job_eliminado(self, record_id, tipo):
+        if not self._pausado and tipo in TIPOS_RECORDATORIO:
+            self._marcar(_id_job(record_id, tipo), None)
+
+    # --- Observador del DespachadorClima ---------------------------------
+
+    def clima_agregado(self, record_id, hora_utc, minuto_utc, suscripcion):
+        if self._pausado:
+            return
+        self._marcar(_id_clima(record_id), {
+            "clase": CLASE_CLIMA,
+            "record_id": record_id,
+            "hora": hora_utc,
+            "minuto": minuto_utc,
+            "suscripcion": suscripcion
+        })
+
+    def clima_quitado(self, record_id):
+        if not self._pausado:
+            self._marcar(_id_clima(record_id), None)
+
+    # ---------------------------------------------------------------------
+
+    def _marcar(self, _id, documento):
+        if not self.activo:
+            # Nadie los volcaría: crecerían sin límite
+            return
+        with self._lock:
+            self._pendientes[_id] = documento
+
+    @contextmanager
+    def pausado(self):
+        """Ignora los cambios mientras se restaura desde el propio snapshot."""
+        self._pausado = True
+        try:
+            yield
+        finally:
+            self._pausado = False
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._pendientes)
+
+    async def volcar(self, db):
+        """
+        Escribe los cambios acumulados y actualiza _meta con un único
+        bulk_write. Si falla, los cambios vuelven a quedar pendientes.
+        """
+        marca = datetime.now(timezone.utc)
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+
+        operaciones = []
+        for _id, documento in pendientes.items():
+            if documento is None:
+                operaciones.append(DeleteOne({"_id": _id}))
+            else:
+                operaciones.append(ReplaceOne({"_id": _id}, dict(documento, _id=_id), upsert=True))
+        operaciones.append(ReplaceOne(
+            {"_id": ID_META},
+            {"_id": ID_META, "marca": marca, "ventana_hasta": self.ventana_hasta},
+            upsert=True))
+
+        inicio = time.monotonic()
+        try:
+            await db[COLECCION_SNAPSHOT].bulk_write(operaciones, ordered=True)
+        except Exception:
+            with self._lock:
+                # Lo que haya cambiado mientras tanto es más reciente
+                for _id, documento in pendientes.items():
+                    self._pendientes.setdefault(_id, documento)
+            raise
+        self.volcados += 1
+        if pendientes:
+            logger.debug(
+                f"Snapshot del planificador: {len(pendientes)} cambios en "
+                f"{time.monotonic() - inicio:.3f} s")
+        return len(pendientes)
+
+    async def cargar(self, db):
+        """
+        Lee el snapshot completo. Devuelve (meta, jobs, clima) o None si no
+        hay snapshot. Las fechas se devuelven en UTC aware.
+        """
+        meta = None
+        jobs, clima = [], []
+        async for documento in db[COLECCION_SNAPSHOT].find({}):
+            if documento["_id"] == ID_META:
+                meta = documento
+            elif documento.get("clase") == CLASE_JOB:
+                jobs.append(_como_utc(documento))
+            elif documento.get("clase") == CLASE_CLIMA:
+                clima.append(documento)
+        if meta is None:
+            return None
+        meta["marca"] = _como_utc(meta.get("marca"))
+        meta["ventana_hasta"] = _como_utc(meta.get("ventana_hasta"))
+        self.ventana_hasta = meta["ventana_hasta"]
+        return meta, jobs, clima
+
+
+# Con particiones (GestorParticiones.activo) cada worker carga las suyas al
+# tomarlas y el snapshot no se vuelca
+snapshot_scheduler = SnapshotScheduler(activo=PARTICIONES_CONFIG["numero"] <= 1)
+
+
+def siguiente_ejecucion(proxima, intervalo, ahora):
+    """
+    Próxima ejecución de un job del snapshot a partir de 'ahora'. Las
+    repeticiones que se perdieron mientras el bot estaba parado se saltan
+    (igual que calcular_proximas_ejecuciones); un run_once ya pasado
+    devuelve None.
+    """
+    if proxima is None:
+        return None
+    if proxima > ahora:
+        return proxima
+    if not intervalo:
+        return None
+    paso = timedelta(seconds=intervalo)
+    return proxima + ((ahora - proxima) // paso + 1) * paso
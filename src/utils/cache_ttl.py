@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Valor centinela para distinguir "no está en caché" de un valor None guardado
+AUSENTE = object()
+
+
+class CacheTTL:
+    """
+    Caché en memoria acotada con expiración por tiempo (TTL) y expulsión LRU.
+
+    - max_entradas: cuando se supera, se expulsa la entrada usada hace más tiempo.
+    - ttl: segundos de vida por defecto; guardar() admite un ttl propio por entrada.
+
+    - indice: función opcional valor -> clave secundaria (o None). Permite
+      invalidar_por() sin recorrer la caché.
+
+    Para no guardar un valor leído antes de una invalidación (una consulta
+    que se cruza con una escritura), se toma marca() antes de leer y se pasa
+    a guardar(): si entre medias se invalidó algo, no se guarda.
+
+    Lleva contadores de aciertos, fallos, expulsiones y expiraciones,
+    accesibles con estadisticas().
+    """
+
+    def __init__(self, max_entradas, ttl, reloj=time.monotonic, indice=None):
+        self._max_entradas = max_entradas
+        self._ttl = ttl
+        self._reloj = reloj
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._funcion_indice = indice
+        # clave secundaria -> claves con ese valor
+        self._indice = {}
+        self._invalidaciones = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.expiradas = 0
+
+    def obtener(self, clave, por_defecto=AUSENTE):
+        """Devuelve el valor guardado o 'por_defecto' si no está o ha caducado."""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return por_defecto
+
+            valor, caduca = entrada
+            if caduca <= self._reloj():
+                self._quitar(clave)
+                self.expiradas += 1
+                self.fallos += 1
+                return por_defecto
+
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def marca(self):
+        """Marca para guardar(): cambia con cada invalidación."""
+        with self._lock:
+            return self._invalidaciones
+
+    def guardar(self, clave, valor, ttl=None, marca=None):
+        """
+        Guarda el valor. Con 'marca' (de marca()), no hace nada si desde
+        entonces se ha invalidado alguna entrada. Devuelve si se guardó.
+        """
+        with self._lock:
+            if marca is not None and marca != self._invalidaciones:
+                return False
+            caduca = self._reloj() + (self._ttl if ttl is None else ttl)
+            self._quitar(clave)
+            self._datos[clave] = (valor, caduca)
+            secundaria = self._secundaria(valor)
+            if secundaria is not None:
+                self._indice.setdefault(secundaria, set()).add(clave)
+            while len(self._datos) > self._max_entradas:
+                self._quitar(next(iter(self._datos)))
+                self.expulsiones += 1
+            return True
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._invalidaciones += 1
+            return self._quitar(clave)
+
+    def invalidar_por(self, secundaria):
+        """Elimina las entradas cuyo valor tiene esa clave secundaria (ver 'indice')."""
+        with self._lock:
+            self._invalidaciones += 1
+            claves = list(self._indice.get(secundaria, ()))
+            for clave in claves:
+                self._quitar(clave)
+            return len(claves)
+
+    def limpiar(self):
+        with self._lock:
+            self._invalidaciones += 1
+            self._datos.clear()
+            self._indice.clear()
+
+    def _secundaria(self, valor):
+        return self._funcion_indice(valor) if self._funcion_indice else None
+
+    def _quitar(self, clave):
+        """Quita la entrada y su referencia en el índice. Con el lock tomado."""
+        entrada = self._datos.pop(clave, None)
+        if entrada is None:
+            return False
+        secundaria = self._secundaria(entrada[0])
+        if secundaria is not None:
+            claves = self._indice.get(secundaria)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._indice[secundaria]
+        return True
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "expiradas": self.expiradas,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datos)
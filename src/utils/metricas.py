@@ -0,0 +1,277 @@
+import asyncio
+import functools
+import logging
+import re
+import time
+from collections import Counter as Conteo
+from apscheduler.events import (
+    EVENT_JOB_ADDED, EVENT_JOB_REMOVED, EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
+)
+from prometheus_client import (
+    Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+from src.config.settings import METRICAS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+'''
+-----------------------------------------------------------------------------------
+Métricas en formato Prometheus
+
+Se exportan por HTTP en METRICAS_CONFIG["listen"]:["puerto"]/metrics.
+Todas empiezan por jbot_. Observar una métrica no hace I/O; los gauges de
+estado se calculan al pedir /metrics.
+-----------------------------------------------------------------------------------
+'''
+
+# Casi todo va de milisegundos a pocos segundos
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# El retraso de los jobs debería quedarse en milisegundos salvo en los picos
+_BUCKETS_RETRASO = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0, 30.0, 60.0)
+
+HANDLER_LATENCIA = Histogram(
+    "jbot_handler_segundos", "Duración de cada callback de las conversaciones",
+    ["conversacion", "handler"], buckets=_BUCKETS)
+JOB_RETRASO = Histogram(
+    "jbot_job_retraso_segundos", "Retraso entre la hora programada de un job y su lanzamiento",
+    ["tipo"], buckets=_BUCKETS_RETRASO)
+JOBS_LANZADOS = Counter(
+    "jbot_jobs_lanzados", "Jobs lanzados por el JobQueue", ["tipo"])
+JOBS_PERDIDOS = Counter(
+    "jbot_jobs_perdidos", "Jobs que no se lanzaron dentro de su misfire_grace_time", ["tipo"])
+MONGO_LATENCIA = Histogram(
+    "jbot_mongo_segundos", "Duración de cada función de acceso a MongoDB",
+    ["funcion", "api"], buckets=_BUCKETS)
+OPENWEATHER_LATENCIA = Histogram(
+    "jbot_openweather_segundos", "Duración de las peticiones a OpenWeather",
+    ["endpoint"], buckets=_BUCKETS)
+OPENWEATHER_RESPUESTAS = Counter(
+    "jbot_openweather_respuestas", "Respuestas de OpenWeather por código HTTP",
+    ["endpoint", "codigo"])
+ENVIO_LATENCIA = Histogram(
+    "jbot_send_message_segundos", "Duración de cada llamada a bot.send_message",
+    buckets=_BUCKETS)
+
+
+def tipo_de_job(nombre):
+    """
+    Tipo de un job a partir de su nombre, sin el record_id o la hora:
+    record_inicio_<id> -> record_inicio, clima_grupo_0700 -> clima_grupo.
+    Los jobs fijos (volcar_snapshot, clima_precarga...) se quedan igual.
+    """
+    return re.sub(r"_(\d{4}|[0-9a-f]{24})$", "", nombre or "desconocido")
+
+
+'''
+-----------------------------------------------------------------------------------
+Instrumentación
+-----------------------------------------------------------------------------------
+'''
+
+
+def medir_mongo(funcion):
+    """Decorador: observa en MONGO_LATENCIA la duración de la función."""
+    nombre = funcion.__name__
+    if asyncio.iscoroutinefunction(funcion):
+        histograma = MONGO_LATENCIA.labels(nombre, "async")
+
+        @functools.wraps(funcion)
+        async def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await funcion(*args, **kwargs)
+            finally:
+                histograma.observe(time.perf_counter() - inicio)
+    else:
+        histograma = MONGO_LATENCIA.labels(nombre, "sync")
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                histograma.observe(time.perf_counter() - inicio)
+    return envoltura
+
+
+def _medir_callback(callback, histograma):
+    @functools.wraps(callback)
+    async def envoltura(update, context):
+        inicio = time.perf_counter()
+        try:
+            resultado = callback(update, context)
+            if asyncio.iscoroutine(resultado):
+                resultado = await resultado
+            return resultado
+        finally:
+            histograma.observe(time.perf_counter() - inicio)
+    return envoltura
+
+
+def instrumentar_conversacion(conv_handler):
+    """
+    Envuelve el callback de cada handler del ConversationHandler (entry
+    points, estados y fallbacks) para observar su duración en
+    HANDLER_LATENCIA. Hay que llamarla antes de app.add_handler.
+    """
+    conversacion = conv_handler.name or "sin_nombre"
+    handlers = list(conv_handler.entry_points) + list(conv_handler.fallbacks)
+    for estado in conv_handler.states.values():
+        handlers.extend(estado)
+    for handler in handlers:
+        nombre = getattr(handler.callback, "__name__", "desconocido")
+        handler.callback = _medir_callback(
+            handler.callback, HANDLER_LATENCIA.labels(conversacion, nombre))
+
+
+def instrumentar_job_queue(job_queue):
+    """
+    Mide con los eventos de APScheduler el retraso de cada job (de la hora
+    programada al momento en que se lanza) y cuenta los lanzados y los
+    perdidos por tipo. El número de jobs programados por tipo se lee al
+    exportar las métricas.
+    """
+    scheduler = job_queue.scheduler
+    # job_id -> tipo. Un run_once sale del jobstore antes de que se avise de
+    # su lanzamiento, así que el tipo se anota al añadirlo
+    tipos = {}
+
+    def _al_evento(evento):
+        if evento.code == EVENT_JOB_ADDED:
+            job = scheduler.get_job(evento.job_id)
+            tipos[evento.job_id] = tipo_de_job(job.name if job else None)
+        elif evento.code == EVENT_JOB_REMOVED:
+            try:
+                # Después de los avisos de lanzamiento y de misfire pendientes
+                asyncio.get_running_loop().call_soon(tipos.pop, evento.job_id, None)
+            except RuntimeError:
+                tipos.pop(evento.job_id, None)
+        elif evento.code == EVENT_JOB_MISSED:
+            JOBS_PERDIDOS.labels(tipos.get(evento.job_id, "desconocido")).inc()
+        else:
+            tipo = tipos.get(evento.job_id, "desconocido")
+            JOBS_LANZADOS.labels(tipo).inc()
+            # Con coalesce se lanza una vez por todas las ejecuciones atrasadas
+            retraso = time.time() - evento.scheduled_run_times[-1].timestamp()
+            JOB_RETRASO.labels(tipo).observe(max(0.0, retraso))
+
+    scheduler.add_listener(
+        _al_evento, EVENT_JOB_ADDED | EVENT_JOB_REMOVED | EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+    registrar_estado("jobs_programados", lambda: Conteo(tipos.values()), etiqueta="tipo")
+
+
+'''
+-----------------------------------------------------------------------------------
+Estado leído al exportar (colas, procesador de updates, jobs programados)
+-----------------------------------------------------------------------------------
+'''
+
+
+class _ColectorEstado:
+    """
+    Convierte en gauges los dicts de estadisticas() de los componentes
+    (ColaEnvios, ProcesadorPorUsuario...). Se leen sólo cuando Prometheus
+    pide /metrics.
+    """
+
+    def __init__(self):
+        self._fuentes = []
+
+    def registrar(self, nombre, funcion, etiqueta=None):
+        self._fuentes.append((nombre, funcion, etiqueta))
+
+    def collect(self):
+        for nombre, funcion, etiqueta in self._fuentes:
+            try:
+                valores = funcion()
+            except Exception as e:
+                logger.warning(f"No se pudieron leer las métricas de {nombre}: {e}")
+                continue
+            if etiqueta is not None:
+                # Un único gauge con una serie por clave
+                familia = GaugeMetricFamily(f"jbot_{nombre}", nombre, labels=[etiqueta])
+                for clave, valor in valores.items():
+                    familia.add_metric([str(clave)], valor)
+                yield familia
+                continue
+            for clave, valor in valores.items():
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                    yield GaugeMetricFamily(f"jbot_{nombre}_{clave}", f"{nombre}: {clave}", value=valor)
+
+
+_colector_estado = _ColectorEstado()
+REGISTRY.register(_colector_estado)
+
+
+def registrar_estado(nombre, funcion, etiqueta=None):
+    """
+    Exporta como gauges jbot_<nombre>_<clave> los valores numéricos del dict
+    que devuelve 'funcion'. Con 'etiqueta', un solo gauge jbot_<nombre> con
+    una serie por clave del dict.
+    """
+    _colector_estado.registrar(nombre, funcion, etiqueta)
+
+
+'''
+-----------------------------------------------------------------------------------
+Servidor HTTP
+-----------------------------------------------------------------------------------
+'''
+
+_servidor = None
+
+
+async def _atender(lector, escritor):
+    try:
+        peticion = await asyncio.wait_for(lector.readline(), 5)
+        # Cabeceras hasta la línea en blanco; no se usan
+        while (await asyncio.wait_for(lector.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        partes = peticion.decode("latin-1").split()
+        if len(partes) >= 2 and partes[0] == "GET" and partes[1].split("?")[0] == "/metrics":
+            estado, tipo, cuerpo = "200 OK", CONTENT_TYPE_LATEST, generate_latest(REGISTRY)
+        else:
+            estado, tipo, cuerpo = "404 Not Found", "text/plain", b"Not Found"
+        escritor.write(
+            f"HTTP/1.1 {estado}\r\nContent-Type: {tipo}\r\n"
+            f"Content-Length: {len(cuerpo)}\r\nConnection: close\r\n\r\n".encode() + cuerpo)
+        await escritor.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        escritor.close()
+
+
+async def iniciar_servidor_metricas():
+    """
+    Arranca el endpoint /metrics si está activado. Se sirve desde el event
+    loop del bot, así que las estadísticas se leen sin carreras con los
+    handlers y los jobs.
+
+    Returns:
+        int: el puerto en el que escucha (útil con puerto 0), o None si
+        las métricas están desactivadas
+    """
+    global _servidor
+    if not METRICAS_CONFIG["activo"]:
+        return None
+    if _servidor is None:
+        _servidor = await asyncio.start_server(
+            _atender, METRICAS_CONFIG["listen"], METRICAS_CONFIG["puerto"])
+        logger.info(
+            f"Métricas en http://{METRICAS_CONFIG['listen']}:{_puerto()}/metrics")
+    return _puerto()
+
+
+def _puerto():
+    return _servidor.sockets[0].getsockname()[1]
+
+
+async def detener_servidor_metricas():
+    global _servidor
+    if _servidor is not None:
+        _servidor.close()
+        await _servidor.wait_closed()
+        _servidor = None
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+
+'''
+-----------------------------------------------------------------------------------
+Cursores de paginación (keyset) para callback_data
+-----------------------------------------------------------------------------------
+'''
+
+# Telegram admite como mucho 64 bytes en callback_data
+MAX_CALLBACK_DATA = 64
+
+
+def codificar_cursor(valores):
+    """
+    Convierte los valores de la clave de orden de un documento (por ejemplo
+    (fecha_hora_inicio, _id)) en un texto corto para callback_data.
+    Las fechas se guardan en milisegundos, que es la precisión de MongoDB.
+    """
+    partes = []
+    for valor in valores:
+        if isinstance(valor, ObjectId):
+            partes.append(f"o{valor}")
+        elif isinstance(valor, datetime):
+            if valor.tzinfo is None:
+                valor = valor.replace(tzinfo=timezone.utc)
+            partes.append(f"d{int(valor.timestamp() * 1000)}")
+        elif valor is None:
+            partes.append("n")
+        else:
+            partes.append(f"i{int(valor)}")
+    return ".".join(partes)
+
+
+def decodificar_cursor(texto):
+    """Operación inversa de codificar_cursor. Devuelve una tupla de valores."""
+    valores = []
+    for parte in texto.split("."):
+        tipo, dato = parte[0], parte[1:]
+        if tipo == "o":
+            valores.append(ObjectId(dato))
+        elif tipo == "d":
+            # MongoDB devuelve fechas naive en UTC
+            valores.append(datetime.fromtimestamp(int(dato) / 1000, timezone.utc).replace(tzinfo=None))
+        elif tipo == "n":
+            valores.append(None)
+        else:
+            valores.append(int(dato))
+    return tuple(valores)
+
+
+def _despues(campo, valor, hacia_atras):
+    """
+    Condición "campo va después de 'valor'" (o antes). MongoDB ordena null
+    (y los campos que faltan) antes que cualquier fecha o número, pero
+    {"$gt": None} o {"$lt": fecha} no comparan entre tipos: hay que decirlo
+    aparte. Devuelve None si no puede cumplirse.
+    """
+    if valor is None:
+        return None if hacia_atras else {campo: {"$ne": None}}
+    if hacia_atras:
+        return {"$or": [{campo: {"$lt": valor}}, {campo: None}]}
+    return {campo: {"$gt": valor}}
+
+
+def filtro_keyset(campos, cursor, hacia_atras=False):
+    """
+    Condición "estrictamente después de 'cursor'" (o antes, si hacia_atras)
+    en el orden ascendente de 'campos'. Para ("a", "_id") con cursor (x, y):
+        a > x  ó  (a == x y _id > y)
+    Los valores null de la clave de orden se tratan como en el sort de
+    MongoDB (antes que todo lo demás). El último campo no puede ser null
+    (normalmente es _id).
+    """
+    condiciones = []
+    for i, campo in enumerate(campos):
+        despues = _despues(campo, cursor[i], hacia_atras)
+        if despues is None:
+            continue
+        condicion = {campos[j]: cursor[j] for j in range(i)}
+        condicion.update(despues)
+        condiciones.append(condicion)
+    return condiciones[0] if len(condiciones) == 1 else {"$or": condiciones}
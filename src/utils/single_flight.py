@@ -0,0 +1,35 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: mientras hay una
+    petición en curso para una clave, el resto de llamadas esperan a esa
+    misma petición en lugar de lanzar otra.
+
+    La tarea compartida está protegida con asyncio.shield, así que si se
+    cancela uno de los que esperan no se cancela para los demás.
+    """
+
+    def __init__(self):
+        self._en_curso = {}
+        self.lanzadas = 0
+        self.compartidas = 0
+
+    async def ejecutar(self, clave, fabrica):
+        """
+        Devuelve el resultado de fabrica() (una función que crea la corrutina),
+        reutilizando la ejecución en curso si ya hay una para 'clave'.
+        """
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(fabrica())
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+            self.lanzadas += 1
+        else:
+            self.compartidas += 1
+        return await asyncio.shield(tarea)
+
+    def en_curso(self):
+        return len(self._en_curso)
@@ -40,8 +40,63 @@ class _DummySession:
 
 _mock_client.start_session = lambda *a, **k: _DummySession()
 
+class _AsyncCursor:
+    """Cursor asíncrono sobre un cursor de mongomock (API de AsyncCursor)."""
+    def __init__(self, cursor): self._cursor = cursor
+    def batch_size(self, n): self._cursor.batch_size(n); return self
+    def sort(self, *a, **k): self._cursor.sort(*a, **k); return self
+    def limit(self, n): self._cursor.limit(n); return self
+    def __aiter__(self): return self
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+    async def to_list(self, length=None):
+        docs = list(self._cursor)
+        return docs if length is None else docs[:length]
+
+
+class _AsyncColeccion:
+    """Colección asíncrona: cada método de mongomock pasa a ser una corrutina."""
+    def __init__(self, coleccion): self._coleccion = coleccion
+    def find(self, *a, **k): return _AsyncCursor(self._coleccion.find(*a, **k))
+    def __getattr__(self, nombre):
+        metodo = getattr(self._coleccion, nombre)
+        async def _async(*a, session=None, **k): return metodo(*a, **k)  # mongomock no admite sesiones
+        return _async
+
+    async def bulk_write(self, operaciones, ordered=True, session=None):
+        # mongomock no acepta ReplaceOne/UpdateOne de pymongo 4.11 en bulk_write
+        for op in operaciones:
+            tipo = type(op).__name__
+            if tipo == "InsertOne": self._coleccion.insert_one(op._doc)
+            elif tipo == "DeleteOne": self._coleccion.delete_one(op._filter)
+            elif tipo == "ReplaceOne": self._coleccion.replace_one(op._filter, op._doc, upsert=op._upsert)
+            else: self._coleccion.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+class _AsyncDB:
+    def __init__(self, db): self._db, self.client = db, _AsyncMockClient()
+    def __getattr__(self, nombre): return _AsyncColeccion(self._db[nombre])
+    __getitem__ = __getattr__
+
+
+class _AsyncDummySession:
+    async def __aenter__(self): return self
+    async def __aexit__(self, exc_type, exc, tb): return False
+    async def start_transaction(self, *a, **k): return self
+
+
+class _AsyncMockClient:
+    def __getitem__(self, nombre): return _AsyncDB(_mock_client[nombre])
+    def start_session(self, *a, **k): return _AsyncDummySession()
+    async def close(self): pass
+
+
 pymongo_fake = types.ModuleType("pymongo")
 pymongo_fake.MongoClient = lambda *a, **k: _mock_client
+pymongo_fake.AsyncMongoClient = lambda *a, **k: _AsyncMockClient()
 pymongo_fake.errors = types.SimpleNamespace(ServerSelectionTimeoutError=Exception)
 sys.modules["pymongo"] = pymongo_fake
 # ─────────────────────────────────────────────────────────────────────
@@ -49,8 +104,10 @@ sys.modules["pymongo"] = pymongo_fake
 # ── 2. Fixture de base de datos aislada ──────────────────────────────
 @pytest.fixture()
 def db(monkeypatch):
-    from src.database import models
+    from src.database import models, async_models
     monkeypatch.setattr(models, "db", _mock_client["jbot"])
+    monkeypatch.setattr(async_models, "db", _AsyncDB(_mock_client["jbot"]))
+    models.cache_usuarios.limpiar()
     yield _mock_client["jbot"]
     _mock_client.drop_database("jbot")
 # ─────────────────────────────────────────────────────────────────────
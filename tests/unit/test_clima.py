@@ -0,0 +1,66 @@
+import pytest
+from types import SimpleNamespace
+from src.clima import gestion_clima
+from src.core.cola_envios import cola_envios
+
+
+class _Scheduler:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_envio_clima_una_consulta_por_provincia(monkeypatch):
+    job_queue = SimpleNamespace(scheduler=_Scheduler())
+    despachador = gestion_clima._despachador(job_queue)
+    for record_id, provincia in (("a", "Madrid"), ("b", "Madrid"), ("c", "Sevilla")):
+        despachador.agregar(record_id, 7, 0, {
+            "user_id": ord(record_id), "provincia": provincia,
+            "zona": "UTC+1", "nombre": record_id
+        }, crear_job=False)
+
+    consultas = []
+
+    async def _datos(provincia):
+        consultas.append(provincia)
+        return None, None
+
+    enviados = []
+
+    async def _send(chat_id, text, **_):
+        enviados.append(chat_id)
+
+    monkeypatch.setattr(gestion_clima, "obtener_datos_clima", _datos)
+    context = SimpleNamespace(
+        job=SimpleNamespace(data={"clave": (7, 0)}),
+        job_queue=job_queue,
+        bot=SimpleNamespace(send_message=_send),
+    )
+    await gestion_clima.enviar_recordatorio_diario_clima(context)
+    await cola_envios.esperar_vacia()
+
+    assert sorted(consultas) == ["Madrid", "Sevilla"]
+    assert sorted(enviados) == [ord("a"), ord("b"), ord("c")]
+
+
+@pytest.mark.asyncio
+async def test_precarga_refresca_provincias_del_minuto(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from src.config.settings import CLIMA_CONFIG
+
+    job_queue = SimpleNamespace(scheduler=_Scheduler())
+    objetivo = datetime.now(timezone.utc) + timedelta(minutes=CLIMA_CONFIG["precarga_minutos"])
+    # Dos minutos seguidos por si el reloj cambia de minuto durante el test
+    for record_id, minuto in (("x", objetivo), ("y", objetivo + timedelta(minutes=1))):
+        gestion_clima._despachador(job_queue).agregar(record_id, minuto.hour, minuto.minute, {
+            "user_id": 1, "provincia": "Lugo", "zona": "UTC+1", "nombre": record_id
+        }, crear_job=False)
+
+    precargadas = []
+
+    async def _datos(provincia, forzar=False):
+        precargadas.append((provincia, forzar))
+        return None, None
+
+    monkeypatch.setattr(gestion_clima, "obtener_datos_clima", _datos)
+    await gestion_clima.precargar_pronosticos(SimpleNamespace(job_queue=job_queue))
+    assert precargadas == [("Lugo", True)]
@@ -1,10 +1,12 @@
-import pytest, requests_mock
+import httpx
+import pytest
+from src.clima import gestion_clima
 from src.clima.clima_bot import comando_clima
 from src.database import models
 
 
 @pytest.mark.asyncio
-async def test_comando_clima(fake_update, fake_context, db):
+async def test_comando_clima(fake_update, fake_context, db, monkeypatch):
     # Registro un usuario ficticio para que get_user() devuelva datos
     models.register_user(
         chat_id=fake_update.message.chat.id,
@@ -18,24 +20,27 @@ async def test_comando_clima(fake_update, fake_context, db):
     fake_context.args = ["Salamanca"] 
 
     # Mock de la API meteorológica
-    with requests_mock.Mocker() as m:
-        m.get(requests_mock.ANY, json={
+    def _api(request):
+        return httpx.Response(200, json={
             "main": {"temp": 20},
             "weather": [{"description": "Despejado"}],
             "wind": {"speed": 3},
         })
 
-        # Captura de la respuesta del bot
-        respuestas = []
+    monkeypatch.setattr(gestion_clima, "_cliente_http", httpx.AsyncClient(
+        transport=httpx.MockTransport(_api), base_url="https://api.test/"))
 
-        async def _capture(txt, **_):
-            respuestas.append(txt)
+    # Captura de la respuesta del bot
+    respuestas = []
 
-        fake_update.message.reply_text = _capture
+    async def _capture(txt, **_):
+        respuestas.append(txt)
 
-        # Ejecutar el handler
-        await comando_clima(fake_update, fake_context)
+    fake_update.message.reply_text = _capture
 
-        # Comprobar salida
-        assert respuestas
-        assert "Salamanca" in respuestas[0] and "20" in respuestas[0]
+    # Ejecutar el handler
+    await comando_clima(fake_update, fake_context)
+
+    # Comprobar salida
+    assert respuestas
+    assert "Salamanca" in respuestas[0] and "20" in respuestas[0]
@@ -0,0 +1,25 @@
+import pytest
+from types import SimpleNamespace
+from telegram.error import RetryAfter
+from src.core.cola_envios import ColaEnvios
+
+
+@pytest.mark.asyncio
+async def test_cola_envios_reintenta_tras_retry_after():
+    intentos = []
+
+    async def _send(chat_id, text, **_):
+        intentos.append(chat_id)
+        if len(intentos) == 1:
+            raise RetryAfter(0)
+        return text
+
+    cola = ColaEnvios(mensajes_por_segundo=100, segundos_por_chat=0,
+                      trabajadores=2, max_reintentos=3, max_pendientes=10)
+    futuro = await cola.encolar(SimpleNamespace(send_message=_send), 5, "hola")
+    assert await futuro == "hola"
+    assert intentos == [5, 5]
+
+    stats = cola.estadisticas()
+    assert stats["enviados"] == 1 and stats["reintentos"] == 1 and stats["pendientes"] == 0
+    await cola.detener()
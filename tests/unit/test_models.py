@@ -1,5 +1,7 @@
+import pytest
 from datetime import datetime
-from src.database import models
+from src.database import models, async_models
+from src.utils.cache_ttl import AUSENTE
 
 def test_register_user_new(db):
     ok = models.register_user(chat_id=111, user_id=111, username="anaTG", apodo="ana")
@@ -17,3 +19,290 @@ def test_update_nickname(db):
     ok = models.update_user_nickname(333, "Charlie")
     doc = db.usuarios.find_one({"chat_id": 333})
     assert ok is True and doc["apodo"] == "Charlie"
+
+@pytest.mark.asyncio
+async def test_async_models_misma_api(db):
+    ok = await async_models.register_user(chat_id=444, user_id=444, username="danaTG", apodo="dana")
+    assert ok is True and await async_models.register_user(444, 444, "dana") is False
+    assert (await async_models.get_user(444))["apodo"] == "dana"
+
+    oid = await async_models.crear_recordatorio(
+        444, "Agua", "Beber", datetime(2025, 1, 1), {"tipo": "ninguna", "valor": None}, None, "UTC+0")
+    assert [r["_id"] for r in await async_models.obtener_recordatorios(444)] == [oid]
+    lotes = [lote async for lote in async_models.iterar_lotes_recordatorios({"user_id": 444})]
+    assert lotes == [[r for r in db.recordatorios.find({}, models.PROYECCION_PROGRAMACION)]]
+
+
+@pytest.mark.asyncio
+async def test_monitor_conexion_backoff_y_recuperacion():
+    from src.database.connection import MonitorConexion
+
+    respuestas = [False, False, True]
+
+    async def _ping():
+        if not respuestas.pop(0):
+            raise ConnectionError("caído")
+
+    monitor = MonitorConexion(ping=_ping, intervalo=10, backoff_inicial=1, backoff_max=3)
+    assert await monitor.comprobar() is False and not monitor.sano
+    assert 0.5 <= monitor._espera() <= 1
+    await monitor.comprobar()
+    assert monitor.fallos_consecutivos == 2 and 1 <= monitor._espera() <= 2
+    assert await monitor.comprobar() is True
+    assert monitor.sano and monitor._espera() == 10
+
+
+@pytest.mark.asyncio
+async def test_cache_usuarios_negativos_e_invalidacion(db):
+    antes = models.cache_usuarios.estadisticas()
+    assert await async_models.get_user(555) is None
+    assert await async_models.get_user(555) is None  # entrada negativa
+    await async_models.register_user(chat_id=555, user_id=555, apodo="eva")
+    assert (await async_models.get_user(555))["apodo"] == "eva"
+
+    await async_models.update_user_nickname(555, "Eve")
+    assert (await async_models.get_user(555))["apodo"] == "Eve"
+    models.update_user(555, {"apodo": "Evita"})
+    assert models.get_user(555)["apodo"] == "Evita"
+
+    stats = models.cache_usuarios.estadisticas()
+    assert stats["aciertos"] - antes["aciertos"] == 1
+    assert stats["fallos"] - antes["fallos"] == 4
+
+
+@pytest.mark.asyncio
+async def test_cache_usuarios_indice_por_chat_y_lectura_cruzada(db):
+    await async_models.register_user(chat_id=-556, user_id=556, apodo="fer")
+    await async_models.register_user(chat_id=-557, user_id=557, apodo="gil")
+    await async_models.get_user(556), await async_models.get_user(557)
+    models.update_user(-556, {"apodo": "Fer"})
+    assert models.cache_usuarios.obtener(556) is AUSENTE
+    assert models.cache_usuarios.obtener(557)["apodo"] == "gil"
+
+    # get_user lee "no registrado", /register confirma y después se guarda
+    # lo leído: la entrada negativa no debe quedarse en la caché
+    marca = models.cache_usuarios.marca()
+    await async_models.register_user(chat_id=558, user_id=558, apodo="hugo")
+    models.guardar_usuario_en_cache(558, None, marca)
+    assert (await async_models.get_user(558))["apodo"] == "hugo"
+
+
+@pytest.mark.asyncio
+async def test_unidad_de_trabajo_agrupa_escrituras(db):
+    frecuencia = {"tipo": "ninguna", "valor": None}
+    async with async_models.unidad_de_trabajo() as unidad:
+        ids = [await async_models.crear_recordatorio(
+            666, f"R{i}", "", datetime(2025, 1, 1), frecuencia, None, "UTC+0") for i in range(2)]
+        await async_models.crear_suscripcion_clima(666, "fran", "Madrid", {"hora": 8})
+        assert len(unidad) == 3 and db.recordatorios.count_documents({}) == 0
+
+    assert [r["_id"] for r in db.recordatorios.find({"user_id": 666})] == ids
+    assert db.clima.count_documents({"user_id": 666}) == 1
+
+    # Si el bloque falla no se escribe nada
+    with pytest.raises(RuntimeError):
+        async with async_models.unidad_de_trabajo():
+            await async_models.crear_recordatorio(
+                667, "R", "", datetime(2025, 1, 1), frecuencia, None, "UTC+0")
+            raise RuntimeError
+    assert db.recordatorios.count_documents({"user_id": 667}) == 0
+
+
+@pytest.mark.asyncio
+async def test_escrituras_de_un_update_en_una_unidad(db, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    from src.core.procesador_updates import ProcesadorPorUsuario
+
+    def _sin_replica_set(*a, **k):
+        raise AssertionError("no debe abrirse una transacción")
+
+    # Varias escrituras sin transacción: funciona en un mongod standalone
+    monkeypatch.setattr(type(async_models.db.client), "start_session", _sin_replica_set)
+    frecuencia = {"tipo": "ninguna", "valor": None}
+    procesador = ProcesadorPorUsuario(trabajadores=2, max_pendientes=4)
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=668), effective_user=SimpleNamespace(id=668))
+    tardias = []
+
+    async def _handler():
+        for i in range(2):
+            await async_models.crear_recordatorio(
+                668, f"R{i}", "", datetime(2025, 1, 1), frecuencia, None, "UTC+0")
+        await async_models.register_user(chat_id=668, user_id=668, apodo="gus")
+        assert db.recordatorios.count_documents({"user_id": 668}) == 0
+        # Una lectura del mismo update ve lo escrito antes
+        assert (await async_models.get_user(668))["apodo"] == "gus"
+        assert len(await async_models.obtener_recordatorios(668)) == 2
+        # Una tarea que sigue tras el update (block=False) escribe directamente
+        tardias.append(asyncio.get_running_loop().create_task(async_models.crear_suscripcion_clima(
+            668, "gus", "Madrid", {"hora": 8})))
+        await async_models.crear_recordatorio(
+            668, "R2", "", datetime(2025, 1, 1), frecuencia, None, "UTC+0")
+        assert await async_models.confirmar_escrituras()
+
+    await procesador.process_update(update, _handler())
+    await tardias[0]
+    assert db.recordatorios.count_documents({"user_id": 668}) == 3
+    assert db.clima.count_documents({"user_id": 668}) == 1
+
+
+def test_migraciones_se_aplican_una_sola_vez(db):
+    from src.database.migraciones import aplicar_migraciones
+
+    db.clima.insert_many([{"hora_config": {"hora": 0}}, {"hora_config": {"hora": 9}}, {"provincia": "Soria"}])
+    assert aplicar_migraciones(db) == [1, 2, 3]
+    assert sorted(d["hora_config"]["hora"] for d in db.clima.find({"hora_config": {"$exists": True}})) == [8, 23]
+    assert db["_migrations"].find_one({"_id": 1})["estado"] == "aplicada"
+
+    # En el siguiente arranque no se vuelve a aplicar
+    assert aplicar_migraciones(db) == []
+    assert db.clima.find_one({"hora_config.hora": 8}) is not None
+
+
+@pytest.mark.asyncio
+async def test_paginacion_keyset_recordatorios(db):
+    from datetime import timedelta
+    from src.utils.paginacion import codificar_cursor, decodificar_cursor, MAX_CALLBACK_DATA
+
+    base = datetime(2025, 1, 1, 9, 30, 15, 123000)
+    # Dos recordatorios con la misma fecha: el _id desempata
+    fechas = [base, base, base + timedelta(days=1), base + timedelta(days=2), base + timedelta(days=3)]
+    for i, fecha in enumerate(fechas):
+        db.recordatorios.insert_one({"user_id": 777, "titulo": f"R{i}", "fecha_hora_inicio": fecha})
+    db.recordatorios.insert_one({"user_id": 778, "titulo": "otro", "fecha_hora_inicio": base})
+
+    vistos = []
+    pagina = await async_models.pagina_recordatorios(777, tamano=2)
+    assert pagina["anterior"] is None
+    while True:
+        vistos += [r["titulo"] for r in pagina["documentos"]]
+        assert set(pagina["documentos"][0]) <= {"_id", "titulo", "descripcion", "fecha_hora_inicio"}
+        if pagina["siguiente"] is None:
+            break
+        cursor = codificar_cursor(pagina["siguiente"])
+        assert len(f"recpag_e_s_{cursor}") <= MAX_CALLBACK_DATA
+        pagina = await async_models.pagina_recordatorios(777, decodificar_cursor(cursor), tamano=2)
+    assert vistos == ["R0", "R1", "R2", "R3", "R4"]
+
+    # Volver atrás desde la última página
+    anterior = await async_models.pagina_recordatorios(777, pagina["anterior"], hacia_atras=True, tamano=2)
+    assert [r["titulo"] for r in anterior["documentos"]] == ["R2", "R3"]
+    assert anterior["anterior"] is not None and anterior["siguiente"] is not None
+
+
+@pytest.mark.asyncio
+async def test_paginacion_keyset_con_fechas_nulas(db):
+    # null se ordena antes que cualquier fecha; {"$gt": null} no encuentra nada
+    for i, fecha in enumerate([None, None, datetime(2025, 1, 1), None, datetime(2025, 1, 2)]):
+        db.recordatorios.insert_one({"user_id": 779, "titulo": f"R{i}", "fecha_hora_inicio": fecha})
+    db.recordatorios.insert_one({"user_id": 779, "titulo": "R5"})  # sin el campo
+
+    vistos, pagina = [], await async_models.pagina_recordatorios(779, tamano=2)
+    while True:
+        vistos += [r["titulo"] for r in pagina["documentos"]]
+        if pagina["siguiente"] is None:
+            break
+        pagina = await async_models.pagina_recordatorios(779, pagina["siguiente"], tamano=2)
+    assert vistos == ["R0", "R1", "R3", "R5", "R2", "R4"]
+
+    anterior = await async_models.pagina_recordatorios(779, pagina["anterior"], hacia_atras=True, tamano=2)
+    assert [r["titulo"] for r in anterior["documentos"]] == ["R3", "R5"]
+    primera = await async_models.pagina_recordatorios(779, anterior["anterior"], hacia_atras=True, tamano=2)
+    assert [r["titulo"] for r in primera["documentos"]] == ["R0", "R1"]
+
+
+@pytest.mark.asyncio
+async def test_startup_reintenta_sin_bloquear_y_shutdown(monkeypatch):
+    from src.database import connection
+
+    fallos = [ConnectionError("caído")]
+
+    async def _ping():
+        if fallos:
+            raise fallos.pop()
+
+    async def _sin_indices():
+        pass
+
+    monitor = connection.MonitorConexion(ping=_ping, intervalo=60, backoff_inicial=0.01, backoff_max=0.01)
+    monkeypatch.setattr(connection, "monitor_conexion", monitor)
+    monkeypatch.setattr(connection, "_setup_indexes", _sin_indices)
+
+    await connection.startup()
+    assert monitor.sano and monitor._tarea is not None
+    await connection.shutdown()
+    assert monitor._tarea is None and connection._async_client is None
+
+
+@pytest.mark.asyncio
+async def test_persistencia_conversaciones_agrupa_escrituras(db, monkeypatch):
+    import asyncio
+    from src.database.persistencia import PersistenciaMongo
+
+    coleccion = async_models.db._conversaciones
+    llamadas = []
+    bulk_write = coleccion.bulk_write
+
+    async def _contar(operaciones, **kw):
+        llamadas.append(len(operaciones))
+        return await bulk_write(operaciones, **kw)
+
+    monkeypatch.setattr(coleccion, "bulk_write", _contar)
+    persistencia = PersistenciaMongo(db={"_conversaciones": coleccion})
+
+    # Una pasada de update_persistence: todo en un único bulk_write
+    datos = {"nuevo_recordatorio": {"titulo": "Agua", "fecha_inicio": datetime(2025, 1, 1, 9, 0)}}
+    await asyncio.gather(
+        persistencia.update_user_data(7, datos),
+        persistencia.update_user_data(8, {}),
+        persistencia.update_conversation("conv_recordatorios", (7,), 3),
+        persistencia.update_conversation("conv_clima", (7, 7), 5))
+    await persistencia._tarea
+    assert llamadas == [3]
+
+    # Sin cambios no se vuelve a escribir; terminar la conversación la borra
+    await persistencia.update_user_data(7, datos)
+    await persistencia.update_conversation("conv_clima", (7, 7), None)
+    assert persistencia.pendientes() == 1
+    await persistencia.flush()
+    assert llamadas == [3, 1]
+
+    # Un reinicio recupera la conversación a medias
+    nueva = PersistenciaMongo(db=persistencia._db)
+    assert await nueva.get_user_data() == {7: datos}
+    assert await nueva.get_conversations("conv_recordatorios") == {(7,): 3}
+    assert await nueva.get_conversations("conv_clima") == {}
+
+
+@pytest.mark.asyncio
+async def test_persistencia_guarda_horas_y_cambios_tras_cargar(db):
+    from datetime import time
+    from src.database.persistencia import PersistenciaMongo
+
+    persistencia = PersistenciaMongo(db={"_conversaciones": async_models.db._conversaciones})
+    datos = {"provincia_diario": "Madrid", "hora_diario": time(8, 0), "x": object()}
+    await persistencia.update_user_data(7, {"provincia_diario": "Madrid", "hora_diario": time(8, 0)})
+    # Lo que BSON no puede codificar se descarta sin bloquear al resto
+    await persistencia.update_user_data(9, datos)
+    await persistencia.flush()
+    assert persistencia.pendientes() == 0
+
+    nueva = PersistenciaMongo(db=persistencia._db)
+    cargado = await nueva.get_user_data()
+    assert cargado == {7: {"provincia_diario": "Madrid", "hora_diario": time(8, 0)}}
+
+    # PTB edita el dict cargado como context.user_data: el cambio se guarda
+    cargado[7]["hora_diario"] = time(9, 30)
+    await nueva.update_user_data(7, dict(cargado[7]))
+    assert nueva.pendientes() == 1
+    await nueva.flush()
+    assert (await PersistenciaMongo(db=persistencia._db).get_user_data())[7]["hora_diario"] == time(9, 30)
+
+    # Un cambio hecho mientras se escribe el volcado no se da por guardado
+    user_data = cargado[7]
+    user_data["provincia_diario"] = "Soria"
+    await nueva.update_user_data(7, user_data)
+    user_data["provincia_diario"] = "Lugo"
+    await nueva.flush()
+    await nueva.update_user_data(7, user_data)
+    assert nueva.pendientes() == 1
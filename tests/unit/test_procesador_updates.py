@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from src.core.procesador_updates import ProcesadorPorUsuario
+
+
+def _update(user_id, chat_id=None):
+    usuario = SimpleNamespace(id=user_id)
+    chat = SimpleNamespace(id=chat_id if chat_id is not None else user_id)
+    return SimpleNamespace(effective_user=usuario, effective_chat=chat)
+
+
+@pytest.mark.asyncio
+async def test_updates_en_orden_por_usuario_y_en_paralelo_entre_usuarios():
+    procesador = ProcesadorPorUsuario(trabajadores=2, max_pendientes=100)
+    orden = []
+    simultaneos = []
+
+    async def _handler(user_id, paso, espera):
+        orden.append((user_id, paso))
+        simultaneos.append(procesador.en_curso)
+        await asyncio.sleep(espera)
+
+    tareas = [
+        asyncio.create_task(procesador.process_update(_update(1), _handler(1, 1, 0.05))),
+        # Mismo usuario desde otro chat: la conversación de recordatorios es per_chat=False
+        asyncio.create_task(procesador.process_update(_update(1, -100), _handler(1, 2, 0))),
+        asyncio.create_task(procesador.process_update(_update(2), _handler(2, 1, 0))),
+    ]
+    await asyncio.sleep(0.01)
+    # El segundo update del usuario 1 espera sin ocupar trabajador
+    assert procesador.profundidad(("usuario", 1)) == 2
+    assert procesador.estadisticas()["en_espera"] == 1
+    await asyncio.gather(*tareas)
+
+    # El usuario 2 no espera a que termine el update lento del usuario 1
+    assert orden == [(1, 1), (2, 1), (1, 2)]
+    assert max(simultaneos) == 2
+    stats = procesador.estadisticas()
+    assert stats["procesados"] == 3 and stats["profundidad_max"] == 2
+    assert procesador.profundidades() == []
+
+
+@pytest.mark.asyncio
+async def test_profundidad_de_las_colas_mas_largas_en_metricas():
+    from prometheus_client import CollectorRegistry, generate_latest
+    from src.utils.metricas import _ColectorEstado
+
+    procesador = ProcesadorPorUsuario(trabajadores=1, max_pendientes=100)
+    colector = _ColectorEstado()
+    colector.registrar("updates_profundidad", lambda: procesador.profundidades_por_puesto(3), etiqueta="puesto")
+    registro = CollectorRegistry()
+    registro.register(colector)
+    liberar = asyncio.Event()
+
+    async def _handler():
+        await liberar.wait()
+
+    tareas = [asyncio.create_task(procesador.process_update(_update(user_id), _handler()))
+              for user_id in (1, 1, 1, 2, 2, 3, 4)]
+    await asyncio.sleep(0.01)
+    assert procesador.profundidades_por_puesto(3) == {1: 3, 2: 2, 3: 1}
+    texto = generate_latest(registro).decode()
+    assert 'jbot_updates_profundidad{puesto="1"} 3.0' in texto
+    assert 'puesto="4"' not in texto and "user" not in texto
+
+    liberar.set()
+    await asyncio.gather(*tareas)
+    assert procesador.profundidades_por_puesto(3) == {1: 0, 2: 0, 3: 0}
+
+
+@pytest.mark.asyncio
+async def test_sin_mongodb_se_contesta_sin_tratar_el_update(monkeypatch):
+    from src.core import procesador_updates
+
+    monkeypatch.setattr(procesador_updates, "db_disponible", lambda: False)
+    procesador = ProcesadorPorUsuario(trabajadores=1, max_pendientes=10)
+    respuestas, tratados = [], []
+
+    async def _reply_text(texto):
+        respuestas.append(texto)
+
+    async def _handler():
+        tratados.append(1)
+
+    update = _update(1)
+    update.callback_query = None
+    update.effective_message = SimpleNamespace(reply_text=_reply_text)
+    await procesador.process_update(update, _handler())
+    assert tratados == [] and respuestas == [procesador_updates.MENSAJE_SIN_BD]
+    assert procesador.estadisticas()["rechazados_sin_bd"] == 1
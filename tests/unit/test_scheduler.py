@@ -0,0 +1,297 @@
+import pytest
+from datetime import timedelta
+from types import SimpleNamespace
+from src.scheduler.registro_jobs import RegistroJobs, TIPO_INICIO, TIPO_FIN
+
+
+def _fake_job(registro, job_id):
+    job = SimpleNamespace(job=SimpleNamespace(id=job_id), eliminado=False)
+
+    def _schedule_removal():
+        job.eliminado = True
+        registro._on_job_removed(SimpleNamespace(job_id=job_id))
+
+    job.schedule_removal = _schedule_removal
+    return job
+
+
+def test_registro_cancelar_por_record_id():
+    registro = RegistroJobs()
+    inicio = _fake_job(registro, "a")
+    fin = _fake_job(registro, "b")
+    registro.registrar("r1", TIPO_INICIO, inicio)
+    registro.registrar("r1", TIPO_FIN, fin)
+
+    assert registro.cancelar("r1") == 2
+    assert inicio.eliminado and fin.eliminado
+    assert not registro.contiene("r1")
+
+
+def test_registro_olvida_jobs_terminados():
+    registro = RegistroJobs()
+    registro.registrar("r2", TIPO_INICIO, _fake_job(registro, "c"))
+    # El scheduler emite EVENT_JOB_REMOVED cuando un run_once termina
+    registro._on_job_removed(SimpleNamespace(job_id="c"))
+    assert len(registro) == 0
+
+
+def test_next_fire_at_salta_a_la_siguiente_repeticion():
+    from datetime import datetime, timedelta, timezone
+    from src.reminders.mensaje_recordatorios import calcular_next_fire_at
+
+    ahora = datetime(2025, 3, 10, 12, 0, tzinfo=timezone.utc)
+    recordatorio = {
+        "fecha_hora_inicio": ahora - timedelta(days=3, hours=1),
+        "frecuencia": {"tipo": "diaria", "valor": None},
+        "fecha_hora_fin": None,
+    }
+    assert calcular_next_fire_at(recordatorio, ahora) == ahora + timedelta(hours=23)
+
+    recordatorio["fecha_hora_fin"] = ahora + timedelta(hours=2)
+    assert calcular_next_fire_at(recordatorio, ahora) == ahora + timedelta(hours=2)
+
+    recordatorio["fecha_hora_fin"] = ahora - timedelta(hours=1)
+    assert calcular_next_fire_at(recordatorio, ahora) is None
+
+
+@pytest.mark.asyncio
+async def test_barrido_archiva_recordatorios_terminados(db, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from src.reminders import mensaje_recordatorios
+    from src.reminders.mensaje_recordatorios import barrer_recordatorios_terminados
+
+    # MongoDB guarda las fechas naive en UTC
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.recordatorios.insert_many([
+        {"titulo": "viejo", "expira_en": ahora - timedelta(days=3), "next_fire_at": None},
+        {"titulo": "reciente", "expira_en": ahora - timedelta(hours=1), "next_fire_at": None},
+        {"titulo": "indefinido", "expira_en": None, "next_fire_at": ahora + timedelta(days=1)},
+    ])
+
+    # Con MongoDB caído (según el heartbeat) el job no espera: se lo salta
+    monkeypatch.setattr(mensaje_recordatorios, "db_disponible", lambda: False)
+    assert await barrer_recordatorios_terminados(None) == 0
+    monkeypatch.setattr(mensaje_recordatorios, "db_disponible", lambda: True)
+
+    assert await barrer_recordatorios_terminados(None) == 1
+    assert sorted(r["titulo"] for r in db.recordatorios.find()) == ["indefinido", "reciente"]
+    archivado = db.recordatorios_archivo.find_one()
+    assert archivado["titulo"] == "viejo" and "archivado_en" in archivado
+
+
+def test_expira_en_sin_frecuencia_con_fecha_fin(db):
+    from datetime import datetime, timezone
+    from src.database.migraciones import aplicar_migraciones
+    from src.reminders.mensaje_recordatorios import calcular_expira_en
+
+    inicio, fin = datetime(2025, 3, 1, 9, 0), datetime(2025, 3, 5, 18, 0)
+    sin_frecuencia = {"frecuencia": {"tipo": "ninguna", "valor": None},
+                      "fecha_hora_inicio": inicio, "fecha_hora_fin": fin, "zona_horaria": "UTC+0"}
+    # Hasta después del job de fin, no desde el de inicio
+    assert calcular_expira_en(sin_frecuencia) > calcular_expira_en(dict(sin_frecuencia, fecha_hora_fin=None))
+    assert calcular_expira_en(sin_frecuencia).tzinfo == timezone.utc
+
+    db.recordatorios.insert_many([
+        dict(sin_frecuencia, titulo="con_fin"),
+        dict(sin_frecuencia, titulo="sin_fin", fecha_hora_fin=None),
+    ])
+    aplicar_migraciones(db)
+    expira = {r["titulo"]: r["expira_en"] for r in db.recordatorios.find()}
+    assert expira == {"con_fin": fin, "sin_fin": inicio}
+
+
+class _Scheduler:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, callback, *a, **k):
+        self.listeners.append(callback)
+
+
+class _JobQueueFalso:
+    """run_once/run_repeating mínimos con el trigger que usa el snapshot."""
+
+    def __init__(self):
+        self.scheduler = _Scheduler()
+        self.creados = []
+
+    def _job(self, callback, proxima, intervalo, chat_id, name, data):
+        trigger = SimpleNamespace(interval=intervalo, run_date=proxima, start_date=proxima)
+        job = SimpleNamespace(
+            job=SimpleNamespace(id=f"{name}-{len(self.creados)}", trigger=trigger, next_run_time=proxima),
+            chat_id=chat_id, name=name, data=data, callback=callback, eliminado=False)
+
+        def _schedule_removal():
+            # Como APScheduler: EVENT_JOB_REMOVED a los listeners
+            job.eliminado = True
+            for listener in self.scheduler.listeners:
+                listener(SimpleNamespace(job_id=job.job.id))
+
+        job.schedule_removal = _schedule_removal
+        self.creados.append(job)
+        return job
+
+    def activos(self):
+        return {job.name for job in self.creados if not job.eliminado}
+
+    def run_once(self, callback, when, chat_id=None, name=None, data=None):
+        return self._job(callback, when, None, chat_id, name, data)
+
+    def run_repeating(self, callback, interval, first, chat_id=None, name=None, data=None):
+        # Como IntervalTrigger, el intervalo queda como timedelta
+        if not isinstance(interval, timedelta):
+            interval = timedelta(seconds=interval)
+        return self._job(callback, first, interval, chat_id, name, data)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restaura_y_reconcilia_solo_cambios(db, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from bson.objectid import ObjectId
+    from src.database import async_models
+    from src.scheduler import restauracion
+    from src.scheduler.snapshot import SnapshotScheduler
+    from src.reminders import mensaje_recordatorios
+
+    # MongoDB guarda milisegundos
+    ahora = datetime.now(timezone.utc).replace(microsecond=0)
+    vivo, borrado = ObjectId(), ObjectId()
+    db.recordatorios.insert_one({"_id": vivo, "creado_en": ahora - timedelta(days=10)})
+
+    # Estado antes de apagar: una repetición diaria que se perdió mientras el
+    # bot estaba parado y un fin de un recordatorio que se borró después
+    snapshot = SnapshotScheduler()
+    registro = RegistroJobs(observador=snapshot)
+    anterior = _JobQueueFalso()
+    registro.registrar(str(vivo), "rep", anterior.run_repeating(
+        None, timedelta(days=1), ahora - timedelta(hours=1), 7, f"record_rep_{vivo}",
+        {"record_id": str(vivo), "programacion": {"fecha_hora_fin": None}}))
+    registro.registrar(str(borrado), TIPO_FIN, anterior.run_once(
+        None, ahora + timedelta(hours=1), 7, f"record_fin_{borrado}", {"record_id": str(borrado)}))
+    # Suscripciones de clima: una sigue en la BD y otra se borró después
+    clima_vivo, clima_borrado = ObjectId(), ObjectId()
+    db.clima.insert_one({"_id": clima_vivo, "user_id": 7, "creado_en": ahora - timedelta(days=10)})
+    for record_id, hora in ((clima_vivo, 7), (clima_borrado, 9)):
+        snapshot.clima_agregado(str(record_id), hora, 0, {
+            "user_id": 7, "provincia": "Soria", "zona": "UTC+0", "nombre": "x"})
+    snapshot.ventana_hasta = ahora + timedelta(hours=6)
+    await snapshot.volcar(async_models.db)
+    assert snapshot.pendientes() == 0
+
+    # Recordatorio creado después del último volcado (falta en el snapshot)
+    nuevo = ObjectId()
+    db.recordatorios.insert_one({
+        "_id": nuevo, "user_id": 8, "titulo": "nuevo", "creado_en": datetime.utcnow(),
+        "fecha_hora_inicio": ahora + timedelta(hours=2), "frecuencia": {"tipo": "ninguna"},
+        "fecha_hora_fin": None, "zona_horaria": "UTC+0",
+        "next_fire_at": (ahora + timedelta(hours=2)).replace(tzinfo=None)
+    })
+
+    monkeypatch.setattr(restauracion, "get_async_db", lambda: async_models.db)
+    restaurado = SnapshotScheduler()
+    monkeypatch.setattr(restauracion, "snapshot_scheduler", restaurado)
+    job_queue = _JobQueueFalso()
+    assert await restauracion.restaurar_desde_snapshot(SimpleNamespace(job_queue=job_queue))
+
+    por_nombre = {job.name: job for job in job_queue.creados}
+    assert set(por_nombre) == {f"record_rep_{vivo}", f"record_inicio_{nuevo}", "clima_grupo_0700"}
+    # La suscripción borrada no vuelve y se quita del snapshot
+    assert restaurado._pendientes[f"clima:{clima_borrado}"] is None
+    rep = por_nombre[f"record_rep_{vivo}"]
+    assert rep.callback is mensaje_recordatorios.enviar_recordatorio_repeticion
+    assert rep.job.next_run_time == ahora + timedelta(hours=23)
+
+
+@pytest.mark.asyncio
+async def test_sincronizador_sondea_altas_ediciones_y_borrados(db):
+    from datetime import datetime, timezone
+    from bson.objectid import ObjectId
+    from src.scheduler.sincronizacion import SincronizadorPlanificador
+
+    # Documentos escritos por otro proceso (sin pasar por los handlers)
+    ahora = datetime.now(timezone.utc)
+    sincronizador = SincronizadorPlanificador(modo="sondeo")
+    sincronizador._desde = ahora
+    context = SimpleNamespace(job_queue=_JobQueueFalso())
+
+    recordatorio, suscripcion = ObjectId(), ObjectId()
+    db.recordatorios.insert_one({
+        "_id": recordatorio, "user_id": 5, "titulo": "externo", "creado_en": datetime.utcnow(),
+        "fecha_hora_inicio": ahora + timedelta(hours=3), "frecuencia": {"tipo": "ninguna"},
+        "fecha_hora_fin": None, "zona_horaria": "UTC+0"
+    })
+    db.clima.insert_one({
+        "_id": suscripcion, "user_id": 5, "nombre_usuario": "x", "provincia": "Soria",
+        "hora_config": {"hora": 8, "minuto": 0, "zona": "UTC+0"}, "creado_en": datetime.utcnow()
+    })
+
+    assert await sincronizador.sondear(context) == 2
+    # UTC+0 se trata como UTC+1 (ver timezone_from_string)
+    assert context.job_queue.activos() == {f"record_inicio_{recordatorio}", "clima_grupo_0700"}
+    # Lo ya aplicado no se vuelve a aplicar
+    assert await sincronizador.sondear(context) == 0
+
+    db.clima.update_one({"_id": suscripcion}, {"$set": {
+        "hora_config.hora": 9, "actualizado_en": datetime.utcnow() + timedelta(seconds=1)}})
+    assert await sincronizador.sondear(context) == 1
+    assert context.job_queue.activos() == {f"record_inicio_{recordatorio}", "clima_grupo_0800"}
+
+    db.recordatorios.delete_one({"_id": recordatorio})
+    db.clima.delete_one({"_id": suscripcion})
+    assert await sincronizador.comprobar_borrados(context) == 2
+    assert context.job_queue.activos() == set()
+
+
+@pytest.mark.asyncio
+async def test_particiones_se_reparten_y_se_reequilibran(db, monkeypatch):
+    from datetime import datetime, timezone
+    from src.scheduler import particiones
+    from src.scheduler.particiones import GestorParticiones
+
+    avisos = []
+
+    async def _ganar(context, particiones):
+        avisos.append((context, "gana", sorted(particiones)))
+
+    async def _perder(context, particiones):
+        avisos.append((context, "pierde", sorted(particiones)))
+
+    a = GestorParticiones(numero=4, duracion=30, worker_id="a")
+    b = GestorParticiones(numero=4, duracion=30, worker_id="b")
+    for gestor in (a, b):
+        gestor._al_ganar, gestor._al_perder = _ganar, _perder
+    liberar = particiones.liberar_particiones
+
+    async def _liberar(worker_id, sueltas):
+        avisos.append((worker_id, "libera", sorted(sueltas)))
+        return await liberar(worker_id, sueltas)
+
+    monkeypatch.setattr(particiones, "liberar_particiones", _liberar)
+
+    ahora = datetime.now(timezone.utc)
+    await a.equilibrar("a", ahora)
+    assert a.propias() == [0, 1, 2, 3]
+    assert a.es_mia(7) and a.filtro_de({3}) == {"user_id": {"$mod": [4, 3]}}
+
+    # Llega un segundo worker: 'a' cede la mitad y 'b' la toma
+    await b.equilibrar("b", ahora)
+    assert b.propias() == []
+    await a.equilibrar("a", ahora + timedelta(seconds=10))
+    await b.equilibrar("b", ahora + timedelta(seconds=10))
+    assert (a.propias(), b.propias()) == ([0, 1], [2, 3])
+    # 'a' cancela sus jobs antes de soltar el lease que 'b' va a tomar
+    assert avisos[-3:-1] == [("a", "pierde", [2, 3]), ("a", "libera", [2, 3])]
+    assert not a.es_mia(7) and b.es_mia(7)
+
+    # 'b' deja de renovar: cuando caducan sus leases 'a' las recupera
+    await a.equilibrar("a", ahora + timedelta(seconds=45))
+    assert a.propias() == [0, 1, 2, 3]
+    assert avisos[-1] == ("a", "gana", [2, 3])
+
+    # Con particiones no se vuelca el snapshot: tampoco se acumulan cambios
+    from src.scheduler.snapshot import SnapshotScheduler
+    inactivo = SnapshotScheduler(activo=False)
+    RegistroJobs(observador=inactivo).registrar("r1", TIPO_FIN, _JobQueueFalso().run_once(
+        None, ahora, 7, "record_fin_r1", {"record_id": "r1"}))
+    inactivo.clima_agregado("c1", 7, 0, {})
+    assert inactivo.pendientes() == 0
@@ -1,3 +1,5 @@
+import asyncio
+import pytest
 from src.utils.validators import validate_nickname
 from src.utils.input_sanitizer import sanitize_text
 
@@ -9,3 +11,119 @@ def test_validate_nickname_bad():
 
 def test_sanitize_removes_html():
     assert sanitize_text("<b>Hola</b>") == "bHolab"
+
+def test_cache_ttl_expira_y_expulsa_lru():
+    from src.utils.cache_ttl import CacheTTL, AUSENTE
+    ahora = [0.0]
+    cache = CacheTTL(max_entradas=2, ttl=10, reloj=lambda: ahora[0])
+    cache.guardar("a", 1)
+    cache.guardar("b", 2, ttl=100)
+    assert cache.obtener("a") == 1
+    cache.guardar("c", 3)          # expulsa "b" (la menos usada)
+    assert cache.obtener("b") is AUSENTE
+    ahora[0] = 11
+    assert cache.obtener("a") is AUSENTE   # caducada
+    stats = cache.estadisticas()
+    assert stats["expulsiones"] == 1 and stats["expiradas"] == 1 and stats["aciertos"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_comparte_peticion_en_curso():
+    from src.utils.single_flight import SingleFlight
+    vuelos = SingleFlight()
+    llamadas = []
+
+    async def _consulta():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    resultados = await asyncio.gather(
+        *(vuelos.ejecutar("madrid", _consulta) for _ in range(5)))
+    assert resultados == ["ok"] * 5
+    assert len(llamadas) == 1 and vuelos.compartidas == 4
+
+
+def _valor_metrica(nombre, **etiquetas):
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value(nombre, etiquetas) or 0
+
+
+def test_metricas_tipo_de_job():
+    from src.utils.metricas import tipo_de_job
+    assert tipo_de_job("record_inicio_65a1b2c3d4e5f60718293a4b") == "record_inicio"
+    assert tipo_de_job("clima_grupo_0700") == "clima_grupo"
+    assert tipo_de_job("volcar_snapshot") == "volcar_snapshot"
+
+
+@pytest.mark.asyncio
+async def test_metricas_callbacks_de_conversacion():
+    from types import SimpleNamespace
+    from src.utils import metricas
+
+    async def pedir_titulo(update, context):
+        return 3
+
+    handler = SimpleNamespace(callback=pedir_titulo)
+    conv = SimpleNamespace(name="conv_prueba", entry_points=[], fallbacks=[], states={1: [handler]})
+    metricas.instrumentar_conversacion(conv)
+    assert await handler.callback(None, None) == 3
+    assert _valor_metrica("jbot_handler_segundos_count", conversacion="conv_prueba", handler="pedir_titulo") == 1
+
+
+@pytest.mark.asyncio
+async def test_metricas_funciones_mongo(db):
+    from src.database import async_models
+
+    antes = _valor_metrica("jbot_mongo_segundos_count", funcion="get_user", api="async")
+    await async_models.get_user(123)
+    assert _valor_metrica("jbot_mongo_segundos_count", funcion="get_user", api="async") == antes + 1
+
+
+@pytest.mark.asyncio
+async def test_metricas_retraso_y_recuento_de_jobs():
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from src.utils import metricas
+
+    scheduler = AsyncIOScheduler(timezone=timezone.utc)
+    metricas.instrumentar_job_queue(SimpleNamespace(scheduler=scheduler))
+    lanzado = asyncio.Event()
+
+    async def _job():
+        lanzado.set()
+
+    # Un run_once sale del jobstore al lanzarse
+    scheduler.add_job(_job, "date", run_date=datetime.now(timezone.utc),
+                      name="record_fin_65a1b2c3d4e5f60718293a4b")
+    scheduler.add_job(_job, "interval", minutes=5, name="clima_precarga")
+    scheduler.start()
+    try:
+        await asyncio.wait_for(lanzado.wait(), 2)
+        await asyncio.sleep(0)
+        assert _valor_metrica("jbot_jobs_lanzados_total", tipo="record_fin") == 1
+        assert _valor_metrica("jbot_job_retraso_segundos_count", tipo="record_fin") == 1
+        assert _valor_metrica("jbot_jobs_programados", tipo="clima_precarga") == 1
+        assert _valor_metrica("jbot_jobs_programados", tipo="record_fin") == 0
+    finally:
+        scheduler.shutdown(wait=False)
+
+
+@pytest.mark.asyncio
+async def test_metricas_endpoint(monkeypatch):
+    import httpx
+    from src.utils import metricas
+
+    # Puerto 0: el sistema elige uno libre
+    monkeypatch.setitem(metricas.METRICAS_CONFIG, "activo", True)
+    monkeypatch.setitem(metricas.METRICAS_CONFIG, "listen", "127.0.0.1")
+    monkeypatch.setitem(metricas.METRICAS_CONFIG, "puerto", 0)
+    puerto = await metricas.iniciar_servidor_metricas()
+    try:
+        async with httpx.AsyncClient() as cliente:
+            resp = await cliente.get(f"http://127.0.0.1:{puerto}/metrics")
+            assert resp.status_code == 200 and "jbot_send_message_segundos_bucket" in resp.text
+            assert (await cliente.get(f"http://127.0.0.1:{puerto}/otra")).status_code == 404
+    finally:
+        await metricas.detener_servidor_metricas()